@@ -0,0 +1,134 @@
+# coding: utf-8
+'''
+本地背景图片目录索引
+
+启动时扫描一次背景图片文件夹, 之后由后台线程定期检查各图片的 mtime / 大小 (原地覆盖文件时文件夹的 mtime 不变),
+有变化时才替换索引, 渲染页面时只读取内存中的列表, 不访问文件系统
+'''
+import os
+import random
+import threading
+import zlib
+from time import time, sleep
+from urllib.parse import quote
+
+import utils as u
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+
+class BackgroundCatalog:
+    '''
+    背景图片索引
+
+    - `files`: 按文件名排序的图片列表
+    - `meta`: {文件名: {'size': 字节数, 'mtime': 修改时间, 'version': 由 mtime / 大小得出的版本号}}
+    - 两者作为一个快照整体替换, 读取时无需加锁
+    '''
+
+    def __init__(self, folder: str, check_interval: int = 10):
+        '''
+        :param folder: 背景图片文件夹 (相对于主程序目录或绝对路径)
+        :param check_interval: 检查文件夹变化的间隔 *(秒, 为 0 则不自动检查)*
+        '''
+        self.folder = u.get_path(folder)
+        self.check_interval = check_interval
+        self._snapshot = ((), (), {})  # (files, urls, meta)
+        self._signature = None
+        self.refresh(force=True)
+        if check_interval > 0:
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+
+    @property
+    def files(self) -> tuple:
+        return self._snapshot[0]
+
+    @property
+    def meta(self) -> dict:
+        return self._snapshot[2]
+
+    def __len__(self):
+        return len(self._snapshot[0])
+
+    def refresh(self, force: bool = False) -> bool:
+        '''
+        扫描文件夹, 图片列表或任一图片的 mtime / 大小变化时更新索引
+
+        :param force: 是否在没有变化时也更新
+        :return: 是否更新了索引
+        '''
+        files = []
+        meta = {}
+        exists = os.path.isdir(self.folder)
+        if exists:
+            try:
+                with os.scandir(self.folder) as it:
+                    for entry in it:
+                        if not entry.name.lower().endswith(IMAGE_EXTS):
+                            continue
+                        try:
+                            if not entry.is_file():
+                                continue
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        files.append(entry.name)
+                        meta[entry.name] = {
+                            'size': st.st_size,
+                            'mtime': st.st_mtime,
+                            'version': f'{zlib.crc32(f"{st.st_mtime_ns}:{st.st_size}".encode()):08x}'
+                        }
+            except OSError as e:
+                u.warning(f'[background] failed to scan {self.folder}: {e}')
+        files.sort()
+        signature = (exists, tuple((f, meta[f]['version']) for f in files))
+        if not force and signature == self._signature:
+            return False
+        self._signature = signature
+        # url 中带上版本号, 图片更新后 url 随之变化 (可使用长期缓存)
+        self._snapshot = (tuple(files), tuple(f'/background/{quote(f)}?v={meta[f]["version"]}' for f in files), meta)
+        if files:
+            u.info(f'[background] {len(files)} local background images loaded from {self.folder}')
+        else:
+            u.warning(f'本地背景图片文件夹 {self.folder} 不存在或没有图片文件，使用默认背景')
+        return True
+
+    def _watch(self):
+        while True:
+            sleep(self.check_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                u.warning(f'[background] refresh error: {e}')
+
+    def pick_random(self) -> str:
+        '''
+        随机选择一张图片, 返回 url (没有图片时返回 None)
+        '''
+        urls = self._snapshot[1]
+        if not urls:
+            return None
+        return urls[random.randrange(len(urls))]
+
+    def pick_index(self, index: int) -> str:
+        '''
+        选择第 `index` 张图片 (从 1 开始, 超出范围时使用边界值), 返回 url
+        '''
+        urls = self._snapshot[1]
+        if not urls:
+            return None
+        return urls[max(1, min(index, len(urls))) - 1]
+
+    def pick_rotating(self, visitor: str, interval: int) -> str:
+        '''
+        按访客轮换: 同一访客在同一时间段内总是看到同一张图片, 每过 `interval` 秒换下一张
+
+        :param visitor: 访客标识 (如 ip + User-Agent)
+        :param interval: 轮换间隔 (秒)
+        '''
+        urls = self._snapshot[1]
+        if not urls:
+            return None
+        offset = zlib.crc32(visitor.encode('utf-8'))
+        return urls[(offset + int(time() // max(1, interval))) % len(urls)]
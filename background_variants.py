@@ -0,0 +1,158 @@
+# coding: utf-8
+'''
+本地背景图片的多尺寸 / 多格式版本
+
+按需 (第一次被请求时) 在线程池中用 Pillow 生成缩小并重新编码的版本 (AVIF / WebP / JPEG),
+缓存在磁盘上, 文件名包含原图的版本号 (由 mtime / 大小得出), 原图更新后自动失效
+'''
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import utils as u
+
+# Pillow 在第一次生成图片 / 检查格式支持时才导入 (不影响启动速度)
+Image = u.lazy_import('PIL.Image')
+ImageOps = u.lazy_import('PIL.ImageOps')
+features = u.lazy_import('PIL.features')
+
+FORMATS = {
+    # 格式: (Pillow 格式名, 扩展名, mimetype, 保存参数)
+    'avif': ('AVIF', 'avif', 'image/avif', {'quality': 60}),
+    'webp': ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# 不生成版本的格式 (动图等), 直接返回原图
+SKIP_EXTS = ('.gif',)
+
+
+class BackgroundVariants:
+    '''
+    背景图片版本缓存
+    '''
+
+    def __init__(self, catalog, cache_folder: str, widths: list, workers: int = 2, wait: float = 3.0):
+        '''
+        :param catalog: `BackgroundCatalog` 实例 (用于校验文件名和读取版本号)
+        :param cache_folder: 缓存目录 (相对于主程序目录或绝对路径)
+        :param widths: 可用的宽度列表
+        :param workers: 生成图片的线程数
+        :param wait: 请求时最多等待生成多少秒, 超时则先返回原图
+        '''
+        self.catalog = catalog
+        self.cache_folder = u.get_path(cache_folder)
+        self.widths = sorted(set(int(w) for w in widths if int(w) > 0))
+        self.wait = wait
+        self._formats: list = None
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='bg-variant')
+        self._pending: dict = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_folder, exist_ok=True)
+
+    @property
+    def formats(self) -> list:
+        '''
+        可用的格式 (按优先级排列, 第一次访问时检查 Pillow 的支持情况)
+        '''
+        if self._formats is None:
+            self._formats = [f for f in ('avif', 'webp') if features.check(f)] + ['jpeg']
+        return self._formats
+
+    def pick_width(self, hint: int) -> int:
+        '''
+        选择不小于 `hint` 的最小可用宽度 (没有提示时返回最大宽度)
+        '''
+        if not self.widths:
+            return None
+        if not hint:
+            return self.widths[-1]
+        for w in self.widths:
+            if w >= hint:
+                return w
+        return self.widths[-1]
+
+    def pick_format(self, accept: str, fmt: str = None) -> str:
+        '''
+        按 `?fmt=` 参数或 Accept 请求头选择格式
+        '''
+        if fmt in self.formats:
+            return fmt
+        accept = accept or ''
+        for f in self.formats:
+            if f != 'jpeg' and f'image/{f}' in accept:
+                return f
+        return 'jpeg'
+
+    def _variant_path(self, filename: str, version: str, width: int, fmt: str) -> str:
+        key = hashlib.sha1(filename.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_folder, f'{key}-{version}-{width}.{FORMATS[fmt][1]}')
+
+    def _remove_stale(self, dst: str):
+        '''
+        删除同一原图旧版本的文件
+        '''
+        key, version = os.path.basename(dst).split('-')[:2]
+        try:
+            for name in os.listdir(self.cache_folder):
+                if name.startswith(f'{key}-') and not name.startswith(f'{key}-{version}-'):
+                    os.remove(os.path.join(self.cache_folder, name))
+        except OSError:
+            pass
+
+    def _generate(self, src: str, dst: str, width: int, fmt: str):
+        pil_fmt, _, _, params = FORMATS[fmt]
+        with Image.open(src) as im:
+            im = ImageOps.exif_transpose(im)
+            if im.width > width:
+                im = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+            if fmt == 'jpeg' or im.mode not in ('RGB', 'RGBA'):
+                im = im.convert('RGB' if fmt == 'jpeg' or 'A' not in im.mode else 'RGBA')
+            tmp = f'{dst}.{threading.get_ident()}.tmp'
+            im.save(tmp, format=pil_fmt, **params)
+        os.replace(tmp, dst)
+        self._remove_stale(dst)
+        u.debug(f'[background] generated {dst}')
+
+    def _submit(self, src: str, dst: str, width: int, fmt: str):
+        with self._lock:
+            fut = self._pending.get(dst)
+            if fut is None:
+                fut = self._pool.submit(self._generate, src, dst, width, fmt)
+                self._pending[dst] = fut
+                fut.add_done_callback(lambda _: self._drop(dst))
+        return fut
+
+    def _drop(self, dst: str):
+        with self._lock:
+            self._pending.pop(dst, None)
+
+    def resolve(self, filename: str, width_hint: int = None, accept: str = None, fmt: str = None) -> tuple:
+        '''
+        获取请求应返回的文件
+
+        :param filename: 原图文件名
+        :param width_hint: 期望宽度 (`?w=` 或 Client Hints)
+        :param accept: Accept 请求头
+        :param fmt: 指定格式 (`?fmt=`)
+        :return: (文件路径, mimetype) - 返回 None 表示应直接返回原图
+        '''
+        meta = self.catalog.meta.get(filename)
+        if meta is None or filename.lower().endswith(SKIP_EXTS):
+            return None
+        width = self.pick_width(width_hint)
+        if width is None:
+            return None
+        fmt = self.pick_format(accept, fmt)
+        dst = self._variant_path(filename, meta['version'], width, fmt)
+        if not os.path.exists(dst):
+            src = os.path.join(self.catalog.folder, filename)
+            try:
+                self._submit(src, dst, width, fmt).result(timeout=self.wait)
+            except TimeoutError:
+                return None
+            except Exception as e:
+                u.warning(f'[background] failed to generate variant for {filename}: {e}')
+                return None
+        return dst, FORMATS[fmt][2]
@@ -1,7 +1,6 @@
 # coding: utf-8
 
 import os
-import re
 import shutil
 try:
     import pytz
@@ -13,12 +12,20 @@ try:
 except Exception:
     json5 = json
 import threading
-from time import sleep
+from time import sleep, time
 from datetime import datetime, timedelta
 
 import utils as u
 import env as env
-from setting import metrics_list
+import tracing
+import device_fields
+import state_store
+from setting import settings
+
+# 用于区分 "未传入" 和 None 的默认值
+_UNSET = object()
+# 创建复制源时加锁
+_feed_lock = threading.Lock()
 
 
 class data:
@@ -28,9 +35,21 @@ class data:
     '''
     data: dict
     preload_data: dict
+    data_path: str
     data_check_interval: int = 60
+    generation: int = 0  # 设备状态的版本号, 每次变化时 +1 (用于页面片段缓存, 不保存到文件)
+    store: 'state_store.StateStore' = None  # 外部状态存储 (无服务器 / 多进程模式 / 只读副本), 为 None 时使用 data.json
+    feed: 'state_store.MemoryStore' = None  # (未使用外部存储时) 供只读副本拉取的操作日志, 第一次有副本连接时创建
+    written_seq: int = 0  # 本实例写入的最新操作序号
 
-    def __init__(self):
+    def __init__(self, data_file: str = None, store: 'state_store.StateStore' = None, compact_ops: int = 200):
+        '''
+        :param data_file: 状态文件路径 (相对于主程序目录或绝对路径, 默认为 `env.main.data_file`)
+        :param store: 外部状态存储 (无服务器 / 多进程模式), 传入时从存储加载状态, 修改写入存储
+        :param compact_ops: (使用外部存储时) 快照之后累计多少条操作时写入新的快照
+        '''
+        self.data_path = u.get_path(data_file or env.main.data_file)
+        self._save_lock = threading.Lock()
         with open(u.get_path('data.template.jsonc'), 'r', encoding='utf-8') as file:
             # json5 may be a fallback to json; json.load doesn't accept encoding param
             try:
@@ -43,12 +62,21 @@ class data:
                 except Exception:
                     self.preload_data = {}
 
-        if os.path.exists(u.get_path('data.json')):
+        if store is not None:
+            self.store = store
+            self.compact_ops = compact_ops
+            self._store_lock = threading.RLock()
+            self._pending: list = []  # 还未写入存储的操作
+            self._last_tick: float = 0
+            self.load_store()
+            return
+
+        if os.path.exists(self.data_path):
             try:
                 self.load()
             except Exception as e:
                 u.warning(f'Error when loading data: {e}, try re-create')
-                os.remove(u.get_path('data.json'))
+                os.remove(self.data_path)
                 self.data = self.preload_data
                 self.save()
                 self.load()
@@ -75,11 +103,11 @@ class data:
 
         while attempts > 0:
             try:
-                if not os.path.exists(u.get_path('data.json')):
+                if not os.path.exists(self.data_path):
                     u.warning('data.json not exist, try re-create')
                     self.data = self.preload_data
                     self.save()
-                with open(u.get_path('data.json'), 'r', encoding='utf-8') as file:
+                with open(self.data_path, 'r', encoding='utf-8') as file:
                     content = file.read()
                     if not content.strip():
                         raise ValueError('data.json is empty, possible interrupted write')
@@ -95,7 +123,7 @@ class data:
                 if attempts > 0:
                     u.warning(f'Load data error: {e}, retrying ({attempts} attempts left)')
                 else:
-                    backup_path = u.get_path('data.json.bak')
+                    backup_path = f'{self.data_path}.bak'
                     if os.path.exists(backup_path):
                         try:
                             with open(backup_path, 'r', encoding='utf-8') as file:
@@ -116,12 +144,26 @@ class data:
                     u.error(f'Load data error: {e}, reached max retry count!')
                     raise
 
+    @tracing.traced()
     def save(self):
         '''
-        保存配置
+        保存配置 (使用外部存储时只写入未保存的操作)
         '''
+        if self.store is not None:
+            self.flush()
+            return
+        self.save_file()
+
+    def save_file(self):
+        '''
+        将当前状态写入 `data.json` (请求线程与定时保存可能同时调用, 加锁避免争用同一个临时文件)
+        '''
+        with self._save_lock:
+            self._save_file()
+
+    def _save_file(self):
         try:
-            data_path = u.get_path('data.json')
+            data_path = self.data_path
             tmp_path = f"{data_path}.tmp"
             backup_path = f"{data_path}.bak"
 
@@ -152,6 +194,19 @@ class data:
         设置一个值
         '''
         self.data[name] = value
+        self.changed(name)
+
+    def touch(self, when: datetime = None):
+        '''
+        标记设备状态已变化: 更新 `last_updated` 和 `generation`
+
+        :param when: 更新时间 (默认为当前时间)
+        '''
+        if when is None:
+            when = datetime.now(pytz.timezone(env.main.timezone))
+        self.data['last_updated'] = when.strftime('%Y-%m-%d %H:%M:%S')
+        self.generation += 1
+        self.changed('last_updated')
 
     def dget(self, name, default=None):
         '''
@@ -163,6 +218,183 @@ class data:
             gotdata = default
         return gotdata
 
+    # --- External state store (serverless / multi-worker)
+
+    def _journaling(self) -> bool:
+        '''
+        是否需要记录操作 (使用可写的外部存储, 或已创建复制源时)
+        '''
+        if self.store is not None:
+            return not self.store.read_only
+        return self.feed is not None
+
+    def journal(self, op: dict):
+        '''
+        记录一条操作, 在 `flush()` 时写入存储 (未使用外部存储时直接写入复制源, 都没有时忽略)
+        '''
+        if not self._journaling():
+            return
+        if self.store is None:
+            self.written_seq = self.feed.append([op])[-1]
+            return
+        with self._store_lock:
+            self._pending.append(op)
+
+    def changed(self, *path):
+        '''
+        标记 `path` 处的值已修改 (如 `changed('device_status', device_id)`), 记录为一条 set / del 操作
+
+        :param path: 键的路径
+        '''
+        if not self._journaling():
+            return
+        node = self.data
+        for key in path:
+            if not isinstance(node, dict) or key not in node:
+                self.journal({'op': 'del', 'path': list(path)})
+                return
+            node = node[key]
+        # 复制一份, 之后的修改不影响已记录的操作
+        self.journal({'op': 'set', 'path': list(path), 'value': json.loads(json.dumps(node))})
+
+    def load_store(self):
+        '''
+        从存储加载快照, 并应用快照之后的操作
+        '''
+        with self._store_lock:
+            snapshot, self.seq = self.store.load()
+            self.snapshot_seq = self.seq
+            self.data = {**json.loads(json.dumps(self.preload_data)), **(snapshot or {})}
+            self.generation += 1
+            self.sync()
+
+    def sync(self) -> int:
+        '''
+        应用其他实例写入的新操作
+
+        :return: 应用的操作数
+        '''
+        with self._store_lock:
+            ops = self.store.read(self.seq)
+            if ops is None:
+                # 部分操作已被其他实例合并进快照
+                u.debug('[state] ops compacted by another instance, reloading snapshot')
+                self.load_store()
+                return 0
+            return self._apply(ops)
+
+    def _apply(self, ops: list, own: dict = None) -> int:
+        '''
+        按序号应用操作 (需持有锁)
+
+        :param own: 本实例刚写入的操作 {序号: 操作}: 已在本地执行过, 其中的 set / del 在日志中的位置重新执行一次
+                    (本地执行后才应用的其他实例的操作可能覆盖了它们), push / metric 跳过
+        :return: 应用的其他实例的操作数
+        '''
+        applied = 0
+        for seq, op in ops:
+            if own is not None and seq in own:
+                if op.get('op') in ('set', 'del'):
+                    state_store.apply_op(self.data, op)
+            else:
+                state_store.apply_op(self.data, op)
+                applied += 1
+            self.seq = max(self.seq, seq)
+        if applied:
+            self.generation += 1
+        return applied
+
+    def flush(self):
+        '''
+        将未保存的操作追加到存储, 操作累计过多时写入新的快照
+        '''
+        with self._store_lock:
+            ops, self._pending = self._pending, []
+            if not ops:
+                return
+            try:
+                seqs = self.store.append(ops)
+            except Exception as e:
+                u.warning(f'[state] failed to append {len(ops)} ops: {e}')
+                self._pending[:0] = ops
+                return
+            self.written_seq = max(self.written_seq, seqs[-1])
+            # 各实例的状态需与日志的顺序一致: 同一个键上后写入日志的修改生效
+            if seqs[0] == self.seq + 1:
+                # 期间没有其他实例写入, 本实例的操作排在已应用的操作之后
+                self._apply(list(zip(seqs, ops)), own=dict(zip(seqs, ops)))
+            else:
+                # 其他实例的操作排在前面: 从日志中读取后按顺序应用
+                logged = self.store.read(self.seq)
+                if logged is None:
+                    self.load_store()
+                else:
+                    self._apply(logged, own=dict(zip(seqs, ops)))
+            if max(seqs) - self.snapshot_seq >= self.compact_ops:
+                try:
+                    self.compact()
+                except Exception as e:
+                    u.warning(f'[state] compact failed: {e}')
+
+    def compact(self):
+        '''
+        同步到最新后, 将当前状态写入存储作为快照
+        '''
+        with self._store_lock:
+            self.sync()
+            if self.store.compact(self.data, self.seq):
+                u.debug(f'[state] compacted at seq {self.seq}')
+            self.snapshot_seq = self.seq
+
+    def prune(self, path: list, before: float) -> int:
+        '''
+        删除 `path` 处列表中时间早于 `before` 的记录 (无法解析时间的保留), 有删除时记录为一条 prune 操作,
+        其他实例 / 只读副本删除同样的记录
+
+        :return: 删除的记录数
+        '''
+        op = {'op': 'prune', 'path': path, 'before': before}
+        removed = state_store.apply_op(self.data, op)
+        if removed:
+            self.journal(op)
+        return removed
+
+    def open_feed(self) -> 'state_store.StateStore':
+        '''
+        获取复制源 (见 replica.py): 使用外部存储时为存储本身, 否则创建内存中的操作日志, 之后的修改同时写入其中
+        '''
+        if self.store is not None:
+            return self.store
+        with _feed_lock:
+            if self.feed is None:
+                self.feed = state_store.MemoryStore(self.data)
+                u.info('[replica] replication feed enabled')
+        return self.feed
+
+    def store_stats(self) -> dict:
+        '''
+        存储状态 (序号 / 快照序号 / 未写入的操作数)
+        '''
+        with self._store_lock:
+            return {**self.store.stats(), 'seq': self.seq, 'snapshot_seq': self.snapshot_seq, 'pending': len(self._pending)}
+
+    def tick(self, now: float = None) -> bool:
+        '''
+        无服务器模式下代替 `timer_check()`: 在请求中调用, 距上次执行超过 `data_check_interval` 秒时执行一次定时任务
+
+        :return: 是否执行了定时任务
+        '''
+        now = time() if now is None else now
+        with self._store_lock:
+            if now - self._last_tick < self.data_check_interval:
+                return False
+            self._last_tick = now
+        try:
+            self.run_timer_tasks()
+        except Exception as e:
+            u.warning(f'[tick] Error: {e}')
+        return True
+
     def _safe_parse_ts(self, value):
         try:
             dt = datetime.fromisoformat(value)
@@ -170,16 +402,9 @@ class data:
         except Exception:
             return None
 
+    @tracing.traced()
     def _extract_heart_rate(self, text: str):
-        if not text:
-            return None
-        m = re.search(r'(-?\d+(?:\.\d+)?)\s*bpm$', str(text).strip(), re.IGNORECASE)
-        if not m:
-            return None
-        try:
-            return float(m.group(1))
-        except Exception:
-            return None
+        return device_fields.parse_heart_rate(text)
 
     # --- Time helpers
 
@@ -210,6 +435,7 @@ class data:
 
     # --- Heart rate helpers
 
+    @tracing.traced()
     def record_heart_rate(self, device_id: str, heart_rate: float, when: datetime = None):
         '''记录心率数据，默认保留最近 48 小时'''
         try:
@@ -221,16 +447,10 @@ class data:
         hist = self.data.setdefault('heart_history', {})
         lst = hist.setdefault(device_id, [])
         lst.append({'time': now_dt.isoformat(), 'value': float(heart_rate)})
+        self.journal({'op': 'push', 'path': ['heart_history', device_id], 'value': lst[-1]})
 
-        cutoff = (now_dt - timedelta(hours=48)).timestamp()
-        filtered = []
-        for e in lst:
-            ts = self._safe_parse_ts(e.get('time'))
-            if ts is None:
-                continue
-            if ts >= cutoff:
-                filtered.append(e)
-        hist[device_id] = filtered
+        with tracing.span('prune'):
+            self.prune(['heart_history', device_id], (now_dt - timedelta(hours=48)).timestamp())
         try:
             self.save()
         except Exception as e:
@@ -292,9 +512,10 @@ class data:
                 'year': {},
                 'total': {}
             }
+            self.changed('metrics')
             self.record_metrics()
 
-    def get_metrics_resp(self, json_only: bool = False):
+    def get_metrics_resp(self, json_only: bool = False, extra: dict = None):
         now = datetime.now(pytz.timezone(env.main.timezone))
         '''
         if json_only:
@@ -321,7 +542,8 @@ class data:
             'today': self.data['metrics']['today'],
             'month': self.data['metrics']['month'],
             'year': self.data['metrics']['year'],
-            'total': self.data['metrics']['total']
+            'total': self.data['metrics']['total'],
+            **(extra or {})
         })
 
     def check_metrics_time(self) -> None:
@@ -342,16 +564,22 @@ class data:
             u.debug(f'[metrics] today_is changed: {self.data["metrics"]["today_is"]} -> {today_is}')
             self.data['metrics']['today_is'] = today_is
             self.data['metrics']['today'] = {}
+            self.changed('metrics', 'today_is')
+            self.changed('metrics', 'today')
         # this month
         if self.data['metrics']['month_is'] != month_is:
             u.debug(f'[metrics] month_is changed: {self.data["metrics"]["month_is"]} -> {month_is}')
             self.data['metrics']['month_is'] = month_is
             self.data['metrics']['month'] = {}
+            self.changed('metrics', 'month_is')
+            self.changed('metrics', 'month')
         # this year
         if self.data['metrics']['year_is'] != year_is:
             u.debug(f'[metrics] year_is changed: {self.data["metrics"]["year_is"]} -> {year_is}')
             self.data['metrics']['year_is'] = year_is
             self.data['metrics']['year'] = {}
+            self.changed('metrics', 'year_is')
+            self.changed('metrics', 'year')
 
     def record_metrics(self, path: str = None) -> None:
         '''
@@ -361,7 +589,7 @@ class data:
         '''
 
         # check metrics list
-        if not path in metrics_list:
+        if path not in settings.metrics_paths:
             return
 
         self.check_metrics_time()
@@ -376,10 +604,12 @@ class data:
         month[path] = month.get(path, 0) + 1
         year[path] = year.get(path, 0) + 1
         total[path] = total.get(path, 0) + 1
+        self.journal({'op': 'metric', 'key': path})
 
     # --- App usage history
 
-    def record_app_usage(self, device_id: str, app_name: str, using: bool, app_pkg: str = None, app_name_only: str = None) -> None:
+    @tracing.traced()
+    def record_app_usage(self, device_id: str, app_name: str, using: bool, app_pkg: str = None, app_name_only: str = None, heart_rate=_UNSET) -> None:
         '''
         记录设备上报的 app 使用事件（时间点事件）
         :param device_id: 设备 id
@@ -387,6 +617,7 @@ class data:
         :param using: 是否正在使用
         :param app_pkg: (可选) 应用包名或标识
         :param app_name_only: (可选) 清洗后的应用名（优先使用）
+        :param heart_rate: (可选) 已解析的心率 (None 表示没有), 不传入时从应用名中解析
         '''
         privacy_placeholder = '内容被隐藏'
         if self.data.get('private_mode'):
@@ -400,27 +631,18 @@ class data:
             now = datetime.utcnow().isoformat()
 
         # 规范化应用名：优先使用传入的 app_name_only，再尝试从原始 app_name 中提取
-        def normalize(name):
-            if not name:
-                return ''
-            # 常见 magisk 上报格式包含 "应用:" 或 "应用："
-            import re
-            m = re.search(r'[\n\r]*应用[:：]\s*(.+)$', name)
-            if m:
-                return m.group(1).strip()
-            # 若包含换行，尝试取最后一行
-            if '\n' in name:
-                last = name.split('\n')[-1].strip()
-                return last
-            return name.strip()
-
-        clean_name = (app_name_only or '').strip() or normalize(app_name)
+        clean_name = (app_name_only or '').strip() or device_fields.clean_app_name(app_name)
 
         ah = self.data.setdefault('app_history', {})
         lst = ah.setdefault(device_id, [])
         lst.append({'time': now, 'app_name': app_name or '', 'app_name_only': clean_name, 'app_pkg': app_pkg or '', 'using': bool(using)})
+        self.journal({'op': 'push', 'path': ['app_history', device_id], 'value': lst[-1]})
 
-        heart_val = self._extract_heart_rate(clean_name or app_name)
+        if heart_rate is _UNSET:
+            heart_val = self._extract_heart_rate(clean_name or app_name)
+        else:
+            # 上报时已解析过 (隐私模式下不记录)
+            heart_val = None if self.data.get('private_mode') else heart_rate
         if heart_val is not None:
             self.record_heart_rate(device_id, heart_val, when=datetime.fromisoformat(now))
 
@@ -431,22 +653,13 @@ class data:
             u.warning(f'[record_app_usage] failed to save: {e}')
 
         # 清理旧数据，仅保留最近 48 小时的记录以防增长过大
-        try:
-            cutoff = datetime.now(pytz.timezone(env.main.timezone))
-        except Exception:
-            from datetime import timezone
-            cutoff = datetime.now(timezone.utc)
-        cutoff = cutoff.timestamp() - 48 * 3600
-        newlst = []
-        for e in lst:
+        with tracing.span('prune'):
             try:
-                t = datetime.fromisoformat(e['time']).timestamp()
-                if t >= cutoff:
-                    newlst.append(e)
+                cutoff = datetime.now(pytz.timezone(env.main.timezone))
             except Exception:
-                # 如果解析失败，保守保留
-                newlst.append(e)
-        ah[device_id] = newlst
+                from datetime import timezone
+                cutoff = datetime.now(timezone.utc)
+            self.prune(['app_history', device_id], cutoff.timestamp() - 48 * 3600)
 
     def get_app_usage(self, device_id: str, hours: int = 24) -> list:
         '''
@@ -963,6 +1176,7 @@ class data:
         self.timer_thread = threading.Thread(target=self.timer_check, daemon=True)
         self.timer_thread.start()
 
+    @tracing.traced()
     def check_device_status(self, trigged_by_timer: bool = False):
         '''
         按情况自动切换状态
@@ -983,6 +1197,7 @@ class data:
                 else:
                     self.data['status'] = 1
                 if last_status != self.data['status']:
+                    self.changed('status')
                     u.debug(f'[check_device_status] 已自动切换状态 ({last_status} -> {self.data["status"]}).')
                 elif not trigged_by_timer:
                     u.debug(f'[check_device_status] 当前状态已为 {current_status}, 无需切换.')
@@ -1018,6 +1233,7 @@ class data:
                     info['offline'] = True
                     info['using'] = False
                     info['app_name'] = '超时自动离线'
+                    self.changed('device_status', device_id)
                     try:
                         # 追加一条“停止使用”事件，避免在自动离线后继续累计使用时长
                         self.record_app_usage(
@@ -1031,10 +1247,19 @@ class data:
                     changed = True
             elif info.get('offline'):
                 info['offline'] = False
+                self.changed('device_status', device_id)
                 changed = True
 
         if changed:
-            self.data['last_updated'] = now_dt.strftime('%Y-%m-%d %H:%M:%S')
+            self.touch(now_dt)
+
+    def run_timer_tasks(self):
+        '''
+        定时任务: 标记超时设备 / 跨日检测 / 自动切换状态
+        '''
+        self.mark_stale_devices_offline()  # 标记长时间未上报的设备
+        self.check_metrics_time()  # 检测是否跨日
+        self.check_device_status(trigged_by_timer=True)  # 检测设备状态并更新 status
 
     def timer_check(self):
         '''
@@ -1046,9 +1271,14 @@ class data:
         while True:
             sleep(self.data_check_interval)
             try:
-                self.mark_stale_devices_offline()  # 标记长时间未上报的设备
-                self.check_metrics_time()  # 检测是否跨日
-                self.check_device_status(trigged_by_timer=True)  # 检测设备状态并更新 status
+                if self.store is not None:
+                    # 多进程模式: 同步其他进程的修改后执行定时任务, 并定期写回 data.json
+                    self.sync()
+                    self.run_timer_tasks()
+                    self.flush()
+                    self.save_file()
+                    continue
+                self.run_timer_tasks()
                 file_data = self.load(ret=True)
                 if file_data != self.data:
                     self.save()
@@ -0,0 +1,131 @@
+# coding: utf-8
+'''
+设备上报内容的解析
+
+在 `/device/set` 收到上报时解析一次, 结果 (电量 / 设备类型 / 心率 / 清洗后的应用名) 存入 `device_status`,
+首页 / `/query` / SSE / 图片渲染直接读取这些字段, 不再各自用正则解析 `app_name`
+'''
+import re
+
+# 电量: magisk 上报 "电量:80%", 手机 "🔋80%", 电脑 "[🔋80% ...]"
+BATTERY_PATTERNS = (
+    re.compile(r'电量[:：]?\s*(\d{1,3})%'),
+    re.compile(r'🔋\s*(\d{1,3})%'),
+    re.compile(r'\[(?:🔋)?(\d{1,3})%\s*.*?\]'),
+)
+# 心率: 手表上报 "72 bpm"
+HEART_RATE_PATTERN = re.compile(r'(-?\d+(?:\.\d+)?)\s*bpm$', re.IGNORECASE)
+# 应用名: magisk 上报的多行格式中 "应用:" 后的部分
+APP_NAME_PATTERN = re.compile(r'[\n\r]*应用[:：]\s*(.+)$')
+# 设备类型 (根据显示名称判断)
+PHONE_NAME_PATTERN = re.compile(r'手机|phone|android|iphone', re.IGNORECASE)
+COMPUTER_NAME_PATTERN = re.compile(r'电脑|pc|win|mac|linux', re.IGNORECASE)
+
+PHONE_TYPE_KEYWORDS = ('phone', 'mobile', 'android', 'iphone')
+COMPUTER_TYPE_KEYWORDS = ('pc', 'win', 'mac', 'linux', 'desktop')
+
+# 解析后存入 device_status 的字段
+FIELDS = ('battery_percent', 'device_type', 'heart_rate', 'app_name_only')
+
+
+def parse_battery(text: str) -> int:
+    '''
+    从上报的应用名中解析电量百分比
+
+    :return: 0-100 的整数, 没有时返回 None
+    '''
+    if not text:
+        return None
+    for pat in BATTERY_PATTERNS:
+        m = pat.search(text)
+        if m:
+            pct = int(m.group(1))
+            if 0 <= pct <= 100:
+                return pct
+    return None
+
+
+def parse_heart_rate(text: str) -> float:
+    '''
+    从上报的应用名中解析心率 (以 `bpm` 结尾)
+
+    :return: 心率, 没有时返回 None
+    '''
+    if not text:
+        return None
+    m = HEART_RATE_PATTERN.search(str(text).strip())
+    if not m:
+        return None
+    try:
+        return float(m.group(1))
+    except ValueError:
+        return None
+
+
+def clean_app_name(name: str) -> str:
+    '''
+    清洗应用名: 取 magisk 格式中 "应用:" 后的部分, 或多行内容的最后一行
+    '''
+    if not name:
+        return ''
+    m = APP_NAME_PATTERN.search(name)
+    if m:
+        return m.group(1).strip()
+    if '\n' in name:
+        return name.split('\n')[-1].strip()
+    return name.strip()
+
+
+def detect_device_type(show_name: str, raw_type: str = None) -> str:
+    '''
+    判断设备类型
+
+    :param show_name: 设备显示名称
+    :param raw_type: 上报的类型字段 (优先使用)
+    :return: `phone` / `computer` / `''` (未知)
+    '''
+    if raw_type:
+        tt = str(raw_type).lower()
+        if any(x in tt for x in PHONE_TYPE_KEYWORDS):
+            return 'phone'
+        if any(x in tt for x in COMPUTER_TYPE_KEYWORDS):
+            return 'computer'
+        return ''
+    show_name = show_name or ''
+    if COMPUTER_NAME_PATTERN.search(show_name):
+        return 'computer'
+    if PHONE_NAME_PATTERN.search(show_name):
+        return 'phone'
+    return ''
+
+
+def parse_report(show_name: str, app_name: str, app_name_only: str = None, raw_type: str = None) -> dict:
+    '''
+    解析一次设备上报
+
+    :param show_name: 设备显示名称
+    :param app_name: 上报的应用名 (原始)
+    :param app_name_only: (可选) 客户端提供的清洗后的应用名
+    :param raw_type: (可选) 上报的设备类型
+    :return: 包含 `FIELDS` 中各字段的 dict
+    '''
+    clean = (app_name_only or '').strip() or clean_app_name(app_name)
+    heart = parse_heart_rate(clean or app_name)
+    return {
+        'battery_percent': parse_battery(app_name),
+        'device_type': detect_device_type(show_name, raw_type),
+        'heart_rate': int(heart) if heart is not None else None,
+        'app_name_only': clean
+    }
+
+
+def ensure_fields(device: dict) -> dict:
+    '''
+    为旧版本 data.json 中没有解析字段的设备补全字段 (原地修改, 只在第一次读取时解析)
+    '''
+    if all(k in device for k in FIELDS):
+        return device
+    parsed = parse_report(device.get('show_name'), device.get('app_name'), raw_type=device.get('type') or device.get('device_type'))
+    for k in FIELDS:
+        device.setdefault(k, parsed[k])
+    return device
@@ -1,136 +1,452 @@
 import os
-import requests
 import json
 import random
-from datetime import datetime
-from pathlib import Path
-
-def load_dglab_config():
-    """从DGLab.json加载配置"""
-    config_path = Path('DGLab.json')
-    
-    # 如果配置文件不存在，创建默认配置
-    if not config_path.exists():
-        default_config = {
-            "api": {
-                "url": "http://127.0.0.1:8920/api/v2/game/all/action/fire"
-            },
-            "strength": {
-                "min": 70,
-                "max": 100
-            },
-            "time": {
-                "min": 2,
-                "max": 5
-            },
-            "ui": {
-                "continuous_click": true,
-                "cooldown": {
-                    "min": 3,
-                    "max": 8
-                }
-            }
+import threading
+from time import sleep, perf_counter
+from concurrent.futures import wait as wait_futures
+
+import utils as u
+
+# requests 在第一次发送请求时才导入 (读取配置时不需要)
+requests = u.lazy_import('requests')
+
+DEFAULT_API_URL = 'http://127.0.0.1:8920/api/v2/game/all/action/fire'
+
+# 默认配置 (配置文件中缺少 / 无效的项使用此处的值)
+DEFAULT_CONFIG = {
+    "api": {
+        "url": DEFAULT_API_URL
+    },
+    "strength": {
+        "min": 70,
+        "max": 100
+    },
+    "time": {
+        "min": 2,
+        "max": 5
+    },
+    "ui": {
+        "continuous_click": True,
+        "cooldown": {
+            "min": 3,
+            "max": 8
         }
-        
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(default_config, f, ensure_ascii=False, indent=2)
-        
-        print("已创建默认DGLab.json配置文件，请根据需要修改")
-        return default_config
-    
-    # 读取配置文件
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        return config
-    except Exception as e:
-        print(f"读取DGLab.json失败: {str(e)}")
-        return None
+    },
+    "scheduler": {
+        "window": 0.5,
+        "merge": "max",
+        "global_cooldown": 1.0,
+        "client_cooldown": 1.0,
+        "client_burst": 3,
+        "max_queue": 4
+    }
+}
+
+
+def _range(raw, default: dict, name: str) -> dict:
+    """校验 {"min", "max"} 范围: 非负整数, min > max 时交换"""
+    if not isinstance(raw, dict):
+        if raw is not None:
+            u.warning(f'[dglab] {name} should be an object, using default')
+        return dict(default)
+    ret = {}
+    for k in ('min', 'max'):
+        v = raw.get(k, default[k])
+        if isinstance(v, bool) or not isinstance(v, (int, float)) or v < 0:
+            u.warning(f'[dglab] {name}.{k} should be a non-negative number, got {v!r}, using default')
+            v = default[k]
+        ret[k] = int(v)
+    if ret['min'] > ret['max']:
+        ret['min'], ret['max'] = ret['max'], ret['min']
+    return ret
+
+
+def _number(raw: dict, key: str, default, name: str, minimum=0, cast=float):
+    """校验数字项 (不小于 minimum)"""
+    v = raw.get(key, default)
+    if isinstance(v, bool) or not isinstance(v, (int, float)) or v < minimum:
+        u.warning(f'[dglab] {name}.{key} should be a number >= {minimum}, got {v!r}, using default')
+        v = default
+    return cast(v)
+
+
+def _scheduler(raw) -> dict:
+    """校验调度配置"""
+    default = DEFAULT_CONFIG['scheduler']
+    if not isinstance(raw, dict):
+        if raw is not None:
+            u.warning('[dglab] scheduler should be an object, using default')
+        raw = {}
+    merge = raw.get('merge', default['merge'])
+    if merge not in MERGE_POLICIES:
+        u.warning(f'[dglab] scheduler.merge should be one of {", ".join(MERGE_POLICIES)}, got {merge!r}, using default')
+        merge = default['merge']
+    return {
+        "window": _number(raw, 'window', default['window'], 'scheduler'),
+        "merge": merge,
+        "global_cooldown": _number(raw, 'global_cooldown', default['global_cooldown'], 'scheduler'),
+        "client_cooldown": _number(raw, 'client_cooldown', default['client_cooldown'], 'scheduler'),
+        "client_burst": _number(raw, 'client_burst', default['client_burst'], 'scheduler', minimum=1, cast=int),
+        "max_queue": _number(raw, 'max_queue', default['max_queue'], 'scheduler', minimum=1, cast=int)
+    }
+
+
+def _targets(raw, url: str) -> list:
+    """
+    校验控制器列表; 没有配置 `targets` 时使用 `api.url` 作为唯一的控制器
+    """
+    if raw is None:
+        raw = [{"name": "default", "url": url}]
+    elif not isinstance(raw, list):
+        u.warning('[dglab] targets should be a list, using api.url')
+        raw = [{"name": "default", "url": url}]
+    targets = []
+    for i, t in enumerate(raw):
+        name = f'targets[{i}]'
+        if not isinstance(t, dict):
+            u.warning(f'[dglab] {name} should be an object, skipped')
+            continue
+        t_url = t.get('url')
+        if not isinstance(t_url, str) or not t_url.startswith(('http://', 'https://')):
+            u.warning(f'[dglab] {name}.url should be a http(s) url, got {t_url!r}, skipped')
+            continue
+        targets.append({
+            "name": str(t.get('name') or f'target-{i + 1}'),
+            "url": t_url,
+            "weight": _number(t, 'weight', 1.0, name),
+            # 未设置时不限制
+            "strength": _range(t['strength'], DEFAULT_CONFIG['strength'], f'{name}.strength') if 'strength' in t else None,
+            "time": _range(t['time'], DEFAULT_CONFIG['time'], f'{name}.time') if 'time' in t else None
+        })
+    if not targets:
+        u.warning('[dglab] no valid targets, using api.url')
+        targets.append({"name": "default", "url": url, "weight": 1.0, "strength": None, "time": None})
+    return targets
+
+
+def normalize_config(raw: dict) -> dict:
+    """
+    校验配置并合并默认值
+
+    :param raw: DGLab.json 的内容
+    :return: 完整的配置 (所有项都存在且类型正确)
+    """
+    if not isinstance(raw, dict):
+        raise ValueError('DGLab.json should contain an object')
+    api = raw.get('api') if isinstance(raw.get('api'), dict) else {}
+    url = api.get('url', DEFAULT_API_URL)
+    if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        u.warning(f'[dglab] api.url should be a http(s) url, got {url!r}, using default')
+        url = DEFAULT_API_URL
+    ui = raw.get('ui') if isinstance(raw.get('ui'), dict) else {}
+    continuous_click = ui.get('continuous_click', True)
+    if not isinstance(continuous_click, bool):
+        u.warning(f'[dglab] ui.continuous_click should be true / false, got {continuous_click!r}, using default')
+        continuous_click = True
+    return {
+        "api": {
+            "url": url
+        },
+        "targets": _targets(raw.get('targets'), url),
+        "strength": _range(raw.get('strength'), DEFAULT_CONFIG['strength'], 'strength'),
+        "time": _range(raw.get('time'), DEFAULT_CONFIG['time'], 'time'),
+        "ui": {
+            "continuous_click": continuous_click,
+            "cooldown": _range(ui.get('cooldown'), DEFAULT_CONFIG['ui']['cooldown'], 'ui.cooldown')
+        },
+        "scheduler": _scheduler(raw.get('scheduler'))
+    }
+
+
+class DGLabConfig:
+    """
+    DGLab.json 配置
+
+    - 启动时读取一次, 校验并合并默认值
+    - 之后由后台线程检查文件的 mtime / 大小, 有变化时才重新读取
+    - 新配置完整解析后整体替换, 读取时无需加锁, 也不访问文件系统
+    - 修改后的文件无效时继续使用之前的配置
+    """
+
+    def __init__(self, path: str = 'DGLab.json', check_interval: int = 5):
+        """
+        :param path: 配置文件路径 (相对于主程序目录或绝对路径)
+        :param check_interval: 检查文件变化的间隔 *(秒, 为 0 则不自动检查)*
+        """
+        self.path = u.get_path(path)
+        self.check_interval = check_interval
+        self._config: dict = normalize_config(DEFAULT_CONFIG)
+        self._signature = None  # (mtime_ns, size)
+        self._lock = threading.Lock()
+        self.reloads: int = 0
+        self.refresh(force=True)
+        if check_interval > 0:
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+
+    @property
+    def config(self) -> dict:
+        """当前配置 (只读, 请勿修改)"""
+        return self._config
+
+    def _create_default(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(DEFAULT_CONFIG, f, ensure_ascii=False, indent=2)
+        u.info(f'已创建默认DGLab.json配置文件 ({self.path})，请根据需要修改')
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        文件 mtime / 大小变化时重新读取
+
+        :param force: 是否忽略 mtime / 大小强制读取
+        :return: 是否更新了配置
+        """
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                if not force:
+                    return False
+                try:
+                    self._create_default()
+                    st = os.stat(self.path)
+                except OSError as e:
+                    u.warning(f'[dglab] failed to create {self.path}: {e}, using default config')
+                    return False
+            except OSError as e:
+                u.warning(f'[dglab] failed to stat {self.path}: {e}')
+                return False
+            signature = (st.st_mtime_ns, st.st_size)
+            if not force and signature == self._signature:
+                return False
+            self._signature = signature
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    config = normalize_config(json.load(f))
+            except Exception as e:
+                u.warning(f'读取DGLab.json失败: {e}，继续使用之前的配置')
+                return False
+            self._config = config
+            self.reloads += 1
+            if not force:
+                u.info(f'[dglab] config reloaded from {self.path}')
+            return True
+
+    def _watch(self):
+        while True:
+            sleep(self.check_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                u.warning(f'[dglab] config refresh error: {e}')
+
+
+_config: DGLabConfig = None
+_config_lock = threading.Lock()
+
+
+def init_config(path: str = 'DGLab.json', check_interval: int = 5) -> DGLabConfig:
+    """
+    加载配置文件 (替换当前使用的配置)
+
+    :param path: 配置文件路径
+    :param check_interval: 检查文件变化的间隔 (秒, 为 0 则不自动检查)
+    """
+    global _config
+    with _config_lock:
+        _config = DGLabConfig(path, check_interval)
+    return _config
+
+
+def load_dglab_config() -> dict:
+    """获取当前配置 (第一次调用时从 DGLab.json 加载)"""
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = DGLabConfig()
+    return _config.config
+
 
 def get_api_url():
     """获取API URL"""
-    config = load_dglab_config()
-    if config:
-        api_url = config.get('api', {}).get('url', 'http://127.0.0.1:8920/api/v2/game/all/action/fire')
-        return api_url
+    return load_dglab_config()['api']['url']
+
+# 成功消息列表
+SUCCESS_MESSAGES = [
+    "以雷霆，击碎黑暗！",
+    "十万伏特！",
+    "此刻，寂灭之时！"
+]
+
+# 失败消息列表
+FAILURE_MESSAGES = [
+    "可恶……竟被命运束缚了手脚！",
+    "你行不行啊细狗。",
+    "杂鱼，杂鱼捏~"
+]
+
+# 默认超时 (连接, 读取), 单位秒
+DEFAULT_TIMEOUT = (3.0, 5.0)
+
+# 合并命令的方式
+MERGE_POLICIES = ('max', 'sum', 'first')
+# 单次命令的最长持续时间 (毫秒)
+MAX_TIME_MS = 30000
+
+
+def make_command(config: dict = None) -> dict:
+    """
+    按配置的范围随机生成一次开火的参数
+
+    :return: {"strength": 强度, "time": 持续时间 (毫秒)}
+    """
+    config = config or load_dglab_config()
+    strength = random.randint(config['strength']['min'], config['strength']['max'])  # 随机强度
+    time_seconds = random.randint(config['time']['min'], config['time']['max'])  # 随机持续时间（秒）
+    return {
+        "strength": strength,  # 强度，最高40
+        "time": time_seconds * 1000  # 持续时间，单位毫秒，最高30000（30秒）
+    }
+
+
+def merge_commands(commands: list, policy: str = 'max') -> dict:
+    """
+    将短时间内的多次点击合并为一次开火
+
+    :param commands: make_command() 生成的参数列表
+    :param policy: `max` (取最大强度和最长时间) / `sum` (最大强度, 时间累加, 不超过 30 秒) / `first` (只使用第一次的参数)
+    """
+    if policy == 'first' or len(commands) == 1:
+        return dict(commands[0])
+    strength = max(c['strength'] for c in commands)
+    if policy == 'sum':
+        time_ms = min(sum(c['time'] for c in commands), MAX_TIME_MS)
     else:
-        return 'http://127.0.0.1:8920/api/v2/game/all/action/fire'
+        time_ms = max(c['time'] for c in commands)
+    return {"strength": strength, "time": time_ms}
 
-def lightning_attack():
-    """雷元素攻击 - 一键开火功能"""
-    # 加载配置
-    config = load_dglab_config()
-    api_url = get_api_url()
-    
-    # 获取UI配置
-    continuous_click = config.get('ui', {}).get('continuous_click', True)
-    cooldown_min = config.get('ui', {}).get('cooldown', {}).get('min', 3)
-    cooldown_max = config.get('ui', {}).get('cooldown', {}).get('max', 8)
-    
+
+def target_command(target: dict, command: dict) -> dict:
+    """
+    按控制器的权重 / 范围调整命令: 强度乘以 `weight`, 再限制在该控制器的 `strength` / `time` 范围内
+    """
+    strength = int(round(command['strength'] * target['weight']))
+    time_ms = command['time']
+    if target['strength']:
+        strength = min(max(strength, target['strength']['min']), target['strength']['max'])
+    if target['time']:
+        time_ms = min(max(time_ms, target['time']['min'] * 1000), target['time']['max'] * 1000)
+    return {"strength": strength, "time": time_ms}
+
+
+def _send(post, target: dict, command: dict, timeout) -> dict:
+    """向单个控制器发送命令, 返回该控制器的结果"""
+    sent = target_command(target, command)
+    start = perf_counter()
+    status = None
     try:
-        # 从配置文件获取参数范围
-        strength_min = config.get('strength', {}).get('min', 70)
-        strength_max = config.get('strength', {}).get('max', 100)
-        time_min = config.get('time', {}).get('min', 2)
-        time_max = config.get('time', {}).get('max', 5)
-        
-        # 随机生成参数
-        strength = random.randint(strength_min, strength_max)  # 随机强度
-        time_seconds = random.randint(time_min, time_max)  # 随机持续时间（秒）
-        time_ms = time_seconds * 1000  # 转换为毫秒
-        
-        # 构造请求数据 - 根据API文档
-        data = {
-            "strength": strength,  # 强度，最高40
-            "time": time_ms  # 持续时间，单位毫秒，最高30000（30秒）
-        }
-        
-        # 发送请求
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        
-        response = requests.post(api_url, json=data, headers=headers)
-        
-        # 成功消息列表
-        success_messages = [
-            "以雷霆，击碎黑暗！",
-            "十万伏特！",
-            "此刻，寂灭之时！"
-        ]
-        
-        # 失败消息列表
-        failure_messages = [
-            "可恶……竟被命运束缚了手脚！",
-            "你行不行啊细狗。",
-            "杂鱼，杂鱼捏~"
-        ]
+        response = post(target['url'], json=sent, headers={'Content-Type': 'application/json'}, timeout=timeout)
+        status = response.status_code
+        error = None if status == 200 else f'HTTP {status}'
+    except requests.Timeout:
+        error = 'timeout'
+    except requests.ConnectionError:
+        error = 'connection failed'  # 不返回异常原文 (包含控制器地址)
+    except Exception as e:
+        error = type(e).__name__
+    return {
+        "name": target['name'],
+        "success": error is None,
+        "status": status,
+        "error": error,
+        "latency_ms": round((perf_counter() - start) * 1000, 1),
+        "data_sent": sent
+    }
+
+
+def _total_timeout(timeout) -> float:
+    """单个请求最长可能耗时 (连接 + 读取超时)"""
+    if isinstance(timeout, (tuple, list)):
+        return sum(t for t in timeout if t)
+    return timeout or 0
+
+
+def fire(command: dict, session=None, timeout=DEFAULT_TIMEOUT, config: dict = None, executor=None) -> dict:
+    """
+    向所有控制器发送一次开火命令
+
+    :param command: {"strength", "time"}
+    :param session: (可选) 复用连接的 requests.Session, 为 None 时使用 requests.post
+    :param timeout: 每个请求的超时 (秒), 可为 (连接超时, 读取超时)
+    :param config: (可选) 使用的配置, 为 None 时使用当前配置
+    :param executor: (可选) 有多个控制器时用于并发发送的线程池, 为 None 时依次发送
+    :return: 汇总结果, `targets` 中为每个控制器的结果, 部分失败时 `partial` 为 true
+    """
+    # 读取当前配置 (内存中的快照)
+    config = config or load_dglab_config()
+    continuous_click = config['ui']['continuous_click']
+    cooldown = config['ui']['cooldown']
+    targets = config['targets']
+    post = session.post if session is not None else requests.post
+
+    if len(targets) == 1 or executor is None:
+        results = [_send(post, t, command, timeout) for t in targets]
+    else:
+        # 并发发送, 总耗时取决于最慢的控制器 (不超过单个请求的超时)
+        futures = [executor.submit(_send, post, t, command, timeout) for t in targets]
+        wait_futures(futures, timeout=_total_timeout(timeout) + 1)
+        results = []
+        for t, f in zip(targets, futures):
+            if f.done() and f.exception() is None:
+                results.append(f.result())
+            else:
+                f.cancel()
+                results.append({"name": t['name'], "success": False, "status": None, "error": 'timeout', "latency_ms": None, "data_sent": None})
+
+    ok = sum(1 for r in results if r['success'])
+    if ok:
+        message = random.choice(SUCCESS_MESSAGES)
+        if ok < len(results):
+            message += f" ({ok}/{len(results)} 个控制器)"
         
-        if response.status_code == 200:
-            message = random.choice(success_messages)
+        # 如果不允许连续点击，计算随机冷却时间
+        cooldown_time = 0
+        if not continuous_click:
+            cooldown_time = random.randint(cooldown['min'], cooldown['max'])
             
-            # 如果不允许连续点击，计算随机冷却时间
-            cooldown_time = 0
-            if not continuous_click:
-                cooldown_time = random.randint(cooldown_min, cooldown_max)
-                
-            return {
-                "success": True, 
-                "message": message,
-                "details": f"强度: {strength}, 持续: {int(time_ms/1000)}秒",
-                "continuous_click": continuous_click,
-                "cooldown_time": cooldown_time,
-                "data_sent": {
-                    "strength": strength,
-                    "time": time_ms
-                }
-            }
-        else:
-            message = random.choice(failure_messages)
-            return {"success": False, "message": message}
-    
-    except Exception as e:
-        return {"success": False, "message": f"发生错误: {str(e)}"}
+        return {
+            "success": True, 
+            "partial": ok < len(results),
+            "message": message,
+            "details": f"强度: {command['strength']}, 持续: {int(command['time']/1000)}秒",
+            "continuous_click": continuous_click,
+            "cooldown_time": cooldown_time,
+            "data_sent": {
+                "strength": command['strength'],
+                "time": command['time']
+            },
+            "targets": results
+        }
+    errors = {r['error'] for r in results}
+    if errors == {'timeout'}:
+        message = "DG-Lab 控制器响应超时"
+    elif len(results) == 1 and not results[0]['status']:
+        message = f"发生错误: {results[0]['error']}"
+    else:
+        message = random.choice(FAILURE_MESSAGES)
+    return {"success": False, "partial": False, "message": message, "targets": results}
+
+
+def lightning_attack(session=None, timeout=DEFAULT_TIMEOUT):
+    """
+    雷元素攻击 - 一键开火功能 (立即发送, 不经过调度)
+
+    :param session: (可选) 复用连接的 requests.Session, 为 None 时使用 requests.post
+    :param timeout: 请求超时 (秒), 可为 (连接超时, 读取超时)
+    """
+    config = load_dglab_config()
+    return fire(make_command(config), session=session, timeout=timeout, config=config)
 
 # 用于Flask路由
 def handle_lightning_attack():
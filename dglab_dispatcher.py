@@ -0,0 +1,332 @@
+# coding: utf-8
+'''
+DG-Lab 控制器请求的后台调度
+
+- 使用带连接池的 `requests.Session` (keep-alive), 不再每次点击都新建 TCP 连接
+- 请求带有连接 / 读取超时, 控制器卡住时不会一直占用线程
+- 请求在小型线程池中发送, `/dglab/lightning` 立即返回任务 id, 结果通过 `/dglab/job/<id>` 查询
+- 配置了多个控制器 (`targets`) 时并发发送, 总耗时取决于最慢的控制器
+- 冷却由服务端执行: 每个访客 / 全局各有一个令牌桶, 访客点击过快时直接拒绝
+- 一个时间窗口内的多次点击合并为一次开火 (按 `DGLab.json` 中 `scheduler.merge` 合并参数),
+  全局冷却中到达的点击继续排队, 队列满时并入最后一批, 因此无论多少访客同时点击, 控制器收到的请求频率都不会超过全局冷却
+'''
+import uuid
+import threading
+from time import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import utils as u
+import dglab_api
+
+
+class Busy(Exception):
+    '''
+    排队的任务过多
+    '''
+
+
+class Cooldown(Exception):
+    '''
+    访客点击过快
+    '''
+
+    def __init__(self, retry_after: float):
+        super().__init__(f'cooling down, retry after {retry_after:.1f}s')
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    '''
+    令牌桶: 每 `cooldown` 秒补充一个令牌, 最多存 `burst` 个
+
+    速率通过参数传入 (而不是保存在桶中), 配置重新加载后立即生效
+    '''
+
+    def __init__(self, burst: int = 1):
+        self.tokens: float = float(burst)
+        self.updated: float = time()
+
+    def take(self, cooldown: float, burst: int, now: float = None) -> float:
+        '''
+        尝试取出一个令牌
+
+        :param cooldown: 补充一个令牌所需的秒数 (为 0 则不限制)
+        :param burst: 令牌上限
+        :return: 取出成功返回 0, 否则返回还需等待的秒数
+        '''
+        now = time() if now is None else now
+        if cooldown <= 0:
+            self.tokens = float(burst)
+        else:
+            self.tokens = min(float(burst), self.tokens + (now - self.updated) / cooldown)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) * cooldown
+
+
+def _percentiles(samples) -> dict:
+    if not samples:
+        return {'p50': None, 'p95': None}
+    s = sorted(samples)
+    return {
+        'p50': round(s[len(s) // 2], 1),
+        'p95': round(s[min(len(s) - 1, int(len(s) * 0.95))], 1)
+    }
+
+
+class DGLabDispatcher:
+    '''
+    DG-Lab 请求调度器
+    '''
+
+    def __init__(self, workers: int = 2, max_pending: int = 64, connect_timeout: float = 3.0, read_timeout: float = 5.0,
+                 max_jobs: int = 256, job_ttl: int = 300, max_clients: int = 4096, fanout_workers: int = 8):
+        '''
+        :param workers: 发送请求的线程数 (同时也是连接池大小)
+        :param max_pending: 最多同时有多少个未完成的任务 (含排队中的)
+        :param connect_timeout: 连接超时 (秒)
+        :param read_timeout: 读取超时 (秒)
+        :param max_jobs: 最多保留多少个任务的结果
+        :param job_ttl: 已完成任务的结果保留时间 (秒)
+        :param max_clients: 最多记录多少个访客的令牌桶
+        :param fanout_workers: 配置了多个控制器时, 同时发送的最大请求数
+        '''
+        workers = max(1, workers)
+        self.session = requests.Session()
+        fanout_workers = max(1, fanout_workers)
+        # 每个控制器 (host) 一个连接池
+        adapter = HTTPAdapter(pool_connections=fanout_workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dglab')
+        self._fanout = ThreadPoolExecutor(max_workers=fanout_workers, thread_name_prefix='dglab-fanout')
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._jobs: OrderedDict = OrderedDict()  # {id: job}
+        self._events: dict = {}  # {id: threading.Event}, 完成后移除
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._open: dict = None  # 正在收集点击的批次
+        self._queue: deque = deque()  # 等待全局冷却的批次
+        self._global = TokenBucket()
+        self._clients: OrderedDict = OrderedDict()  # {client: TokenBucket}
+        self._wait_ms: deque = deque(maxlen=256)  # 点击到开始发送的耗时
+        self._fire_ms: deque = deque(maxlen=256)  # 控制器请求耗时
+        self._closed = False
+        self.max_jobs = max_jobs
+        self.job_ttl = job_ttl
+        self.max_clients = max_clients
+        self.submitted: int = 0
+        self.fired: int = 0
+        self.succeeded: int = 0
+        self.failed: int = 0
+        self.rejected: int = 0
+        self.cooled_down: int = 0
+        self.overflowed: int = 0
+        self._thread = threading.Thread(target=self._schedule, daemon=True, name='dglab-scheduler')
+        self._thread.start()
+
+    def _prune(self, now: float):
+        '''
+        清理过期 / 超出数量的已完成任务 (需持有锁)
+        '''
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if job['status'] != 'done':
+                break  # 任务按创建顺序排列, 未完成的任务在超时后也会结束
+            if len(self._jobs) <= self.max_jobs and now - job['finished'] <= self.job_ttl:
+                break
+            self._jobs.popitem(last=False)
+
+    def _client_bucket(self, client: str, burst: int) -> TokenBucket:
+        '''
+        获取访客的令牌桶 (需持有锁)
+        '''
+        bucket = self._clients.get(client)
+        if bucket is None:
+            bucket = self._clients[client] = TokenBucket(burst)
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(client)
+        return bucket
+
+    def submit(self, client: str = '') -> dict:
+        '''
+        提交一次雷元素攻击
+
+        :param client: 访客标识 (如 ip), 用于访客冷却
+        :return: 任务信息 (副本)
+        :raise Cooldown: 访客点击过快
+        :raise Busy: 排队的任务过多
+        '''
+        config = dglab_api.load_dglab_config()
+        sch = config['scheduler']
+        now = time()
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise Busy('too many dglab jobs pending')
+        # 排队成功后才消耗访客的点击机会 (返回 Busy 时不算一次点击)
+        with self._lock:
+            wait = self._client_bucket(client, sch['client_burst']).take(sch['client_cooldown'], sch['client_burst'], now)
+            if wait > 0:
+                self.cooled_down += 1
+        if wait > 0:
+            self._slots.release()
+            raise Cooldown(wait)
+        job_id = uuid.uuid4().hex[:16]
+        job = {
+            'id': job_id,
+            'status': 'pending',
+            'created': now,
+            'finished': None,
+            'result': None
+        }
+        with self._cond:
+            self._prune(now)
+            self._jobs[job_id] = job
+            self._events[job_id] = threading.Event()
+            self.submitted += 1
+            if self._open is None:
+                self._open = {'jobs': [], 'commands': [], 'deadline': now + sch['window']}
+            self._open['jobs'].append(job_id)
+            self._open['commands'].append(dglab_api.make_command(config))
+            if sch['window'] <= 0:
+                self._seal(sch['max_queue'])  # 不合并
+            self._cond.notify()
+            return dict(job)
+
+    def _seal(self, max_queue: int):
+        '''
+        结束当前批次的收集, 放入队列; 队列已满时并入最后一批 (需持有锁)
+        '''
+        batch, self._open = self._open, None
+        if len(self._queue) >= max_queue:
+            last = self._queue[-1]
+            last['jobs'].extend(batch['jobs'])
+            last['commands'].extend(batch['commands'])
+            self.overflowed += 1
+        else:
+            self._queue.append(batch)
+
+    def _schedule(self):
+        '''
+        调度线程: 到期的批次放入队列, 全局令牌可用时发送队首的批次
+        '''
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    sch = dglab_api.load_dglab_config()['scheduler']
+                    now = time()
+                    if self._open is not None and now >= self._open['deadline']:
+                        self._seal(sch['max_queue'])
+                    timeout = None
+                    if self._queue:
+                        wait = self._global.take(sch['global_cooldown'], 1, now)
+                        if wait <= 0:
+                            batch = self._queue.popleft()
+                            break
+                        timeout = wait
+                    if self._open is not None:
+                        until = self._open['deadline'] - now
+                        timeout = until if timeout is None else min(timeout, until)
+                    self._cond.wait(timeout)
+            try:
+                self._pool.submit(self._fire, batch, sch['merge'])
+            except RuntimeError:
+                # 线程池已关闭
+                for job_id in batch['jobs']:
+                    self._finish(job_id, {'success': False, 'message': '服务正在关闭'})
+                return
+
+    def _fire(self, batch: dict, policy: str):
+        start = time()
+        with self._lock:
+            for job_id in batch['jobs']:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job['status'] = 'running'
+                    self._wait_ms.append((start - job['created']) * 1000)
+        try:
+            command = dglab_api.merge_commands(batch['commands'], policy)
+            result = dglab_api.fire(command, session=self.session, timeout=self.timeout, executor=self._fanout)
+        except Exception as e:
+            u.warning(f'[dglab] fire error: {e}')
+            result = {'success': False, 'message': f'发生错误: {str(e)}'}
+        result['coalesced'] = len(batch['jobs'])
+        with self._lock:
+            self.fired += 1
+            self._fire_ms.append((time() - start) * 1000)
+        for job_id in batch['jobs']:
+            self._finish(job_id, dict(result))
+
+    def _finish(self, job_id: str, result: dict):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job['status'] = 'done'
+                job['finished'] = time()
+                job['result'] = result
+            if result.get('success'):
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            event = self._events.pop(job_id, None)
+        self._slots.release()
+        if event is not None:
+            event.set()
+
+    def get(self, job_id: str, wait: float = 0) -> dict:
+        '''
+        获取任务状态
+
+        :param job_id: 任务 id
+        :param wait: 任务未完成时最多等待多少秒 (长轮询)
+        :return: 任务信息 (副本), 不存在时返回 None
+        '''
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            event = self._events.get(job_id)
+        if event is not None and wait > 0:
+            event.wait(wait)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'pending': len(self._events),
+                'open_batch': len(self._open['jobs']) if self._open else 0,
+                'queued_batches': len(self._queue),
+                'submitted': self.submitted,
+                'fired': self.fired,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'cooled_down': self.cooled_down,
+                'overflowed': self.overflowed,
+                'wait_ms': _percentiles(self._wait_ms),
+                'fire_ms': _percentiles(self._fire_ms)
+            }
+
+    def shutdown(self):
+        '''
+        停止接受新任务, 关闭连接池
+        '''
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._pool.shutdown(wait=False)
+        self._fanout.shutdown(wait=False)
+        self.session.close()
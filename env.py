@@ -2,10 +2,13 @@
 import os
 from dotenv import load_dotenv
 
-from _utils import tobool, get_path
+from _utils import tobool, get_path, current_dir
 
 load_dotenv(dotenv_path=get_path('.env'))
 
+# 是否运行在 Vercel 上 (与 _utils.get_path 的判断一致)
+_on_vercel: bool = current_dir().startswith('/var/task') or os.getenv('VERCEL') == '1'
+
 
 def getenv(key: str, default: any, typeobj: object) -> any:
     '''
@@ -33,10 +36,22 @@ class _main:
     debug: bool = getenv('sleepy_main_debug', False, bool)
     timezone: str = getenv('sleepy_main_timezone', 'Asia/Shanghai', str)
     checkdata_interval: int = getenv('sleepy_main_checkdata_interval', 30, int)
+    data_file: str = getenv('sleepy_main_data_file', 'data.json', str)
     secret: str = getenv('sleepy_secret', '', str)
     https_enabled: bool = getenv('sleepy_main_https_enabled', False, bool)
     ssl_cert: str = getenv('sleepy_main_ssl_cert', 'cert.pem', str)
     ssl_key: str = getenv('sleepy_main_ssl_key', 'key.pem', str)
+    # 是否部署在反向代理之后: 开启时使用代理添加的 X-Forwarded-For 识别访客 (如 DG-Lab 的访客冷却), 否则使用连接地址
+    trusted_proxy: bool = getenv('sleepy_main_trusted_proxy', False, bool)
+    # 无服务器模式: 状态保存在外部存储 (快照 + 追加的操作), 定时任务在请求中按经过的时间执行
+    serverless: bool = getenv('sleepy_main_serverless', _on_vercel, bool)
+    state_store: str = getenv('sleepy_main_state_store', 'file:/tmp/sleepy_state' if _on_vercel else 'file:data.state', str)
+    state_compact_ops: int = getenv('sleepy_main_state_compact_ops', 200, int)
+    # 多进程模式 (start.py): 工作进程数, 大于 1 时进程之间通过 state_store 共享状态
+    workers: int = getenv('sleepy_main_workers', 1, int)
+    # 只读副本: 主实例地址 (如 http://primary:9010), 设置后从主实例同步状态; 修改状态的请求转发到主实例 (proxy) 或拒绝 (reject)
+    replica_of: str = getenv('sleepy_main_replica_of', '', str)
+    replica_writes: str = getenv('sleepy_main_replica_writes', 'proxy', str)
 
 
 class _page:
@@ -52,6 +67,13 @@ class _page:
     background_folder: str = getenv('sleepy_page_background_folder', './background', str)
     background_random: bool = getenv('sleepy_page_background_random', True, bool)
     background_index: int = getenv('sleepy_page_background_index', 1, int)
+    background_rotate_interval: int = getenv('sleepy_page_background_rotate_interval', 0, int)
+    background_check_interval: int = getenv('sleepy_page_background_check_interval', 10, int)
+    background_variants: bool = getenv('sleepy_page_background_variants', True, bool)
+    background_variant_widths: str = getenv('sleepy_page_background_variant_widths', '720,1080,1440,2160', str)
+    background_cache_folder: str = getenv('sleepy_page_background_cache_folder', '.cache/background', str)
+    # 社交平台预览图 (/og.png) 最短重新生成间隔 (秒)
+    og_image_interval: int = getenv('sleepy_page_og_image_interval', 60, int)
     learn_more: str = getenv('sleepy_page_learn_more', 'GitHub Repo', str)
     repo: str = getenv('sleepy_page_repo', 'https://github.com/sleepy-project/sleepy', str)
     more_text: str = getenv('sleepy_page_more_text', '', str)
@@ -86,6 +108,21 @@ class _util:
     steam_enabled: bool = getenv('sleepy_util_steam_enabled', False, bool)
     steam_ids: str = getenv('sleepy_util_steam_ids', '', str)
     steam_refresh_interval: int = getenv('sleepy_util_steam_refresh_interval', 20000, int)
+    # 请求耗时追踪 (采样率 0-1, 为 0 则关闭)
+    trace_sample_rate: float = getenv('sleepy_util_trace_sample_rate', 0.01, float)
+    trace_ring_size: int = getenv('sleepy_util_trace_ring_size', 200, int)
+    trace_file: str = getenv('sleepy_util_trace_file', '', str)
+    # 设备状态图片 (/device/image.png)
+    image_workers: int = getenv('sleepy_util_image_workers', 2, int)
+    image_cache_size: int = getenv('sleepy_util_image_cache_size', 64, int)
+    # DG-Lab 控制器请求 (线程数 / 连接超时 / 读取超时)
+    dglab_workers: int = getenv('sleepy_util_dglab_workers', 2, int)
+    dglab_connect_timeout: float = getenv('sleepy_util_dglab_connect_timeout', 3.0, float)
+    dglab_read_timeout: float = getenv('sleepy_util_dglab_read_timeout', 5.0, float)
+    # DGLab.json 变化检查间隔 (秒, 为 0 则不自动重新加载)
+    dglab_config_check_interval: int = getenv('sleepy_util_dglab_config_check_interval', 5, int)
+    # setting/ 目录下设置文件的变化检查间隔 (秒, 为 0 则不自动重新加载)
+    setting_check_interval: int = getenv('sleepy_util_setting_check_interval', 5, int)
 
 
 main = _main()
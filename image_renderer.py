@@ -6,15 +6,22 @@ produce lightweight server-side images without adding heavy browser runtimes.
 """
 from __future__ import annotations
 
+import hashlib
+import json
 import os
 import re
-from datetime import datetime
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
 from io import BytesIO
-from typing import Dict, Iterable, List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import pytz
 from PIL import Image, ImageDraw, ImageFont
 
+import device_fields
+
 # basic colors
 BG_COLOR = (15, 17, 21)
 CARD_COLOR = (23, 26, 34)
@@ -42,33 +49,56 @@ FONT_CANDIDATES_BOLD = [
 ]
 
 
-def _load_font(size: int, bold: bool = False) -> ImageFont.FreeTypeFont:
-    candidates = FONT_CANDIDATES_BOLD if bold else FONT_CANDIDATES
-    for path in candidates:
+# process-wide caches: font files are probed once per weight, each (size, bold)
+# font object is created once, and text measurements are memoized
+_FONT_PATHS: Dict[bool, Optional[str]] = {}
+_FONT_CACHE: Dict[Tuple[int, bool], ImageFont.ImageFont] = {}
+_FONT_LOCK = threading.Lock()
+
+# fixed strings drawn on every card, measured once per font
+FIXED_LABELS = ("设备类型", "系统平台", "当前运行应用", "应用状态", "最近活跃时间", "电量", "—")
+
+
+def _find_font_path(bold: bool) -> Optional[str]:
+    """Return the first usable font file (the filesystem is only probed on the first call)."""
+    if bold in _FONT_PATHS:
+        return _FONT_PATHS[bold]
+    found = None
+    for path in FONT_CANDIDATES_BOLD if bold else FONT_CANDIDATES:
         if os.path.exists(path):
             try:
-                return ImageFont.truetype(path, size)
+                ImageFont.truetype(path, 12)
             except Exception:
                 continue
-    return ImageFont.load_default()
-
-
-def _parse_battery_from_text(text: str) -> Optional[int]:
-    matchers = [
-        r"电量[:：]?\s*(\d{1,3})%",
-        r"🔋\s*(\d{1,3})%",
-        r"\[(?:🔋)?(\d{1,3})%\s*.*?\]",
-    ]
-    for pat in matchers:
-        m = re.search(pat, text)
-        if m:
+            found = path
+            break
+    _FONT_PATHS[bold] = found
+    return found
+
+
+def _load_font(size: int, bold: bool = False) -> ImageFont.ImageFont:
+    key = (size, bold)
+    font = _FONT_CACHE.get(key)
+    if font is not None:
+        return font
+    with _FONT_LOCK:
+        font = _FONT_CACHE.get(key)
+        if font is None:
+            path = _find_font_path(bold)
             try:
-                pct = int(m.group(1))
-                if 0 <= pct <= 100:
-                    return pct
+                font = ImageFont.truetype(path, size) if path else ImageFont.load_default()
             except Exception:
-                continue
-    return None
+                font = ImageFont.load_default()
+            _FONT_CACHE[key] = font
+    return font
+
+
+def clear_font_cache() -> None:
+    """Drop cached fonts and text measurements (e.g. after installing new fonts)."""
+    with _FONT_LOCK:
+        _FONT_PATHS.clear()
+        _FONT_CACHE.clear()
+    _text_size.cache_clear()
 
 
 def _normalize_device_type(raw: Optional[str]) -> str:
@@ -148,7 +178,8 @@ def build_device_view_models(devices: Dict[str, dict], timezone: str) -> List[di
         platform = info.get("platform") or info.get("os") or info.get("system")
         online_status = _normalize_online_status(info.get("online_status") or info.get("online"), info)
         app_status = _normalize_app_status(info.get("app_status"), info)
-        app_name = info.get("app_name") or info.get("app") or "—"
+        # prefer the fields parsed at report time (see device_fields)
+        app_name = info.get("app_name_only") or info.get("app_name") or info.get("app") or "—"
         last_active = _format_last_active(
             info.get("last_active") or info.get("last_seen") or info.get("last_online"), tz
         )
@@ -156,7 +187,7 @@ def build_device_view_models(devices: Dict[str, dict], timezone: str) -> List[di
         if battery is None:
             battery = info.get("battery")
         if battery is None:
-            battery = _parse_battery_from_text(app_name if app_name else "")
+            battery = device_fields.parse_battery(info.get("app_name") or "")
         try:
             if battery is not None:
                 battery = max(0, min(100, int(battery)))
@@ -178,10 +209,10 @@ def build_device_view_models(devices: Dict[str, dict], timezone: str) -> List[di
     return models
 
 
-def _measure_text(draw: ImageDraw.ImageDraw, text: str, font):
-    """兼容 Pillow 版本的文本测量工具。"""
+@lru_cache(maxsize=4096)
+def _text_size(text: str, font) -> Tuple[int, int]:
     try:
-        bbox = draw.textbbox((0, 0), text, font=font)
+        bbox = font.getbbox(text)
         return bbox[2] - bbox[0], bbox[3] - bbox[1]
     except Exception:
         pass
@@ -191,14 +222,23 @@ def _measure_text(draw: ImageDraw.ImageDraw, text: str, font):
         return (0, 0)
 
 
+def _measure_text(draw: ImageDraw.ImageDraw, text: str, font) -> Tuple[int, int]:
+    """Measure text across Pillow versions (memoized per (text, font))."""
+    return _text_size(text, font)
+
+
+def warm_up() -> None:
+    """Preload the fonts in use and measure the fixed labels so the first render is not slowed down."""
+    for size, bold in ((22, True), (14, True), (13, False), (15, False), (15, True)):
+        font = _load_font(size, bold)
+        for label in FIXED_LABELS + tuple(STATUS_COLORS):
+            _text_size(label, font)
+
+
 def _draw_status_badge(draw: ImageDraw.ImageDraw, text: str, xy, font):
     color = STATUS_COLORS.get(text, (90, 96, 108))
     x1, y1 = xy
     text_w, text_h = _measure_text(draw, text, font)
-def _draw_status_badge(draw: ImageDraw.ImageDraw, text: str, xy, font):
-    color = STATUS_COLORS.get(text, (90, 96, 108))
-    x1, y1 = xy
-    text_w, text_h = draw.textsize(text, font=font)
     padding_x = 14
     padding_y = 8
     rect = [x1, y1, x1 + text_w + padding_x * 2, y1 + text_h + padding_y * 2]
@@ -215,85 +255,417 @@ def _draw_info_block(draw: ImageDraw.ImageDraw, pos, label: str, value: str, lab
 
 def _draw_battery(draw: ImageDraw.ImageDraw, pos, percent: Optional[int]):
     x, y = pos
+    label_font = _load_font(13)
     if percent is None:
-        draw.text((x, y), "电量", font=_load_font(13), fill=LABEL_COLOR)
+        draw.text((x, y), "电量", font=label_font, fill=LABEL_COLOR)
         draw.text((x, y + 18), "—", font=_load_font(15), fill=TEXT_COLOR)
         return
-    draw.text((x, y), "电量", font=_load_font(13), fill=LABEL_COLOR)
+    draw.text((x, y), "电量", font=label_font, fill=LABEL_COLOR)
     draw.rounded_rectangle([x, y + 26, x + 200, y + 48], radius=8, outline=BORDER_COLOR, width=2, fill=(29, 33, 42))
     inner_width = int(196 * percent / 100)
     draw.rounded_rectangle([x + 2, y + 28, x + 2 + inner_width, y + 46], radius=6, fill=(52, 152, 219))
     draw.text((x + 210, y + 24), f"{percent}%", font=_load_font(15, bold=True), fill=TEXT_COLOR)
 
 
-def render_device_usage_image(devices: Iterable[dict]) -> BytesIO:
-    device_list = list(devices)
-    if not device_list:
-        device_list = [
-            {
-                "name": "暂无设备",
-                "type": "其他",
-                "platform": "—",
-                "online_status": "—",
-                "current_app": "—",
-                "app_status": "—",
-                "last_active": "—",
-                "battery_percent": None,
-            }
-        ]
-
-    width = 1200
-    card_height = 210
-    margin = 32
-    spacing = 18
-    canvas_height = margin + len(device_list) * (card_height + spacing) + margin
-    img = Image.new("RGB", (width, canvas_height), BG_COLOR)
-    draw = ImageDraw.Draw(img)
+# layout
+CANVAS_WIDTH = 1200
+CARD_HEIGHT = 210
+MARGIN = 32
+SPACING = 18
+CARD_WIDTH = CANVAS_WIDTH - MARGIN * 2
+
+EMPTY_DEVICE = {
+    "name": "暂无设备",
+    "type": "其他",
+    "platform": "—",
+    "online_status": "—",
+    "current_app": "—",
+    "app_status": "—",
+    "last_active": "—",
+    "battery_percent": None,
+}
+
+# pre-rendered card tiles keyed by the card's view model, and blank canvases
+# keyed by card count; only cards whose view model changed are re-rasterized
+_TILE_CACHE: "OrderedDict[str, Image.Image]" = OrderedDict()
+_TILE_CACHE_SIZE = 256
+_CANVAS_CACHE: Dict[int, Image.Image] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def _card_key(device: dict) -> str:
+    raw = json.dumps(device, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _draw_card(device: dict) -> Image.Image:
+    """Draw a single device card (coordinates relative to the card's top-left corner)."""
+    tile = Image.new("RGB", (CARD_WIDTH + 1, CARD_HEIGHT + 1), BG_COLOR)
+    draw = ImageDraw.Draw(tile)
 
     title_font = _load_font(22, bold=True)
     tag_font = _load_font(14, bold=True)
     label_font = _load_font(13)
     value_font = _load_font(15, bold=True)
 
-    card_width = width - margin * 2
+    # card background
+    draw.rounded_rectangle([0, 0, CARD_WIDTH, CARD_HEIGHT], radius=14, fill=CARD_COLOR, outline=BORDER_COLOR)
+
+    # header row
+    name = str(device.get("name", "—"))
+    draw.text((22, 18), name, font=title_font, fill=TEXT_COLOR)
+    _draw_status_badge(draw, device.get("online_status", "—"), (CARD_WIDTH - 150, 12), tag_font)
+
+    # info grid
+    info_items = [
+        ("设备类型", device.get("type", "—")),
+        ("系统平台", device.get("platform", "—")),
+        ("当前运行应用", device.get("current_app", "—")),
+        ("应用状态", device.get("app_status", "—")),
+        ("最近活跃时间", device.get("last_active", "—")),
+    ]
+    grid_left = 22
+    grid_top = 64
+    col_width = (CARD_WIDTH - 44 - 18) // 2
+    for i, (label, value) in enumerate(info_items):
+        col = i % 2
+        row = i // 2
+        x = grid_left + col * (col_width + 18)
+        y = grid_top + row * 52
+        _draw_info_block(draw, (x, y), label, str(value or "—"), label_font, value_font)
+
+    # battery row spans width
+    _draw_battery(draw, (grid_left, CARD_HEIGHT - 60), device.get("battery_percent"))
+    return tile
+
+
+def _get_card(device: dict) -> Image.Image:
+    key = _card_key(device)
+    with _CACHE_LOCK:
+        tile = _TILE_CACHE.get(key)
+        if tile is not None:
+            _TILE_CACHE.move_to_end(key)
+            return tile
+    tile = _draw_card(device)
+    with _CACHE_LOCK:
+        _TILE_CACHE[key] = tile
+        while len(_TILE_CACHE) > _TILE_CACHE_SIZE:
+            _TILE_CACHE.popitem(last=False)
+    return tile
+
+
+def _get_canvas(count: int) -> Image.Image:
+    """Return a blank canvas (a copy) with room for `count` cards."""
+    base = _CANVAS_CACHE.get(count)
+    if base is None:
+        height = MARGIN + count * (CARD_HEIGHT + SPACING) + MARGIN
+        base = Image.new("RGB", (CANVAS_WIDTH, height), BG_COLOR)
+        with _CACHE_LOCK:
+            if len(_CANVAS_CACHE) > 32:
+                _CANVAS_CACHE.clear()
+            _CANVAS_CACHE[count] = base
+    return base.copy()
+
+
+def clear_tile_cache() -> None:
+    """Drop the cached cards and canvases."""
+    with _CACHE_LOCK:
+        _TILE_CACHE.clear()
+        _CANVAS_CACHE.clear()
+
+
+def compose_device_usage_image(devices: Iterable[dict]) -> Image.Image:
+    """Paste the device cards into one image (unchanged cards come from the cache)."""
+    device_list = list(devices) or [EMPTY_DEVICE]
+    img = _get_canvas(len(device_list))
     for idx, device in enumerate(device_list):
-        top = margin + idx * (card_height + spacing)
-        left = margin
-        # card background
-        draw.rounded_rectangle(
-            [left, top, left + card_width, top + card_height], radius=14, fill=CARD_COLOR, outline=BORDER_COLOR
-        )
+        top = MARGIN + idx * (CARD_HEIGHT + SPACING)
+        img.paste(_get_card(device), (MARGIN, top))
+    return img
 
-        # header row
-        name = str(device.get("name", "—"))
-        draw.text((left + 22, top + 18), name, font=title_font, fill=TEXT_COLOR)
-        badge_x = left + card_width - 150
-        badge_y = top + 12
-        _draw_status_badge(draw, device.get("online_status", "—"), (badge_x, badge_y), tag_font)
-
-        # info grid
-        info_items = [
-            ("设备类型", device.get("type", "—")),
-            ("系统平台", device.get("platform", "—")),
-            ("当前运行应用", device.get("current_app", "—")),
-            ("应用状态", device.get("app_status", "—")),
-            ("最近活跃时间", device.get("last_active", "—")),
-        ]
-        grid_left = left + 22
-        grid_top = top + 64
-        col_width = (card_width - 44 - 18) // 2
-        for i, (label, value) in enumerate(info_items):
-            col = i % 2
-            row = i // 2
-            x = grid_left + col * (col_width + 18)
-            y = grid_top + row * 52
-            _draw_info_block(draw, (x, y), label, str(value or "—"), label_font, value_font)
-
-        # battery row spans width
-        battery_y = top + card_height - 60
-        _draw_battery(draw, (grid_left, battery_y), device.get("battery_percent"))
 
+# output formats: the layout only has a few flat colors plus anti-aliased
+# text, so a 64-color palette PNG or lossless WebP is much smaller than RGB PNG
+IMAGE_FORMATS = {
+    "png": "image/png",
+    "webp": "image/webp",
+}
+IMAGE_SCALES = (0.5, 1.0, 2.0)
+PALETTE_COLORS = 64
+
+
+def encode_image(img: Image.Image, fmt: str = "png", scale: float = 1.0) -> bytes:
+    """
+    Encode an image.
+
+    :param fmt: `png` (palette PNG) / `webp` (lossless WebP)
+    :param scale: one of `IMAGE_SCALES`, applied by resampling
+    """
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"unsupported image format: {fmt}")
+    if scale not in IMAGE_SCALES:
+        raise ValueError(f"unsupported image scale: {scale}")
+    if scale != 1.0:
+        img = img.resize((round(img.width * scale), round(img.height * scale)), Image.LANCZOS)
     buffer = BytesIO()
-    img.save(buffer, format="PNG")
+    if fmt == "webp":
+        img.save(buffer, format="WEBP", lossless=True, quality=100, method=4)
+    else:
+        pal = img.quantize(colors=PALETTE_COLORS, method=Image.Quantize.FASTOCTREE)
+        pal.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def render_device_usage_image(devices: Iterable[dict], fmt: str = "png", scale: float = 1.0) -> BytesIO:
+    img = compose_device_usage_image(devices)
+    buffer = BytesIO(encode_image(img, fmt, scale))
     buffer.seek(0)
     return buffer
+
+
+# --- charts
+
+CHART_WIDTH = 800
+CHART_HEIGHT = 320
+CHART_PADDING = (56, 40, 24, 44)  # left, top, right, bottom
+CHART_COLORS = [
+    (21, 112, 239), (46, 125, 50), (108, 92, 231), (255, 112, 67),
+    (2, 136, 209), (142, 36, 170), (3, 169, 244),
+]
+BAR_COLOR = (52, 152, 219)
+HEART_COLOR = (231, 76, 60)
+GRID_COLOR = (36, 40, 50)
+
+
+def _chart_canvas(title: str):
+    img = Image.new("RGB", (CHART_WIDTH, CHART_HEIGHT), CARD_COLOR)
+    draw = ImageDraw.Draw(img)
+    draw.text((CHART_PADDING[0], 10), title, font=_load_font(15, bold=True), fill=TEXT_COLOR)
+    return img, draw
+
+
+def _plot_area():
+    left, top, right, bottom = CHART_PADDING
+    return left, top, CHART_WIDTH - right, CHART_HEIGHT - bottom
+
+
+def _draw_empty(draw: ImageDraw.ImageDraw, text: str = "暂无数据"):
+    font = _load_font(15)
+    w, h = _measure_text(draw, text, font)
+    draw.text(((CHART_WIDTH - w) // 2, (CHART_HEIGHT - h) // 2), text, font=font, fill=MUTED_COLOR)
+
+
+def hour_keys(hours: int, timezone: str, now: Optional[datetime] = None) -> List[str]:
+    """Hour keys in the window, oldest first (same 'YYYY-MM-DD HH:00' format as `hourly_seconds`)."""
+    tz = pytz.timezone(timezone) if timezone else pytz.UTC
+    now = now or datetime.now(tz)
+    end = now.replace(minute=0, second=0, microsecond=0)
+    keys = []
+    for i in range(hours - 1, -1, -1):
+        keys.append(tz.normalize(end - timedelta(hours=i)).strftime("%Y-%m-%d %H:00"))
+    return keys
+
+
+def render_hourly_chart(hourly_seconds: Dict[str, int], keys: List[str]) -> Image.Image:
+    """Bar chart of usage minutes per hour."""
+    img, draw = _chart_canvas("每小时使用时长")
+    left, top, right, bottom = _plot_area()
+    values = [min(3600, hourly_seconds.get(k, 0)) / 60 for k in keys]
+    if not keys or not any(values):
+        _draw_empty(draw)
+        return img
+    label_font = _load_font(13)
+    # y grid: 0 / 30 / 60 minutes
+    for minutes in (0, 30, 60):
+        y = bottom - (bottom - top) * minutes / 60
+        draw.line([left, y, right, y], fill=GRID_COLOR)
+        draw.text((left - 40, y - 8), f"{minutes}m", font=label_font, fill=LABEL_COLOR)
+    slot = (right - left) / len(keys)
+    bar_w = max(1, slot * 0.7)
+    label_every = max(1, len(keys) // 8)
+    for i, (key, val) in enumerate(zip(keys, values)):
+        x = left + i * slot + (slot - bar_w) / 2
+        if val > 0:
+            draw.rectangle([x, bottom - (bottom - top) * val / 60, x + bar_w, bottom], fill=BAR_COLOR)
+        if i % label_every == 0:
+            draw.text((x, bottom + 8), key[-5:], font=label_font, fill=LABEL_COLOR)
+    return img
+
+
+def downsample_series(points: List[tuple], buckets: int) -> List[tuple]:
+    """
+    Split an (x, y) series into `buckets` equal x ranges and keep the min and max
+    point of each (in original order), so spikes survive while at most
+    2 * buckets points are drawn.
+    """
+    if len(points) <= buckets * 2:
+        return list(points)
+    x0, x1 = points[0][0], points[-1][0]
+    span = (x1 - x0) or 1
+    out = []
+    cur, lo, hi = None, None, None
+    for p in points:
+        b = min(buckets - 1, int((p[0] - x0) * buckets / span))
+        if b != cur:
+            if cur is not None:
+                out.extend(sorted({lo, hi}, key=lambda q: q[0]))
+            cur, lo, hi = b, p, p
+        else:
+            if p[1] < lo[1]:
+                lo = p
+            if p[1] > hi[1]:
+                hi = p
+    out.extend(sorted({lo, hi}, key=lambda q: q[0]))
+    return out
+
+
+def render_heart_rate_chart(samples: List[dict], window_start: float, window_end: float) -> Image.Image:
+    """
+    Heart rate line chart.
+
+    :param samples: [{'time': timestamp or iso string, 'value': bpm}, ...] sorted by time
+    """
+    img, draw = _chart_canvas("心率")
+    left, top, right, bottom = _plot_area()
+    points = []
+    for s in samples:
+        t = s.get("time")
+        if isinstance(t, str):
+            try:
+                t = datetime.fromisoformat(t).timestamp()
+            except ValueError:
+                continue
+        points.append((float(t), float(s.get("value"))))
+    if not points:
+        _draw_empty(draw, "暂无心率数据")
+        return img
+    points = downsample_series(points, right - left)
+    values = [p[1] for p in points]
+    vmin, vmax = min(values), max(values)
+    # 10 bpm of headroom above and below
+    vmin, vmax = max(0, vmin - 10), vmax + 10
+    label_font = _load_font(13)
+    for v in (vmin, (vmin + vmax) / 2, vmax):
+        y = bottom - (bottom - top) * (v - vmin) / (vmax - vmin)
+        draw.line([left, y, right, y], fill=GRID_COLOR)
+        draw.text((left - 40, y - 8), f"{v:.0f}", font=label_font, fill=LABEL_COLOR)
+    span = (window_end - window_start) or 1
+    xy = [
+        (left + (right - left) * (t - window_start) / span, bottom - (bottom - top) * (v - vmin) / (vmax - vmin))
+        for t, v in points
+    ]
+    if len(xy) == 1:
+        x, y = xy[0]
+        draw.ellipse([x - 3, y - 3, x + 3, y + 3], fill=HEART_COLOR)
+    else:
+        draw.line(xy, fill=HEART_COLOR, width=2, joint="curve")
+    latest = f"{points[-1][1]:.0f} bpm"
+    w, _ = _measure_text(draw, latest, _load_font(15, bold=True))
+    draw.text((CHART_WIDTH - CHART_PADDING[2] - w, 10), latest, font=_load_font(15, bold=True), fill=HEART_COLOR)
+    return img
+
+
+def render_app_donut(totals_seconds: Dict[str, int], top: int = 6) -> Image.Image:
+    """Donut chart of usage share per app (apps beyond `top` are merged into one "other" slice)."""
+    img, draw = _chart_canvas("应用使用占比")
+    items = sorted(((k, v) for k, v in totals_seconds.items() if v > 0), key=lambda x: -x[1])
+    if not items:
+        _draw_empty(draw)
+        return img
+    if len(items) > top:
+        items = items[:top - 1] + [("其他", sum(v for _, v in items[top - 1:]))]
+    total = sum(v for _, v in items)
+    cx, cy, r = 170, CHART_HEIGHT // 2 + 14, 110
+    angle = -90.0
+    for i, (_, sec) in enumerate(items):
+        sweep = 360.0 * sec / total
+        draw.pieslice([cx - r, cy - r, cx + r, cy + r], angle, angle + sweep, fill=CHART_COLORS[i % len(CHART_COLORS)])
+        angle += sweep
+    inner = r * 0.6
+    draw.ellipse([cx - inner, cy - inner, cx + inner, cy + inner], fill=CARD_COLOR)
+    # legend
+    font = _load_font(15)
+    value_font = _load_font(13)
+    x, y = 340, 64
+    for i, (name, sec) in enumerate(items):
+        color = CHART_COLORS[i % len(CHART_COLORS)]
+        draw.rounded_rectangle([x, y + 3, x + 14, y + 17], radius=3, fill=color)
+        draw.text((x + 24, y), str(name)[:24], font=font, fill=TEXT_COLOR)
+        draw.text((x + 300, y + 2), f"{sec / 60:.0f} 分钟  {sec * 100 / total:.1f}%", font=value_font, fill=MUTED_COLOR)
+        y += 34
+    return img
+
+
+# --- social preview (Open Graph) card
+
+OG_SIZE = (1200, 630)
+# colors for the `color` field of status_list (see .awake / .sleeping / .error in main.css)
+OG_STATUS_COLORS = {
+    "awake": (46, 204, 113),
+    "sleeping": (136, 146, 157),
+    "error": (231, 76, 60),
+}
+ACCENT_COLOR = (79, 139, 255)
+
+
+def _fit_text(draw: ImageDraw.ImageDraw, text: str, font, max_width: int) -> str:
+    """Truncate text with an ellipsis when it exceeds `max_width`."""
+    if _measure_text(draw, text, font)[0] <= max_width:
+        return text
+    while text and _measure_text(draw, text + "…", font)[0] > max_width:
+        text = text[:-1]
+    return text + "…"
+
+
+def render_og_card(user: str, status: dict, devices: List[dict], updated: str = "", max_devices: int = 3) -> Image.Image:
+    """
+    Social preview (Open Graph) card, 1200x630.
+
+    :param user: user name
+    :param status: current status ({'name', 'desc', 'color'}); html tags in desc are stripped
+    :param devices: device view models (from `build_device_view_models()`)
+    :param updated: last update time
+    """
+    width, height = OG_SIZE
+    img = Image.new("RGB", OG_SIZE, BG_COLOR)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([0, 0, 12, height], fill=ACCENT_COLOR)
+
+    left = 72
+    draw.text((left, 56), _fit_text(draw, f"{user}'s Status", _load_font(40, bold=True), width - left * 2),
+              font=_load_font(40, bold=True), fill=TEXT_COLOR)
+    color = OG_STATUS_COLORS.get(status.get("color"), ACCENT_COLOR)
+    name_font = _load_font(72, bold=True)
+    draw.text((left, 120), _fit_text(draw, str(status.get("name", "")), name_font, width - left * 2), font=name_font, fill=color)
+    desc = re.sub(r"<[^>]+>", "", str(status.get("desc", "")))
+    desc_font = _load_font(26)
+    draw.text((left, 222), _fit_text(draw, desc, desc_font, width - left * 2), font=desc_font, fill=MUTED_COLOR)
+
+    # top devices: using first
+    ordered = sorted(devices, key=lambda m: m.get("app_status") != "运行中")[:max_devices]
+    top = 300
+    row_h = 82
+    title_font = _load_font(26, bold=True)
+    app_font = _load_font(22)
+    tag_font = _load_font(18, bold=True)
+    for i, m in enumerate(ordered):
+        y = top + i * (row_h + 14)
+        draw.rounded_rectangle([left, y, width - left, y + row_h], radius=14, fill=CARD_COLOR, outline=BORDER_COLOR)
+        draw.text((left + 24, y + 12), _fit_text(draw, str(m.get("name", "—")), title_font, 420), font=title_font, fill=TEXT_COLOR)
+        draw.text((left + 24, y + 46), _fit_text(draw, str(m.get("current_app", "—")), app_font, 700), font=app_font, fill=MUTED_COLOR)
+        right = width - left - 24
+        battery = m.get("battery_percent")
+        if battery is not None:
+            text = f"{battery}%"
+            w, _ = _measure_text(draw, text, tag_font)
+            draw.text((right - w, y + 48), text, font=tag_font, fill=LABEL_COLOR)
+        _draw_status_badge(draw, m.get("online_status", "—"), (right - 90, y + 8), tag_font)
+    if not ordered:
+        draw.text((left, top + 10), "暂无设备", font=app_font, fill=MUTED_COLOR)
+
+    if updated:
+        foot_font = _load_font(18)
+        text = f"最后更新: {updated}"
+        w, _ = _measure_text(draw, text, foot_font)
+        draw.text((width - left - w, height - 44), text, font=foot_font, fill=LABEL_COLOR)
+    return img
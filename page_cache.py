@@ -0,0 +1,130 @@
+# coding: utf-8
+'''
+首页 (index.html) 的片段缓存
+
+- 页面外壳 (只和配置有关, 重启前不变) 在第一次访问时渲染一次, 按占位符切分后缓存
+- 设备列表按 `data.generation` 缓存, 设备状态变化后才重新渲染
+- 背景样式按背景 url 缓存
+- 每次请求只拼接缓存的片段和少量按请求变化的文本 (状态 / 更新时间 / more_text)
+'''
+import re
+import threading
+
+import flask
+from markupsafe import Markup, escape
+
+_SLOT = re.compile('\x00(\\w+)\x00')
+
+
+def _slot(name: str) -> Markup:
+    return Markup(f'\x00{name}\x00')
+
+
+class IndexPage:
+    '''
+    首页渲染器
+    '''
+
+    # 按请求填入的位置
+    SLOTS = ('background_style', 'devices_html', 'status_name', 'status_desc', 'status_color', 'last_updated', 'more_text', 'og_image')
+
+    def __init__(self, template: str = 'index.html', cache_shell: bool = True, max_backgrounds: int = 256):
+        '''
+        :param template: 页面模板
+        :param cache_shell: 是否缓存页面外壳 (调试模式下关闭, 以便修改模板后立即生效)
+        :param max_backgrounds: 最多缓存多少个背景样式
+        '''
+        self.template = template
+        self.cache_shell = cache_shell
+        self.max_backgrounds = max_backgrounds
+        self._shell: list = None
+        self._devices: tuple = (None, '')  # (generation, html)
+        self._backgrounds: dict = {}
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def _render_shell(self, **context) -> list:
+        '''
+        渲染页面外壳, 返回按占位符切分后的列表 (偶数位为固定文本, 奇数位为占位符名称)
+        '''
+        html = flask.render_template(
+            self.template,
+            status={'name': _slot('status_name'), 'desc': _slot('status_desc'), 'color': _slot('status_color')},
+            **{k: _slot(k) for k in self.SLOTS if not k.startswith('status_')},
+            **context
+        )
+        return _SLOT.split(html)
+
+    def _get_shell(self, **context) -> list:
+        shell = self._shell
+        if shell is None or not self.cache_shell:
+            shell = self._render_shell(**context)
+            self._shell = shell
+        return shell
+
+    def _get_devices(self, generation: int, build_devices) -> str:
+        gen, html = self._devices
+        if gen == generation:
+            self.hits += 1
+            return html
+        self.misses += 1
+        html = flask.render_template('index_devices.html', devices=build_devices())
+        # 只保留最新的版本
+        with self._lock:
+            if self._devices[0] is None or generation >= self._devices[0]:
+                self._devices = (generation, html)
+        return html
+
+    def _get_background(self, background_url: str, background_srcset: list) -> str:
+        key = background_url
+        html = self._backgrounds.get(key)
+        if html is None:
+            html = flask.render_template('index_background.html', background_url=background_url, background_srcset=background_srcset)
+            with self._lock:
+                if len(self._backgrounds) >= self.max_backgrounds:
+                    self._backgrounds.clear()
+                self._backgrounds[key] = html
+        return html
+
+    def render(self, generation: int, build_devices, status: dict, last_updated: str, more_text: str,
+               background_url: str, background_srcset: list, og_image: str = '', **context) -> str:
+        '''
+        渲染首页
+
+        :param generation: 设备状态版本号 (`d.generation`), 需在读取设备状态之前获取
+        :param build_devices: 返回设备视图 dict 的函数 (仅在缓存失效时调用)
+        :param status: 当前状态 ({'name', 'desc', 'color'})
+        :param last_updated: 最后更新时间
+        :param more_text: 已格式化的 more_text (html)
+        :param background_url: 背景图片 url
+        :param background_srcset: 背景图片的多尺寸版本列表
+        :param og_image: 预览图的完整 url (按请求的 Host 生成)
+        :param context: 其他传给模板的变量 (只在渲染外壳时使用)
+        '''
+        values = {
+            'background_style': self._get_background(background_url, background_srcset),
+            'devices_html': self._get_devices(generation, build_devices),
+            'status_name': str(escape(status.get('name', ''))),
+            'status_desc': str(status.get('desc', '')),
+            'status_color': str(escape(status.get('color', ''))),
+            'last_updated': str(escape(last_updated)),
+            'more_text': str(more_text),
+            'og_image': str(escape(og_image))
+        }
+        shell = self._get_shell(**context)
+        parts = shell[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = values[parts[i]]
+        return ''.join(parts)
+
+    def stats(self) -> dict:
+        '''
+        设备列表片段的缓存命中统计
+        '''
+        return {
+            'generation': self._devices[0],
+            'hits': self.hits,
+            'misses': self.misses,
+            'backgrounds_cached': len(self._backgrounds)
+        }
@@ -0,0 +1,238 @@
+# coding: utf-8
+'''
+只读副本
+
+访问量远大于设备上报时, 可以在负载均衡后面运行多个只读副本, 只有一个主实例处理 `/device/set` 等修改:
+
+- 主实例: `/state/changes?since=<序号>` 返回之后的状态修改 (与 state_store 中的操作相同), 没有新的修改时等待 (长轮询);
+  使用外部存储 (多进程 / 无服务器模式) 时直接读取存储, 否则在第一次有副本连接时创建内存中的操作日志 (`data.open_feed()`)
+- 副本: 后台线程持续拉取操作, 存入 `ReplicaStore`, 每次请求前由 `data.sync()` 应用, 与多进程模式的同步方式相同;
+  `/query`、`/events`、`/device/history`、主页等在本地处理, 需要 secret 的修改请求转发到主实例 (或拒绝)
+
+序号来源 (`epoch`) 变化 (如主实例重启后内存中的操作日志重新编号) 或所需的操作已被合并进快照时, 副本重新加载完整快照
+'''
+import threading
+from time import time, monotonic
+
+import utils as u
+import state_store
+
+# requests 只在副本中使用
+requests = u.lazy_import('requests')
+
+MAX_OPS = 2000  # 每次最多返回的操作数
+FORWARD_HEADERS = ('content-type', 'sleepy-secret', 'authorization', 'user-agent')
+
+# 主实例: 最近拉取过的副本 {地址: (since, 时间)}
+_followers: dict = {}
+_followers_lock = threading.Lock()
+
+
+# --- Primary side
+
+def changes(d, since: int, epoch: str = '', wait: float = 0, addr: str = None, stop: threading.Event = None) -> dict:
+    '''
+    复制源: 返回序号 `since` 之后的操作; 序号来源不一致或所需的操作已被合并进快照时附带完整快照
+
+    :param d: data 实例
+    :param epoch: 副本记录的序号来源 (第一次请求时为空)
+    :param wait: 没有新操作时最多等待的秒数 (长轮询)
+    :param addr: 副本地址 (用于统计)
+    :param stop: 设置时立即返回 (服务停止)
+    :return: `{"epoch", "seq", "ops": [[序号, 操作]]}`, 需要重新加载时另有 `"snapshot"` / `"snapshot_seq"`
+    '''
+    feed = d.open_feed()
+    if addr:
+        with _followers_lock:
+            _followers[addr] = (since, time())
+    if epoch == feed.epoch:
+        deadline = monotonic() + wait
+        while True:
+            ops = feed.read(since)
+            if ops is None:
+                break
+            left = deadline - monotonic()
+            if ops or left <= 0 or (stop is not None and stop.is_set()):
+                return {
+                    'epoch': feed.epoch,
+                    'seq': ops[-1][0] if ops else since,
+                    'ops': ops[:MAX_OPS]
+                }
+            feed.wait(since, min(left, 1))
+
+    for _ in range(3):
+        snapshot, snapshot_seq = feed.load()
+        ops = feed.read(snapshot_seq)
+        if ops is not None:
+            break
+    else:
+        raise RuntimeError('state store is compacting too often')
+    return {
+        'epoch': feed.epoch,
+        'seq': ops[-1][0] if ops else snapshot_seq,
+        'snapshot': snapshot,
+        'snapshot_seq': snapshot_seq,
+        'ops': ops[:MAX_OPS]
+    }
+
+
+def feed_stats(d) -> dict:
+    '''
+    主实例的复制状态 (最近 1 分钟内拉取过的副本及其落后的操作数)
+    '''
+    feed = d.feed if d.store is None else d.store
+    if feed is None:
+        return None
+    now = time()
+    with _followers_lock:
+        followers = {addr: v for addr, v in _followers.items() if now - v[1] < 60}
+    seq = max(d.seq if d.store is not None else feed.seq, d.written_seq)
+    return {
+        'epoch': feed.epoch,
+        'seq': seq,
+        'replicas': {addr: {'since': since, 'behind': max(0, seq - since), 'last_poll': round(now - at, 1)} for addr, (since, at) in followers.items()}
+    }
+
+
+# --- Replica side
+
+class ReplicaStore(state_store.MemoryStore):
+    '''
+    只读副本的状态存储: 后台线程从主实例的 `/state/changes` 长轮询拉取操作
+
+    收到新的快照时, 本地序号整体后移 (本地序号 = 主实例序号 + offset), 保证比之前的序号都大,
+    正在使用旧序号的 data 实例读取时会得到 None 并重新加载快照
+    '''
+    read_only = True
+
+    def __init__(self, primary: str, secret: str, poll: float = 25, timeout: float = 30):
+        '''
+        :param primary: 主实例地址 (如 `http://127.0.0.1:9010`)
+        :param secret: 主实例的 secret
+        :param poll: 长轮询的等待时间 (秒)
+        :param timeout: 启动时等待第一次同步的时间 (秒), 超时抛出异常
+        '''
+        super().__init__()
+        self.primary = primary.rstrip('/')
+        self.secret = secret
+        self.poll = poll
+        self.primary_epoch = ''
+        self.primary_seq = 0  # 主实例最新的序号 (上次响应时)
+        self.caught_up_at = 0.0  # 上次确认与主实例一致的时间
+        self.connected = False
+        self.snapshots = 0
+        self.errors = 0
+        self.last_error = None
+        self._offset = 0
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._session = requests.Session()
+        self.proxy = requests.Session()  # 转发修改请求 (见 forward())
+        self._thread = threading.Thread(target=self._run, name='replica', daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            self.close()
+            raise u.SleepyException(f'[replica] could not sync from primary {self.primary}: {self.last_error}')
+
+    def _run(self):
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                self._pull()
+                backoff = 1
+            except Exception as e:
+                if self.connected:
+                    u.warning(f'[replica] lost connection to primary {self.primary}: {e}')
+                self.connected = False
+                self.errors += 1
+                self.last_error = str(e)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _pull(self):
+        since = self.seq - self._offset
+        resp = self._session.get(f'{self.primary}/state/changes', params={
+            'since': since,
+            'epoch': self.primary_epoch,
+            'wait': self.poll if self.connected else 0
+        }, headers={'Sleepy-Secret': self.secret}, timeout=self.poll + 10)
+        if resp.status_code != 200:
+            raise RuntimeError(f'HTTP {resp.status_code}: {resp.text[:200]}')
+        body = resp.json()
+        with self._cond:
+            if 'snapshot' in body:
+                self._offset = max(self._offset, self.seq + 1 - body['snapshot_seq'])
+                self._reset(body['snapshot'], body['snapshot_seq'] + self._offset)
+                self.primary_epoch = body['epoch']
+                self.snapshots += 1
+                u.info(f'[replica] loaded snapshot from {self.primary} (seq {body["snapshot_seq"]})')
+            self._extend([(seq + self._offset, op) for seq, op in body['ops']])
+            self.primary_seq = body['seq']
+            if self.seq - self._offset >= self.primary_seq:
+                self.caught_up_at = time()
+        if not self.connected:
+            u.info(f'[replica] following {self.primary} (seq {self.primary_seq})')
+            self.connected = True
+        self._ready.set()
+
+    def wait_for(self, primary_seq: int, timeout: float) -> bool:
+        '''
+        等待收到主实例序号 `primary_seq` 之前的操作 (如转发的修改请求完成后)
+        '''
+        with self._cond:
+            return self._cond.wait_for(lambda: self.seq - self._offset >= primary_seq, timeout)
+
+    def lag(self) -> float:
+        '''
+        复制延迟 (秒): 距离上次确认与主实例一致经过的时间; 长轮询连接正常且已追上时为 0
+        '''
+        if self.connected and self.seq - self._offset >= self.primary_seq:
+            return 0.0
+        return round(time() - self.caught_up_at, 3) if self.caught_up_at else None
+
+    def stats(self) -> dict:
+        with self._cond:
+            seq = self.seq - self._offset
+        return {
+            'type': 'replica',
+            'primary': self.primary,
+            'connected': self.connected,
+            'seq': seq,
+            'primary_seq': self.primary_seq,
+            'lag_ops': max(0, self.primary_seq - seq),
+            'lag_seconds': self.lag(),
+            'snapshots': self.snapshots,
+            'errors': self.errors,
+            'last_error': self.last_error
+        }
+
+    def close(self):
+        self._stop.set()
+        self._session.close()
+        self.proxy.close()
+
+
+def forward(request, store: ReplicaStore, timeout: float = 10) -> tuple:
+    '''
+    将修改请求转发到主实例, 并等待本副本收到这次修改 (之后从本副本读取时能看到)
+
+    :param request: `flask.request`
+    :return: (响应内容, 状态码, headers)
+    '''
+    headers = {k: v for k, v in request.headers.items() if k.lower() in FORWARD_HEADERS}
+    headers['X-Sleepy-Replica'] = '1'
+    headers['X-Forwarded-For'] = ', '.join(filter(None, (request.headers.get('X-Forwarded-For'), request.remote_addr)))
+    url = store.primary + request.path
+    if request.query_string:
+        url += '?' + request.query_string.decode('utf-8', 'replace')
+    try:
+        resp = store.proxy.request(request.method, url, data=request.get_data(), headers=headers, timeout=timeout)
+    except Exception as e:
+        return u.reterr(
+            code='bad gateway',
+            message=f'primary unreachable: {e}'
+        ), 502, {}
+    seq = resp.headers.get('X-Sleepy-Seq', '')
+    if seq.isdigit() and not store.wait_for(int(seq), 2):
+        u.warning(f'[replica] write forwarded but seq {seq} not received yet')
+    return resp.content, resp.status_code, {'Content-Type': resp.headers.get('Content-Type', 'application/json')}
@@ -9,14 +9,14 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 # inject a minimal env module to avoid dependency on python-dotenv for tests
 if 'env' not in sys.modules:
     from types import SimpleNamespace
-    main = SimpleNamespace(timezone='Asia/Shanghai', checkdata_interval=60, debug=False, https_enabled=False, host='0.0.0.0', port=9012, ssl_cert='', ssl_key='')
-    util = SimpleNamespace(metrics=False, auto_switch_status=False)
+    main = SimpleNamespace(timezone='Asia/Shanghai', checkdata_interval=60, data_file='data.json', debug=False, https_enabled=False, host='0.0.0.0', port=9012, ssl_cert='', ssl_key='')
+    util = SimpleNamespace(metrics=False, auto_switch_status=False, trace_sample_rate=0, trace_ring_size=1, trace_file='')
     page = SimpleNamespace()
     status = SimpleNamespace()
     sys.modules['env'] = SimpleNamespace(main=main, util=util, page=page, status=status)
 # stub `setting` if missing (avoid json5 dependency for tests)
 if 'setting' not in sys.modules:
-    sys.modules['setting'] = SimpleNamespace(metrics_list={})
+    sys.modules['setting'] = SimpleNamespace(settings=SimpleNamespace(metrics_paths=frozenset()))
 from data import data
 
 if __name__ == '__main__':
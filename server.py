@@ -2,8 +2,9 @@
 # coding: utf-8
 
 import time
-import os
-import random
+import json
+import signal
+import threading
 from datetime import datetime
 from functools import wraps  # 用于修饰器
 
@@ -14,14 +15,23 @@ from markupsafe import escape
 
 import env
 import utils as u
+import tracing
+import device_fields
+import state_store
+import supervisor
+import replica
 from data import data as data_init
-from setting import status_list
-# 导入DG-Lab API处理模块
-import dglab_api
-from image_renderer import build_device_view_models, render_device_usage_image
-# 确保DGLab配置加载
-dglab_api.load_dglab_config()
-
+from singleflight import SingleFlight
+from background_catalog import BackgroundCatalog
+from background_variants import BackgroundVariants
+from page_cache import IndexPage
+from status_image import StatusImageCache, ThrottledImage, Overloaded
+from setting import settings
+# 可选功能的模块在第一次使用时才导入 (Pillow / requests 等), 减少冷启动耗时
+image_renderer = u.lazy_import('image_renderer')
+# DG-Lab API处理模块
+dglab_api = u.lazy_import('dglab_api')
+dglab_dispatcher = u.lazy_import('dglab_dispatcher')
 try:
     # init flask app
     app = flask.Flask(__name__)
@@ -32,15 +42,83 @@ try:
         flask_default_logger = getLogger('werkzeug')
         flask_default_logger.disabled = True
 
-    # init data
-    d = data_init()
-    d.load()
-    d.start_timer_check(data_check_interval=env.main.checkdata_interval)  # 启动定时保存
+    # 合并并发的相同历史统计计算 (如分享链接后大量访客同时打开页面)
+    history_flight = SingleFlight()
+
+    # 首页片段缓存 (调试模式下不缓存页面外壳, 修改模板后立即生效)
+    index_page = IndexPage(cache_shell=not env.main.debug)
+
+    # 设备状态图片的渲染缓存 / 线程池
+    status_images = StatusImageCache(
+        lambda models, **options: image_renderer.render_device_usage_image(models, **options),
+        workers=env.util.image_workers,
+        max_entries=env.util.image_cache_size,
+        warm_up=lambda: image_renderer.warm_up()
+    )
+    # 社交平台预览图 (/og.png)
+    og_images = ThrottledImage(lambda: _render_og(), min_interval=env.page.og_image_interval)  # _render_og 定义在下方, 在 status_images 的线程池中渲染
+    # 统计图表图片 (/device/chart/*.png), 按 (图表, 设备, 小时数, 数据版本) 缓存
+    chart_images = StatusImageCache(
+        lambda key, **options: _render_chart(key, **options),  # _render_chart 定义在下方
+        workers=env.util.image_workers,
+        max_entries=env.util.image_cache_size,
+        warm_up=lambda: image_renderer.warm_up()
+    )
+
+    # DG-Lab 配置 / 请求调度器 (第一次使用时初始化, 见 get_dglab())
+    dglab = None
+    dglab_config_loaded = False
+    dglab_lock = threading.Lock()
+
+    # 服务停止时设置, 通知 SSE 连接结束 (客户端会自动重连)
+    shutting_down = threading.Event()
+
+    # 由守护进程热重启时, 等待旧的进程保存数据后再加载
+    supervisor.wait_for_handover()
+
+    # 只读副本的状态存储 (见 replica.py), 不是副本时为 None
+    replica_store = None
+
+    # init data (构造时已加载 data.json)
+    if env.main.replica_of:
+        # 只读副本: 从主实例持续拉取状态修改, 不运行定时任务, 也不写入 data.json; 修改状态的请求转发到主实例 (见 primary_only())
+        replica_store = replica.ReplicaStore(env.main.replica_of, env.main.secret)
+        d = data_init(store=replica_store)
+        u.info(f'[state] read-only replica of {env.main.replica_of} (seq {replica_store.primary_seq}, writes: {env.main.replica_writes})')
+    elif env.main.serverless:
+        # 无服务器模式: 从外部存储加载快照, 定时任务在请求中执行 (见 sync_state())
+        d = data_init(store=state_store.open_store(env.main.state_store), compact_ops=env.main.state_compact_ops)
+        d.data_check_interval = env.main.checkdata_interval
+        u.info(f'[state] serverless mode, store: {env.main.state_store} (seq {d.seq})')
+    elif env.main.workers > 1:
+        # 多进程模式 (start.py --workers): 各进程通过共享存储同步状态, 只有 0 号进程运行定时任务并写回 data.json
+        d = data_init(store=state_store.open_store(env.main.state_store), compact_ops=env.main.state_compact_ops)
+        if supervisor.worker_id() == 0:
+            d.start_timer_check(data_check_interval=env.main.checkdata_interval)
+        u.info(f'[state] worker {supervisor.worker_id()}, store: {env.main.state_store} (seq {d.seq})')
+    else:
+        d = data_init()
+        d.start_timer_check(data_check_interval=env.main.checkdata_interval)  # 启动定时保存
 
     # init metrics if enabled
     if env.util.metrics:
         u.info('[metrics] metrics enabled, open /metrics to see the count.')
         d.metrics_init()
+
+    # init local background images
+    if env.page.background_local:
+        backgrounds = BackgroundCatalog(env.page.background_folder, check_interval=env.page.background_check_interval)
+    else:
+        backgrounds = None
+    # 背景图片的多尺寸 / 多格式版本
+    if backgrounds is not None and env.page.background_variants:
+        background_variants = BackgroundVariants(
+            backgrounds,
+            cache_folder=env.page.background_cache_folder,
+            widths=[w for w in env.page.background_variant_widths.split(',') if w.strip().isdigit()]
+        )
+    else:
+        background_variants = None
 except Exception as e:
     u.error(f"Error initing: {e}")
     exit(1)
@@ -54,44 +132,155 @@ except:
     u.error('Unexpected Error!')
     raise
 
+# --- DG-Lab 初始化
+
+def load_dglab_config() -> dict:
+    '''
+    获取 DG-Lab 配置 (第一次调用时加载 DGLab.json, 之后文件变化时自动重新加载)
+    '''
+    global dglab_config_loaded
+    if not dglab_config_loaded:
+        with dglab_lock:
+            if not dglab_config_loaded:
+                dglab_api.init_config(check_interval=env.util.dglab_config_check_interval)
+                dglab_config_loaded = True
+    return dglab_api.load_dglab_config()
+
+
+def get_dglab():
+    '''
+    获取 DG-Lab 请求调度器 (连接池 / 超时 / 线程池), 第一次调用时创建
+    '''
+    global dglab
+    if dglab is None:
+        load_dglab_config()
+        with dglab_lock:
+            if dglab is None:
+                dglab = dglab_dispatcher.DGLabDispatcher(
+                    workers=env.util.dglab_workers,
+                    connect_timeout=env.util.dglab_connect_timeout,
+                    read_timeout=env.util.dglab_read_timeout
+                )
+    return dglab
+
+
 # --- 背景图片处理函数
 
 def get_background_image():
     """
     获取背景图片URL
-    如果启用了本地背景图片，则返回本地图片的URL
+    如果启用了本地背景图片，则返回本地图片的URL (从启动时建立的索引中选择, 不访问文件系统)
     否则返回env.page.background中的URL
     """
-    if env.page.background_local:
-        folder = env.page.background_folder
-        # 确保文件夹路径以/结尾
-        if not folder.endswith('/'):
-            folder += '/'
-        
-        # 获取文件夹中的所有图片文件
-        if os.path.exists(folder):
-            image_files = [f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f)) 
-                          and f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'))]
-            
-            if image_files:
-                if env.page.background_random:
-                    # 随机选择一张图片
-                    image_file = random.choice(image_files)
-                else:
-                    # 使用指定索引的图片
-                    index = max(1, min(env.page.background_index, len(image_files))) - 1
-                    image_file = image_files[index] if index < len(image_files) else image_files[0]
-                
-                return f'/background/{image_file}'
-        
+    if backgrounds is not None:
+        if env.page.background_random:
+            if env.page.background_rotate_interval > 0:
+                # 按访客轮换
+                visitor = f'{_client_addr()}|{flask.request.user_agent}'
+                url = backgrounds.pick_rotating(visitor, env.page.background_rotate_interval)
+            else:
+                # 随机选择一张图片
+                url = backgrounds.pick_random()
+        else:
+            # 使用指定索引的图片
+            url = backgrounds.pick_index(env.page.background_index)
         # 如果没有找到图片或文件夹不存在，回退到默认背景
-        u.warning(f"本地背景图片文件夹 {folder} 不存在或没有图片文件，使用默认背景")
-    
+        if url:
+            return url
+
     return env.page.background
 
+
+def get_background_srcset(background_url: str) -> list:
+    '''
+    为本地背景图片生成按屏幕宽度选择的版本列表 (用于模板中的 @media 规则)
+
+    :return: [(最大屏幕宽度 (css px), url), ...], 按宽度从大到小排列
+    '''
+    if background_variants is None or not background_url.startswith('/background/'):
+        return []
+    sep = '&' if '?' in background_url else '?'
+    # 按 2x 像素密度估算: 宽度 w 的版本用于 css 宽度不超过 w / 2 的屏幕
+    return [(w // 2, f'{background_url}{sep}w={w}') for w in reversed(background_variants.widths[:-1])]
+
+
+def _background_width_hint() -> int:
+    '''
+    从 `?w=` 参数或 Client Hints 请求头获取期望的图片宽度 (物理像素)
+    '''
+    args = flask.request.args
+    headers = flask.request.headers
+    try:
+        if args.get('w'):
+            return int(args.get('w'))
+        width = headers.get('Sec-CH-Width') or headers.get('Width')
+        if width:
+            return int(float(width))
+        vw = headers.get('Sec-CH-Viewport-Width') or headers.get('Viewport-Width')
+        if vw:
+            dpr = float(headers.get('Sec-CH-DPR') or headers.get('DPR') or 1)
+            return int(float(vw) * dpr)
+    except ValueError:
+        pass
+    return None
+
 # --- Functions
 
 
+@app.before_request
+def trace_start():
+    '''
+    按采样率开始追踪本次请求的耗时
+    '''
+    tracing.start(f'{flask.request.method} {flask.request.path}')
+
+
+@app.after_request
+def trace_finish(response):
+    tracing.finish(status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def trace_cleanup(exc):
+    # 出现异常时 after_request 不会被调用
+    if tracing.active():
+        tracing.finish(status=500)
+
+
+@app.before_request
+def sync_state():
+    '''
+    (无服务器 / 多进程模式) 应用其他实例写入的操作; 无服务器模式下按经过的时间执行定时任务
+    '''
+    if d.store is not None:
+        with tracing.span('sync_state'):
+            d.sync()
+            if env.main.serverless:
+                d.tick()
+
+
+@app.teardown_request
+def flush_state(exc):
+    '''
+    (无服务器 / 多进程模式) 将本次请求产生的操作写入存储
+    '''
+    if d.store is not None:
+        d.flush()
+
+
+@app.after_request
+def replica_seq(response):
+    '''
+    (主实例) 返回由副本转发的修改请求写入的操作序号, 副本收到这次修改后再响应
+    '''
+    if flask.request.headers.get('X-Sleepy-Replica') and replica_store is None:
+        if d.store is not None:
+            d.flush()
+        response.headers['X-Sleepy-Seq'] = str(d.written_seq)
+    return response
+
+
 @app.before_request
 def showip():
     '''
@@ -110,44 +299,55 @@ def showip():
         u.info(f'- Request: {ip1} / {ip2} : {path}')
     else:
         u.info(f'- Request: {ip1} : {path}')
-    # --- count
-    if env.util.metrics:
+    # --- count (只读副本上的访问不计入)
+    if env.util.metrics and replica_store is None:
         d.record_metrics(path)
 
 
+def _verify_secret() -> bool:
+    '''
+    检查请求中的 secret 是否正确
+    '''
+    # 1. body
+    # -> {"secret": "my-secret"}
+    body: dict = flask.request.get_json(silent=True) or {}
+    if body.get('secret', '') == env.main.secret:
+        u.debug('[Auth] Verify secret Success from Body')
+        return True
+
+    # 2. param
+    # -> ?secret=my-secret
+    elif flask.request.args.get('secret', '') == env.main.secret:
+        u.debug('[Auth] Verify secret Success from Param')
+        return True
+
+    # 3. header (Sleepy-Secret)
+    # -> Sleepy-Secret: my-secret
+    elif flask.request.headers.get('Sleepy-Secret', '') == env.main.secret:
+        u.debug('[Auth] Verify secret Success from Header (Sleepy-Secret)')
+        return True
+
+    # 4. header (Authorization)
+    # -> Authorization: Bearer my-secret
+    elif flask.request.headers.get('Authorization', '')[7:] == env.main.secret:
+        u.debug('[Auth] Verify secret Success from Header (Authorization)')
+        return True
+
+    return False
+
+
 def require_secret(view_func):
     '''
     require_secret 修饰器, 用于指定函数需要 secret 鉴权
     '''
     @wraps(view_func)
     def wrapped_view(*args, **kwargs):
-        # 1. body
-        # -> {"secret": "my-secret"}
-        body: dict = flask.request.get_json(silent=True) or {}
-        if body.get('secret', '') == env.main.secret:
-            u.debug('[Auth] Verify secret Success from Body')
-            return view_func(*args, **kwargs)
-
-        # 2. param
-        # -> ?secret=my-secret
-        elif flask.request.args.get('secret', '') == env.main.secret:
-            u.debug('[Auth] Verify secret Success from Param')
-            return view_func(*args, **kwargs)
-
-        # 3. header (Sleepy-Secret)
-        # -> Sleepy-Secret: my-secret
-        elif flask.request.headers.get('Sleepy-Secret', '') == env.main.secret:
-            u.debug('[Auth] Verify secret Success from Header (Sleepy-Secret)')
+        with tracing.span('require_secret'):
+            verified = _verify_secret()
+        if verified:
             return view_func(*args, **kwargs)
-
-        # 4. header (Authorization)
-        # -> Authorization: Bearer my-secret
-        elif flask.request.headers.get('Authorization', '')[7:] == env.main.secret:
-            u.debug('[Auth] Verify secret Success from Header (Authorization)')
-            return view_func(*args, **kwargs)
-
-        # -1. no any secret
         else:
+            # -1. no any secret
             u.debug('[Auth] Verify secret Failed')
             return u.reterr(
                 code='not authorized',
@@ -155,9 +355,50 @@ def require_secret(view_func):
             ), 401
     return wrapped_view
 
+
+def primary_only(view_func):
+    '''
+    primary_only 修饰器, 用于指定修改状态的函数: 只读副本上转发到主实例 (`sleepy_main_replica_writes` 为 `reject` 时拒绝)
+    '''
+    @wraps(view_func)
+    def wrapped_view(*args, **kwargs):
+        if replica_store is None:
+            return view_func(*args, **kwargs)
+        if env.main.replica_writes == 'reject':
+            return u.reterr(
+                code='read only',
+                message='this instance is a read-only replica'
+            ), 403
+        with tracing.span('replica_forward'):
+            return replica.forward(flask.request, replica_store)
+    return wrapped_view
+
 # --- Templates
 
 
+def _index_devices() -> dict:
+    '''
+    准备设备的轻量视图（用于服务端首屏渲染）
+    '''
+    devices = {}
+    devices_source = d.data.get('device_status') or d.data.get('device', {})
+    for _id, dv in list(devices_source.items()):
+        device_fields.ensure_fields(dv)
+        devices[_id] = {
+            'id': _id,
+            'show_name': dv.get('show_name') or _id,
+            'offline': dv.get('offline', False),
+            'app_name': dv.get('app_name') or '',
+            'using': bool(dv.get('using')),
+            'running': bool(dv.get('running')),
+            'syncing': bool(dv.get('syncing')),
+            'error': bool(dv.get('error')),
+            'battery_percent': dv['battery_percent'],
+            'type': dv['device_type']
+        }
+    return devices
+
+
 @app.route('/')
 def index():
     '''
@@ -165,15 +406,7 @@ def index():
     - Method: **GET**
     '''
     # 获取手动状态
-    try:
-        status: dict = status_list[d.data['status']]
-    except:
-        u.warning(f"Index {d.data['status']} out of range!")
-        status = {
-            'name': 'Unknown',
-            'desc': '未知的标识符，可能是配置问题。',
-            'color': 'error'
-        }
+    status: dict = _current_status()
     # 获取更多信息 (more_text)
     more_text: str = env.page.more_text
     if env.util.metrics:
@@ -185,65 +418,24 @@ def index():
         )
     # 获取背景图片
     background_url = get_background_image()
-    # 准备设备的轻量视图（用于服务端首屏渲染）
-    import re
-    devices = {}
-    devices_source = d.data.get('device_status') or d.data.get('device', {})
-    for _id, dv in devices_source.items():
-        app_name = dv.get('app_name') or ''
-        # parse battery percent if present
-        battery_pct = None
-        m = re.search(r'电量[:：]?\s*(\d{1,3})%', app_name)
-        if m:
-            try:
-                battery_pct = int(m.group(1))
-            except:
-                battery_pct = None
-        else:
-            m2 = re.search(r'🔋\s*(\d{1,3})%', app_name)
-            if m2:
-                try:
-                    battery_pct = int(m2.group(1))
-                except:
-                    battery_pct = None
-
-        # detect type from provided field or show_name
-        dtype = ''
-        tfield = dv.get('type') or dv.get('device_type') or ''
-        namefield = dv.get('show_name') or ''
-        if tfield:
-            tt = str(tfield).lower()
-            if any(x in tt for x in ('phone', 'mobile', 'android', 'iphone')):
-                dtype = 'phone'
-            elif any(x in tt for x in ('pc', 'win', 'mac', 'linux', 'desktop')):
-                dtype = 'computer'
-        else:
-            if re.search(r'手机|phone|android|iphone', namefield, re.I): dtype = 'phone'
-            if re.search(r'电脑|pc|win|mac|linux', namefield, re.I): dtype = 'computer'
-
-        devices[_id] = {
-            'id': _id,
-            'show_name': dv.get('show_name') or _id,
-            'offline': dv.get('offline', False),
-            'app_name': app_name,
-            'using': bool(dv.get('using')),
-            'running': bool(dv.get('running')),
-            'syncing': bool(dv.get('syncing')),
-            'error': bool(dv.get('error')),
-            'battery_percent': battery_pct,
-            'type': dtype
-        }
-
-    # 返回 html
-    return flask.render_template(
-        'index.html',
-        env=env,
-        more_text=more_text,
+    background_srcset = get_background_srcset(background_url)
+    # 返回 html (设备列表等片段按 d.generation 缓存, 见 page_cache.py)
+    html = index_page.render(
+        generation=d.generation,
+        build_devices=_index_devices,
         status=status,
         last_updated=d.data['last_updated'],
+        more_text=more_text,
         background_url=background_url,
-        devices=devices
-    ), 200
+        background_srcset=background_srcset,
+        og_image=flask.url_for('og_image', _external=True),
+        env=env
+    )
+    headers = {}
+    if background_variants is not None:
+        # 请求浏览器在之后的请求中带上屏幕宽度 (用于选择背景图片尺寸)
+        headers['Accept-CH'] = 'Sec-CH-Viewport-Width, Sec-CH-DPR, Sec-CH-Width'
+    return html, 200, headers
 
 
 @app.route('/'+'git'+'hub')
@@ -264,14 +456,69 @@ def none():
 
 # --- DG-Lab API
 
+def _client_addr() -> str:
+    '''
+    访客地址: 开启 `sleepy_main_trusted_proxy` 时使用反向代理添加的 X-Forwarded-For 的最后一项
+    (之前的项由客户端提供, 可以伪造), 否则使用连接地址
+    '''
+    if env.main.trusted_proxy:
+        forwarded = flask.request.headers.get('X-Forwarded-For', '').split(',')[-1].strip()
+        if forwarded:
+            return forwarded
+    return flask.request.remote_addr or ''
+
+
 @app.route('/dglab/lightning', methods=['POST'])
 def dglab_lightning():
     '''
     DG-Lab 雷元素攻击（一键开火功能）
     - 无需鉴权（可根据需要添加鉴权）
     - Method: **POST**
+    - 请求在后台发送, 立即返回任务信息, 结果通过 `/dglab/job/<id>` 获取
+    - 同一时间窗口内的点击合并为一次开火; 访客点击过快时返回 429 (见 DGLab.json 中的 `scheduler`)
     '''
-    return dglab_api.handle_lightning_attack(), 200
+    try:
+        job = get_dglab().submit(_client_addr())
+    except dglab_dispatcher.Cooldown as e:
+        resp = u.format_dict({
+            'success': False,
+            'code': 'cooldown',
+            'message': '冷却中，请稍后再试',
+            'retry_after': round(e.retry_after, 1)
+        })
+        resp.headers['Retry-After'] = str(max(1, int(e.retry_after + 0.999)))
+        return resp, 429
+    except dglab_dispatcher.Busy:
+        return u.format_dict({
+            'success': False,
+            'code': 'busy',
+            'message': '请求过于频繁，请稍后再试'
+        }), 429
+    return u.format_dict(job), 202
+
+
+@app.route('/dglab/job/<job_id>', methods=['GET'])
+def dglab_job(job_id: str):
+    '''
+    获取 DG-Lab 任务的状态 / 结果
+    - 无需鉴权
+    - Method: **GET**
+    - Params: `wait` (可选, 任务未完成时最多等待的秒数, 0-30)
+    '''
+    try:
+        wait = min(max(float(flask.request.args.get('wait', 0)), 0), 30)
+    except ValueError:
+        return u.reterr(
+            code='bad request',
+            message='wait must be a number'
+        ), 400
+    job = get_dglab().get(job_id, wait=wait)
+    if job is None:
+        return u.reterr(
+            code='not found',
+            message='job not found or expired'
+        ), 404
+    return u.format_dict(job), 200
 
 @app.route('/dglab/config', methods=['GET'])
 def dglab_config():
@@ -280,9 +527,9 @@ def dglab_config():
     - 无需鉴权
     - Method: **GET**
     '''
-    config = dglab_api.load_dglab_config()
+    config = load_dglab_config()
     ui_config = {
-        'continuous_click': config.get('ui', {}).get('continuous_click', True)
+        'continuous_click': config['ui']['continuous_click']
     }
     return u.format_dict(ui_config), 200
 
@@ -302,7 +549,7 @@ def query(ret_as_dict: bool = False):
     # 获取手动状态
     st: int = d.data['status']
     try:
-        stinfo = status_list[st]
+        stinfo = settings.status_list[st]
     except:
         stinfo = {
             'id': -1,
@@ -311,6 +558,8 @@ def query(ret_as_dict: bool = False):
             'color': 'error'
         }
     # 获取设备状态
+    for dv in d.data['device_status'].values():
+        device_fields.ensure_fields(dv)
     if d.data['private_mode']:
         # 隐私模式
         devicelst = {}
@@ -360,7 +609,7 @@ def get_status_list():
     - 无需鉴权
     - Method: **GET**
     '''
-    return u.format_dict(status_list), 200
+    return u.format_dict(settings.status_list), 200
 
 
 # --- Status API
@@ -368,6 +617,7 @@ def get_status_list():
 
 @app.route('/set')
 @require_secret
+@primary_only
 def set_normal():
     '''
     设置状态
@@ -394,6 +644,7 @@ def set_normal():
 
 @app.route('/device/set', methods=['GET', 'POST'])
 @require_secret
+@primary_only
 def device_set():
     '''
     设置单个设备的信息/打开应用
@@ -422,40 +673,47 @@ def device_set():
                 code='bad request',
                 message='missing param or wrong param type'
             ), 400
+    # 读取可选字段 app_pkg / app_name_only
+    if flask.request.method == 'POST':
+        body = flask.request.get_json(silent=True) or {}
+        app_pkg = body.get('app_pkg') or body.get('app_package')
+        app_name_only = body.get('app_name_only') or body.get('app_name_simple')
+    else:
+        app_pkg = flask.request.args.get('app_pkg') or flask.request.args.get('app_package')
+        app_name_only = flask.request.args.get('app_name_only') or flask.request.args.get('app_name_simple')
+
     devices: dict = d.dget('device_status')
     now_ts = datetime.now(pytz.timezone(env.main.timezone)).isoformat()
-    heart_rate_val = d._extract_heart_rate((app_name_only if 'app_name_only' in locals() else None) or app_name)
+    # 解析电量 / 设备类型 / 心率 / 应用名 (只在上报时解析一次)
+    fields = device_fields.parse_report(device_show_name, app_name, app_name_only=app_name_only)
+    usage_extra = {'heart_rate': fields['heart_rate']}
     if (not device_using) and env.status.not_using:
-        # 如未在使用且锁定了提示，则替换
+        # 如未在使用且锁定了提示，则替换 (解析的字段也按替换后的提示生成, 不显示真实的应用)
         app_name = env.status.not_using
+        fields = device_fields.parse_report(device_show_name, app_name)
+        usage_extra = {}  # 心率由 record_app_usage 按记录的应用名解析
     devices[device_id] = {
         'show_name': device_show_name,
         'using': device_using,
         'app_name': app_name,
         'offline': False,
         'updated_at': now_ts,
-        'heart_rate': (int(heart_rate_val) if heart_rate_val is not None else None),
-        'heart_updated_at': now_ts
+        'heart_updated_at': now_ts,
+        **fields
     }
+    d.changed('device_status', device_id)
 
-    # 记录应用上报事件（仅保存事件点），支持可选字段 app_pkg / app_name_only
+    # 记录应用上报事件（仅保存事件点）
     try:
-        # 尝试从 GET/POST body 中读取额外字段
-        app_pkg = None
-        app_name_only = None
-        if flask.request.method == 'POST':
-            body = flask.request.get_json(silent=True) or {}
-            app_pkg = body.get('app_pkg') or body.get('app_package')
-            app_name_only = body.get('app_name_only') or body.get('app_name_simple')
-        else:
-            app_pkg = flask.request.args.get('app_pkg') or flask.request.args.get('app_package')
-            app_name_only = flask.request.args.get('app_name_only') or flask.request.args.get('app_name_simple')
-
-        d.record_app_usage(device_id, app_name, device_using, app_pkg=app_pkg, app_name_only=app_name_only)
+        d.record_app_usage(
+            device_id, app_name, device_using,
+            app_pkg=app_pkg, app_name_only=app_name_only,
+            **usage_extra
+        )
     except Exception as e:
         u.warning(f'Failed to record app usage: {e}')
 
-    d.data['last_updated'] = datetime.now(pytz.timezone(env.main.timezone)).strftime('%Y-%m-%d %H:%M:%S')
+    d.touch()
     d.check_device_status()
     return u.format_dict({
         'success': True,
@@ -465,6 +723,7 @@ def device_set():
 
 @app.route('/device/remove')
 @require_secret
+@primary_only
 def remove_device():
     '''
     移除单个设备的状态
@@ -473,7 +732,8 @@ def remove_device():
     device_id = escape(flask.request.args.get('id'))
     try:
         del d.data['device_status'][device_id]
-        d.data['last_updated'] = datetime.now(pytz.timezone(env.main.timezone)).strftime('%Y-%m-%d %H:%M:%S')
+        d.changed('device_status', device_id)
+        d.touch()
         d.check_device_status()
     except KeyError:
         return u.reterr(
@@ -488,13 +748,14 @@ def remove_device():
 
 @app.route('/device/clear')
 @require_secret
+@primary_only
 def clear_device():
     '''
     清除所有设备状态
     - Method: **GET**
     '''
-    d.data['device_status'] = {}
-    d.data['last_updated'] = datetime.now(pytz.timezone(env.main.timezone)).strftime('%Y-%m-%d %H:%M:%S')
+    d.dset('device_status', {})
+    d.touch()
     d.check_device_status()
     return u.format_dict({
         'success': True,
@@ -504,6 +765,7 @@ def clear_device():
 
 @app.route('/device/private_mode')
 @require_secret
+@primary_only
 def private_mode():
     '''
     隐私模式, 即不在 /query 中显示设备状态 (仍可正常更新)
@@ -515,8 +777,8 @@ def private_mode():
             code='invaild request',
             message='"private" arg only supports boolean type'
         ), 400
-    d.data['private_mode'] = private
-    d.data['last_updated'] = datetime.now(pytz.timezone(env.main.timezone)).strftime('%Y-%m-%d %H:%M:%S')
+    d.dset('private_mode', private)
+    d.touch()
     return u.format_dict({
         'success': True,
         'code': 'OK'
@@ -525,6 +787,7 @@ def private_mode():
 
 @app.route('/save_data')
 @require_secret
+@primary_only
 def save_data():
     '''
     保存内存中的状态信息到 `data.json`
@@ -553,10 +816,13 @@ def events():
     def event_stream():
         last_update = None
         last_heartbeat = time.time()
-        while True:
+        while not shutting_down.is_set():
             current_time = time.time()
-            # 检查数据是否已更新
-            current_update = d.data['last_updated']
+            if d.store is not None:
+                # 多进程模式下其他进程的修改只写入共享存储
+                d.sync()
+            # 检查数据 / 设置 (status_list) 是否已更新 (last_updated 只精确到秒, 同时比较 generation)
+            current_update = (d.data['last_updated'], d.generation, settings.version)
 
             # 如果数据有更新，发送更新事件并重置心跳计时器
             if last_update != current_update:
@@ -573,7 +839,7 @@ def events():
                 yield f"event: heartbeat\ndata: {timenow.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
                 last_heartbeat = current_time
 
-            time.sleep(1)  # 每秒检查一次更新
+            shutting_down.wait(1)  # 每秒检查一次更新
 
     response = flask.Response(event_stream(), mimetype="text/event-stream", status=200)
     response.headers["Cache-Control"] = "no-cache"  # 禁用缓存
@@ -600,7 +866,7 @@ def recent_records():
             message='device id is required'
         ), 400
     try:
-        records = d.get_recent_records(device_id=device_id, hours=hours)
+        records = history_flight.do(('recent', device_id, hours), d.get_recent_records, device_id=device_id, hours=hours)
     except Exception as e:
         return u.reterr(
             code='exception',
@@ -615,6 +881,28 @@ def recent_records():
 
 # --- Device history
 
+def _compute_history(device_id: str, hours: int, hour_param: str = None) -> dict:
+    '''
+    计算 `/device/history` 的统计数据
+
+    :param device_id: 设备 id (为空则聚合所有设备)
+    :param hours: 统计窗口 (小时)
+    :param hour_param: 如指定, 则额外返回该小时的分应用统计
+    '''
+    # 如果未指定 device id，则返回所有设备的聚合统计
+    if not device_id:
+        history = d.get_app_usage_aggregate(hours)
+        # if specific hour requested, include breakdown
+        if hour_param:
+            history['hour_breakdown'] = d.get_app_hour_breakdown('', hour_param, hours=hours)
+    else:
+        # 返回更详细的统计信息
+        history = d.get_app_usage_details_v2(device_id, hours)
+        if hour_param:
+            history['hour_breakdown'] = d.get_app_hour_breakdown(device_id, hour_param, hours=hours)
+    return history
+
+
 @app.route('/device/history')
 def device_history():
     '''
@@ -627,19 +915,9 @@ def device_history():
         hours = int(flask.request.args.get('hours', '24'))
     except:
         hours = 24
-    # 如果未指定 device id，则返回所有设备的聚合统计
+    hour_param = flask.request.args.get('hour')
     try:
-        hour_param = flask.request.args.get('hour')
-        if not device_id:
-            history = d.get_app_usage_aggregate(hours)
-            # if specific hour requested, include breakdown
-            if hour_param:
-                history['hour_breakdown'] = d.get_app_hour_breakdown('', hour_param, hours=hours)
-        else:
-            # 返回更详细的统计信息
-            history = d.get_app_usage_details_v2(device_id, hours)
-            if hour_param:
-                history['hour_breakdown'] = d.get_app_hour_breakdown(device_id, hour_param, hours=hours)
+        history = history_flight.do(('history', device_id, hours, hour_param), _compute_history, device_id, hours, hour_param)
     except Exception as e:
         return u.reterr(
             code='exception',
@@ -652,8 +930,262 @@ def device_history():
         'history': history
     }), 200
 
+
+# --- Device image
+
+def _image_options(default_fmt: str = 'png') -> dict:
+    '''
+    从请求中获取图片格式 / 缩放比例
+    - 格式: `?format=png|webp` > 路径后缀 > Accept 请求头 (支持 webp 时使用 webp)
+    - 缩放: `?scale=0.5|1|2`
+
+    :raise ValueError: 参数不支持
+    '''
+    fmt = flask.request.args.get('format')
+    if not fmt:
+        ext = flask.request.path.rsplit('.', 1)[-1]
+        if ext in image_renderer.IMAGE_FORMATS and ext != default_fmt:
+            fmt = ext
+        elif 'image/webp' in flask.request.headers.get('Accept', ''):
+            fmt = 'webp'
+        else:
+            fmt = default_fmt
+    if fmt not in image_renderer.IMAGE_FORMATS:
+        raise ValueError(f'unsupported format: {fmt}')
+    scale = float(flask.request.args.get('scale', '1'))
+    if scale not in image_renderer.IMAGE_SCALES:
+        raise ValueError(f'unsupported scale: {scale}')
+    return {'fmt': fmt, 'scale': scale}
+
+
+def _image_response(etag: str, data: bytes, fmt: str) -> flask.Response:
+    '''
+    返回图片 (支持 ETag / If-None-Match)
+    '''
+    if etag in flask.request.if_none_match:
+        resp = flask.Response(status=304)
+    else:
+        resp = flask.Response(data, mimetype=image_renderer.IMAGE_FORMATS[fmt])
+    resp.set_etag(etag)
+    # 允许缓存, 但每次使用前需向服务器确认 (状态变化后立即生效)
+    resp.headers['Cache-Control'] = 'public, no-cache'
+    resp.vary.add('Accept')
+    return resp
+
+
+@app.route('/device/image.png')
+@app.route('/device/image.webp')
+def device_image():
+    '''
+    设备状态图片 (可用于论坛签名 / 聊天机器人等)
+    - GET params: id=<device_id> (可选, 不指定则包含所有设备), format=<png|webp>, scale=<0.5|1|2>
+    - 状态未变化时返回缓存的图片, 支持 ETag / If-None-Match
+    '''
+    try:
+        options = _image_options()
+    except ValueError as e:
+        return u.reterr(
+            code='bad request',
+            message=str(e)
+        ), 400
+    device_id = flask.request.args.get('id')
+    devices: dict = {} if d.data['private_mode'] else d.data['device_status']
+    if device_id:
+        if device_id not in devices:
+            return u.reterr(
+                code='not found',
+                message=f'device {device_id} not found'
+            ), 404
+        devices = {device_id: devices[device_id]}
+    models = image_renderer.build_device_view_models(dict(devices), env.main.timezone)
+    try:
+        etag, data = status_images.get(models, **options)
+    except Overloaded:
+        return u.reterr(
+            code='busy',
+            message='too many images rendering, please retry later'
+        ), 503, {'Retry-After': '1'}
+    except Exception as e:
+        return u.reterr(
+            code='exception',
+            message=str(e)
+        ), 500
+    return _image_response(etag, data, options['fmt'])
+
+# --- Chart images
+
+CHART_KINDS = ('hourly', 'heart', 'apps')
+# 即使数据没有变化, 也至少每隔多少秒重新渲染一次 (时间窗口会移动)
+CHART_REFRESH = 300
+
+
+def _render_chart(key: list, fmt: str = 'png', scale: float = 1.0) -> bytes:
+    '''
+    渲染图表 (在图片线程池中执行)
+
+    :param key: [kind, device_id, hours, generation, time_bucket]
+    '''
+    kind, device_id, hours = key[:3]
+    history = history_flight.do(('history', device_id, hours, None), _compute_history, device_id, hours)
+    if kind == 'hourly':
+        img = image_renderer.render_hourly_chart(history.get('hourly_seconds', {}), image_renderer.hour_keys(hours, env.main.timezone))
+    elif kind == 'heart':
+        heart = history.get('heart_rate') or d.get_heart_rate_details(device_id, hours)
+        img = image_renderer.render_heart_rate_chart(
+            heart.get('history', []),
+            datetime.fromisoformat(heart['window_start']).timestamp(),
+            datetime.fromisoformat(heart['window_end']).timestamp()
+        )
+    else:
+        img = image_renderer.render_app_donut(history.get('totals_seconds', {}))
+    return image_renderer.encode_image(img, fmt, scale)
+
+
+@app.route('/device/chart/<kind>.png')
+@app.route('/device/chart/<kind>.webp')
+def device_chart(kind: str):
+    '''
+    使用统计图表图片
+    - kind: `hourly` (每小时使用时长) / `heart` (心率) / `apps` (应用占比)
+    - GET params: id=<device_id> (不指定则聚合所有设备, 心率图需指定), hours=<n>, format=<png|webp>, scale=<0.5|1|2>
+    - 按 (设备, 小时数, 数据版本) 缓存
+    '''
+    if kind not in CHART_KINDS:
+        return u.reterr(
+            code='not found',
+            message=f'chart kind must be one of {", ".join(CHART_KINDS)}'
+        ), 404
+    try:
+        options = _image_options()
+        hours = max(1, min(48, int(flask.request.args.get('hours', '24'))))
+    except ValueError as e:
+        return u.reterr(
+            code='bad request',
+            message=str(e)
+        ), 400
+    device_id = flask.request.args.get('id', '')
+    if kind == 'heart' and not device_id:
+        return u.reterr(
+            code='bad request',
+            message='device id is required for heart rate chart'
+        ), 400
+    key = [kind, device_id, hours, d.generation, int(time.time() // CHART_REFRESH)]
+    try:
+        etag, data = chart_images.get(key, **options)
+    except Overloaded:
+        return u.reterr(
+            code='busy',
+            message='too many images rendering, please retry later'
+        ), 503, {'Retry-After': '1'}
+    except Exception as e:
+        return u.reterr(
+            code='exception',
+            message=str(e)
+        ), 500
+    return _image_response(etag, data, options['fmt'])
+
+# --- Social preview
+
+def _current_status() -> dict:
+    '''
+    获取当前状态信息 (超出范围时返回 Unknown)
+    '''
+    try:
+        return settings.status_list[d.data['status']]
+    except (IndexError, KeyError, TypeError):
+        return {
+            'name': 'Unknown',
+            'desc': '未知的标识符，可能是配置问题。',
+            'color': 'error'
+        }
+
+
+def _render_og() -> bytes:
+    '''
+    在请求线程中读取状态, 在状态图片的渲染线程池中绘制 (与 /device/image.png 共用渲染名额)
+    '''
+    devices = {} if d.data['private_mode'] else dict(d.data['device_status'])
+    options = dict(
+        user=env.page.user,
+        status=_current_status(),
+        devices=image_renderer.build_device_view_models(devices, env.main.timezone),
+        updated=d.data['last_updated']
+    )
+    return status_images.run(lambda: image_renderer.encode_image(image_renderer.render_og_card(**options), 'png'))
+
+
+@app.route('/og.png')
+def og_image():
+    '''
+    社交平台预览图 (Open Graph, 1200×630)
+    - 数据变化后最多每 `sleepy_page_og_image_interval` 秒重新生成一次, 其余请求直接返回缓存
+    - 在设备状态图片的渲染线程池中生成, 渲染队列已满时返回旧的图片 (还没有图片时返回 503)
+    '''
+    try:
+        etag, data = og_images.get((d.generation, d.data['status'], d.data['private_mode'], settings.version))
+    except Overloaded:
+        return u.reterr(
+            code='busy',
+            message='too many images rendering, please retry later'
+        ), 503, {'Retry-After': '1'}
+    except Exception as e:
+        return u.reterr(
+            code='exception',
+            message=str(e)
+        ), 500
+    resp = _image_response(etag, data, 'png')
+    resp.headers['Cache-Control'] = f'public, max-age={env.page.og_image_interval}'
+    return resp
+
 # --- Special
 
+@app.route('/state/changes')
+@require_secret
+def state_changes():
+    '''
+    获取状态修改 (供只读副本同步, 见 replica.py)
+    - GET params: since=<序号>&epoch=<序号来源>&wait=<没有修改时等待的秒数>
+    - Method: **GET**
+    '''
+    try:
+        since = int(flask.request.args.get('since', '0'))
+        wait = min(max(float(flask.request.args.get('wait', '0')), 0), 60)
+    except ValueError:
+        return u.reterr(
+            code='bad request',
+            message="argument 'since' / 'wait' must be number"
+        ), 400
+    ret = replica.changes(d, since, flask.request.args.get('epoch', ''), wait,
+                          addr=_client_addr(), stop=shutting_down)
+    return flask.Response(json.dumps(ret, ensure_ascii=False, separators=(',', ':')), mimetype='application/json')
+
+
+@app.route('/admin/traces')
+@require_secret
+def admin_traces():
+    '''
+    获取最近的请求耗时追踪记录
+    - GET params: limit=<n>&name=<路径过滤>&format=chrome
+    - Method: **GET**
+    '''
+    try:
+        limit = int(flask.request.args.get('limit', '50'))
+    except ValueError:
+        limit = 50
+    name = flask.request.args.get('name') or None
+    if flask.request.args.get('format') == 'chrome':
+        # 可直接保存后在 chrome://tracing 或 Perfetto 中打开
+        return u.format_dict({
+            'traceEvents': tracing.chrome_events()
+        }), 200
+    return u.format_dict({
+        'success': True,
+        'sample_rate': env.util.trace_sample_rate,
+        'summary': tracing.summary(name),
+        'traces': tracing.recent(limit, name)
+    }), 200
+
+
 if env.util.metrics:
     @app.route('/metrics')
     def metrics():
@@ -661,7 +1193,18 @@ if env.util.metrics:
         获取统计信息
         - Method: **GET**
         '''
-        resp = d.get_metrics_resp()
+        resp = d.get_metrics_resp(extra={
+            'singleflight': {
+                'history': history_flight.stats()
+            },
+            'index_page': index_page.stats(),
+            'status_image': status_images.stats(),
+            'chart_image': chart_images.stats(),
+            'og_image': og_images.stats(),
+            'dglab': dglab.stats() if dglab is not None else None,
+            'state': d.store_stats() if d.store is not None else None,
+            'replication': replica_store.stats() if replica_store is not None else replica.feed_stats(d)
+        })
         return resp, 200
 
 if env.util.steam_enabled:
@@ -681,8 +1224,31 @@ if env.util.steam_enabled:
 def background_file(filename):
     """
     提供背景图片文件的访问
+    如启用了多尺寸版本, 则按 `?w=` / Client Hints 和 Accept 请求头返回缩小并重新编码后的图片
     """
-    return flask.send_from_directory(env.page.background_folder, filename)
+    # 带版本号的 url 内容不会改变, 可长期缓存
+    versioned = bool(flask.request.args.get('v'))
+    if background_variants is not None:
+        variant = background_variants.resolve(
+            filename,
+            width_hint=_background_width_hint(),
+            accept=flask.request.headers.get('Accept'),
+            fmt=flask.request.args.get('fmt')
+        )
+        if variant:
+            path, mimetype = variant
+            resp = flask.send_file(path, mimetype=mimetype, max_age=31536000 if versioned else 3600)
+            if versioned:
+                resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+            resp.vary.update(('Accept', 'Sec-CH-Width', 'Sec-CH-Viewport-Width', 'Sec-CH-DPR'))
+            return resp
+    resp = flask.send_from_directory(env.page.background_folder, filename)
+    if versioned and background_variants is not None:
+        # 版本尚未生成完成, 先返回原图, 不做长期缓存
+        resp.headers['Cache-Control'] = 'no-cache'
+    elif versioned:
+        resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
 
 if __name__ == '__main__':
     u.info(f'=============== hi {env.page.user}! ===============')
@@ -703,13 +1269,29 @@ if __name__ == '__main__':
         ssl_context = None
         u.info(f'Starting HTTP server: {env.main.host}:{env.main.port}{" (debug enabled)" if env.main.debug else ""}')
 
+    def _on_sigterm(signum, frame):
+        # 与 Ctrl+C 相同: 停止服务, 保存数据后退出
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    listen_fd = supervisor.listen_fd()
     try:
-        app.run(  # 启↗动↘
-            host=env.main.host,
-            port=env.main.port,
-            debug=env.main.debug,
-            ssl_context=ssl_context
-        )
+        if listen_fd is None:
+            supervisor.notify_serving()
+            app.run(  # 启↗动↘
+                host=env.main.host,
+                port=env.main.port,
+                debug=env.main.debug,
+                ssl_context=ssl_context
+            )
+        else:
+            # 使用守护进程 (start.py) 传入的 socket, 重启期间连接不会被拒绝
+            from werkzeug.serving import make_server
+            srv = make_server(env.main.host, env.main.port, app, threaded=True, ssl_context=ssl_context, fd=listen_fd)
+            u.info(f'Using socket from supervisor (fd {listen_fd})')
+            supervisor.serve(srv, on_stop=shutting_down.set)
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         u.error(f"Error running server: {e}")
     print()
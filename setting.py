@@ -1,45 +1,166 @@
 # coding: utf-8
+'''
+setting/ 目录下的自定义设置 (status_list / metrics_list)
+
+- 启动时加载一次, 之后由后台线程检查文件的 mtime / 大小, 有变化时重新加载, 修改状态列表无需重启
+- 解析后的结构作为一个快照整体替换, 读取时无需加锁
+- 每次重新加载后 `version` 加一, SSE 据此向已连接的客户端推送新的状态信息
+'''
+import os
+import threading
+from time import sleep
 
-import json
 import json5
 
+import env
 import utils as u
 
 
-class setting:
+def _setting_paths(name: str) -> tuple:
     '''
-    setting 类 \n
-    加载指定 json 文件内容到 `self.content`
+    设置文件的路径 (用户自定义, 默认)
     '''
-    config: dict
+    return (u.get_path(f'setting/{name}.json'), u.get_path(f'setting/{name}.default.jsonc'))
+
+
+def _read(path: str):
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json5.load(file)
+    except Exception as e:
+        u.exception(f'[setting] Error loading {path}: {e}')
 
-    def __init__(self, name: str):
+
+def _load_setting(name: str, build, fallback: bool = False):
+    '''
+    读取并校验设置: 用户自定义的文件存在时使用它, 否则使用默认设置
+
+    :param build: 校验函数 (如 `build_status_list`)
+    :param fallback: 用户自定义的文件有错误时, 是否警告并退回默认设置 *(启动时)*; 否则抛出异常 *(重新加载时, 继续使用之前的设置)*
+    '''
+    user, default = _setting_paths(name)
+    if os.path.exists(user):
         try:
-            # load user setting
-            self.load(u.get_path(f'setting/{name}.json'))
-        except:
-            self.load(u.get_path(f'setting/{name}.default.jsonc'))
+            return build(_read(user))
+        except Exception as e:
+            if not fallback:
+                raise
+            u.warning(f'[setting] invalid {user}: {e}, using default {default}')
+    return build(_read(default))
+
+
+def _stat(path: str) -> tuple:
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def build_status_list(raw) -> list:
+    '''
+    校验 status_list 并自动补全 id
+    '''
+    if not isinstance(raw, list) or not all(isinstance(i, dict) for i in raw):
+        raise ValueError('status_list should be a list of objects')
+    ret = []
+    for i, st in enumerate(raw):
+        st = dict(st)
+        st['id'] = i
+        ret.append(st)
+    return ret
+
+
+def build_metrics_list(raw) -> list:
+    '''
+    校验 metrics_list 并展开 `[static]`
+    '''
+    if not isinstance(raw, list):
+        raise ValueError('metrics_list should be a list')
+    ret = [i for i in raw if i != '[static]']
+    if '[static]' in raw:
+        ret.extend(['/static/' + i for i in u.list_dir(u.get_path('static/'))])
+    return ret
+
 
-    def load(self, filename: str):
+class SettingsRegistry:
+    '''
+    设置注册表
+
+    - `status_list`: 状态列表 (已补全 id)
+    - `metrics_list`: 需要统计的路径列表 (已展开 `[static]`)
+    - `metrics_paths`: 同上, frozenset (用于 `record_metrics` 中的查找)
+    '''
+
+    def __init__(self, check_interval: int = 5):
         '''
-        加载配置
+        :param check_interval: 检查文件变化的间隔 *(秒, 为 0 则不自动检查)*
         '''
-        try:
-            with open(filename, 'r', encoding='utf-8') as file:
-                self.content = json5.load(file)
-        except Exception as e:
-            u.exception(f'[setting] Error loading {filename}: {e}')
+        self.check_interval = check_interval
+        self._snapshot = ([], [], frozenset())  # (status_list, metrics_list, metrics_paths)
+        self._signature = None
+        self._lock = threading.Lock()
+        self.version: int = 0
+        self.reload(force=True)
+        self._thread = None
+        if check_interval > 0:
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+
+    @property
+    def status_list(self) -> list:
+        return self._snapshot[0]
 
+    @property
+    def metrics_list(self) -> list:
+        return self._snapshot[1]
+
+    @property
+    def metrics_paths(self) -> frozenset:
+        return self._snapshot[2]
+
+    def _signature_now(self) -> tuple:
+        '''
+        所有相关文件 (及 static 目录, 用于 `[static]`) 的 (mtime, 大小)
+        '''
+        paths = _setting_paths('status_list') + _setting_paths('metrics_list') + (u.get_path('static/'),)
+        return tuple(_stat(p) for p in paths)
+
+    def reload(self, force: bool = False) -> bool:
+        '''
+        文件有变化时重新加载
+
+        :param force: 是否忽略 mtime 强制加载
+        :return: 是否更新了设置
+        '''
+        with self._lock:
+            signature = self._signature_now()
+            if not force and signature == self._signature:
+                return False
+            self._signature = signature
+            # 启动时 (还没有可用的设置) 退回默认设置
+            fallback = self.version == 0
+            try:
+                status_list = _load_setting('status_list', build_status_list, fallback)
+                metrics_list = _load_setting('metrics_list', build_metrics_list, fallback)
+            except Exception as e:
+                if fallback:
+                    raise
+                u.warning(f'[setting] reload failed: {e}, keeping previous settings')
+                return False
+            self._snapshot = (status_list, metrics_list, frozenset(metrics_list))
+            self.version += 1
+            if not force:
+                u.info(f'[setting] reloaded: {len(status_list)} status, {len(metrics_list)} metrics paths')
+            return True
 
-status_list: list = setting('status_list').content
-metrics_list: list = setting('metrics_list').content
+    def _watch(self):
+        while True:
+            sleep(self.check_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                u.warning(f'[setting] refresh error: {e}')
 
-# status_list 中自动补全 id
-for i in range(len(status_list)):
-    status_list[i]['id'] = i
 
-# metrics_list 中 [static] 处理
-if '[static]' in metrics_list:
-    metrics_list.remove('[static]')
-    static_list = u.list_dir(u.get_path('static/'))
-    metrics_list.extend(['/static/' + i for i in static_list])
+settings = SettingsRegistry(check_interval=env.util.setting_check_interval)
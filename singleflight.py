@@ -0,0 +1,88 @@
+# coding: utf-8
+'''
+single-flight: 合并并发的相同计算
+
+同一时刻对同一个 key 的多次调用只会真正执行一次, 其余调用等待并共享这次的结果 (或异常),
+计算完成后不缓存结果, 之后的调用会重新计算
+'''
+import threading
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    '''
+    single-flight 组
+
+    用法: `group.do(key, func, *args, **kwargs)`
+
+    > 返回值会被所有等待者共享, 调用方不应修改返回的对象
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict = {}
+        self.requests: int = 0  # 总调用次数
+        self.executed: int = 0  # 实际执行次数
+        self.coalesced: int = 0  # 等待并共享结果的次数
+        self.max_waiters: int = 0  # 单次计算最多被多少个调用共享
+
+    def do(self, key, func, *args, **kwargs):
+        '''
+        执行 (或等待正在进行的) 计算
+
+        :param key: 计算的标识 (需可哈希), 相同 key 的并发调用会被合并
+        :param func: 实际执行的函数
+        '''
+        with self._lock:
+            self.requests += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                self.max_waiters = max(self.max_waiters, call.waiters)
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def stats(self) -> dict:
+        '''
+        合并统计
+        '''
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'coalesce_ratio': round(self.coalesced / self.requests, 4) if self.requests else 0,
+                'max_waiters': self.max_waiters,
+                'in_flight': len(self._calls)
+            }
@@ -1,26 +1,82 @@
 #!/usr/bin/python3
 # coding: utf-8
+'''
+启动器: 在子进程中运行 server.py, 异常退出后自动重启 (见 supervisor.py)
 
-from os import name, path, system
-from sys import argv
-from time import sleep
+- 重启等待时间指数增长 (1s, 2s, 4s ... 最长 60s), 短时间内崩溃次数过多时停止重启
+- `kill -HUP <pid>` 热重启 (如更新代码后): 不会拒绝连接, 也不会丢失未保存的数据
+- `kill <pid>` / Ctrl+C: 通知服务保存数据后退出
+- `--workers N`: 运行 N 个服务进程 (共用端口), 状态通过 `sleepy_main_state_store` 共享;
+  启动时用 data.json 初始化共享存储, 退出时写回 data.json
+'''
+import os
+import sys
+import argparse
+from os import path
+
+import env
+import state_store
+from supervisor import Supervisor
 
 Server_Path = 'server.py'  # server.py 相对路径
-Sleep_Time = 5  # 等待时间 (s)
-
-c = 0  # count
-selfn = argv[0]  # self
-dirn = path.dirname(selfn)  # self dir
-server = path.join(dirn, Server_Path)  # server.py path
-print(f'[Start] Server path: {server}')
-while True:
-    c += 1
-    print(f'[Start] Starting server #{c}')
-    if name == 'nt':
-        # Windows
-        r = system(f'python {server}')
-    else:
-        # not Windows
-        r = system(f'python3 {server}')
-    print(f'[Start] #{c} exited with code {r}\nwaiting {Sleep_Time}s')
-    sleep(Sleep_Time)
+
+
+def seed_store(url: str):
+    '''
+    用 data.json 的内容初始化共享存储 (两次运行之间以 data.json 为准)
+    '''
+    from data import data as data_init
+    state = data_init().data
+    store = state_store.open_store(url)
+    try:
+        seqs = store.append([{'op': 'set', 'path': [k], 'value': v} for k, v in state.items()])
+        store.compact(state, seqs[-1])
+    finally:
+        store.close()
+
+
+def export_store(url: str):
+    '''
+    将共享存储中的状态写回 data.json
+    '''
+    from data import data as data_init
+    store = state_store.open_store(url)
+    try:
+        data_init(store=store).save_file()
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run server.py under a supervisor with backoff restarts and warm reload (SIGHUP)')
+    parser.add_argument('--server', default=path.join(path.dirname(path.abspath(__file__)), Server_Path), help='path of server.py')
+    parser.add_argument('--backoff', type=float, default=1, help='initial restart delay in seconds, doubled after each crash (default: 1)')
+    parser.add_argument('--backoff-max', type=float, default=60, help='max restart delay in seconds (default: 60)')
+    parser.add_argument('--crash-limit', type=int, default=5, help='give up after this many crashes within --crash-window (default: 5)')
+    parser.add_argument('--crash-window', type=float, default=120, help='crash loop window in seconds (default: 120)')
+    parser.add_argument('--no-socket', action='store_true', help='let server.py bind the port itself (no socket handover)')
+    parser.add_argument('--workers', type=int, default=env.main.workers, help=f'number of server processes sharing the port (default: {env.main.workers})')
+    args = parser.parse_args()
+
+    print(f'[Start] Server path: {args.server}')
+    multi = args.workers > 1
+    if multi:
+        # 传给子进程, 使其使用共享存储
+        os.environ['SLEEPY_MAIN_WORKERS'] = str(args.workers)
+        print(f'[Start] {args.workers} workers, shared state: {env.main.state_store}')
+        seed_store(env.main.state_store)
+    sup = Supervisor(
+        [sys.executable, args.server],
+        host=None if args.no_socket or env.main.debug else env.main.host,
+        port=env.main.port,
+        workers=args.workers,
+        backoff_initial=args.backoff,
+        backoff_max=args.backoff_max,
+        crash_limit=args.crash_limit,
+        crash_window=args.crash_window
+    )
+    code = sup.run()
+    if multi:
+        print('[Start] writing shared state back to data.json')
+        export_store(env.main.state_store)
+    sys.exit(code)
@@ -0,0 +1,501 @@
+# coding: utf-8
+'''
+无服务器模式 (Vercel 等) 下的状态存储
+
+实例之间不共享内存 / 磁盘, 且随时可能被回收, 因此状态保存在外部存储中:
+- 快照 (snapshot): 某个序号之前的完整状态, 冷启动时加载一次
+- 操作日志 (ops): 每次修改追加一条小记录 (设置某个设备 / 追加一条使用记录 / 计数 +1 ...), 不再每次重写整个 data.json
+- 日志过长时由任意实例写入新的快照并删除已包含在快照中的操作 (compact)
+
+每条操作有递增的序号, 实例在每次请求前读取自己还没有应用的操作, 因此多个实例之间的状态也能保持同步
+
+存储后端需实现 `StateStore` 的接口, 这里提供了:
+- `FileStore`: 快照 json + 操作日志 jsonl
+- `SQLiteStore`: 单个 SQLite 数据库文件
+- `MemoryStore`: 只在内存中 (单进程模式下的复制源 / 只读副本, 见 replica.py)
+
+> 两者都只是本地文件, 在 Vercel 上 (`/tmp`) 仍然是每个实例独立的, 主要用于本地测试;
+> 实际部署时请将路径指向共享的存储, 或按相同接口实现 Redis / KV 等外部存储
+'''
+import os
+import json
+import uuid
+import bisect
+import threading
+from time import sleep, monotonic
+from datetime import datetime
+from contextlib import contextmanager
+
+import utils as u
+
+sqlite3 = u.lazy_import('sqlite3')
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: 只在进程内加锁
+    fcntl = None
+
+
+# --- Operations
+
+def _walk(data: dict, path: list) -> dict:
+    for key in path:
+        node = data.get(key)
+        if not isinstance(node, dict):
+            node = data[key] = {}
+        data = node
+    return data
+
+
+def _older_than(entry: dict, before: float) -> bool:
+    try:
+        return datetime.fromisoformat(entry['time']).timestamp() < before
+    except Exception:
+        return False
+
+
+def apply_op(data: dict, op: dict):
+    '''
+    将一条操作应用到状态上
+
+    操作格式:
+    - `{"op": "set", "path": [...], "value": ...}`: 设置值
+    - `{"op": "del", "path": [...]}`: 删除键
+    - `{"op": "push", "path": [...], "value": ...}`: 向列表追加一项
+    - `{"op": "prune", "path": [...], "before": <时间戳>}`: 删除列表中 `time` 早于此时间的记录 (无法解析的保留)
+    - `{"op": "metric", "key": "/"}`: 访问计数 +1 (today / month / year / total)
+
+    :return: (prune) 删除的记录数
+    '''
+    kind = op.get('op')
+    if kind == 'metric':
+        metrics = data.setdefault('metrics', {})
+        for period in ('today', 'month', 'year', 'total'):
+            counts = metrics.setdefault(period, {})
+            counts[op['key']] = counts.get(op['key'], 0) + 1
+        return
+    path = op['path']
+    parent = _walk(data, path[:-1])
+    key = path[-1]
+    if kind == 'set':
+        parent[key] = op['value']
+    elif kind == 'del':
+        parent.pop(key, None)
+    elif kind == 'push':
+        lst = parent.get(key)
+        if not isinstance(lst, list):
+            lst = parent[key] = []
+        lst.append(op['value'])
+    elif kind == 'prune':
+        lst = parent.get(key)
+        if not isinstance(lst, list):
+            return 0
+        kept = [e for e in lst if not _older_than(e, op['before'])]
+        parent[key] = kept
+        return len(lst) - len(kept)
+    else:
+        raise ValueError(f'unknown op: {kind}')
+
+
+# --- Stores
+
+class StateStore:
+    '''
+    状态存储接口
+
+    - 序号从 1 开始递增, 快照的序号表示它已包含了哪些操作 (没有快照时为 0)
+    - 所有方法都可能被多个线程 / 进程同时调用
+    '''
+    read_only: bool = False  # 只读存储 (如只读副本), 本实例的修改不写入
+    epoch: str = 'store'  # 序号的来源标识, 不同时表示序号不可比较 (见 replica.py)
+    poll_interval: float = 0.2  # wait() 中读取的间隔 (秒)
+
+    def load(self) -> tuple:
+        '''
+        读取快照
+
+        :return: (快照 dict 或 None, 快照序号)
+        '''
+        raise NotImplementedError
+
+    def read(self, since: int):
+        '''
+        读取序号大于 `since` 的操作
+
+        :return: [(序号, 操作)], 按序号排列; 如 `since` 之后的部分操作已被合并进快照 (需要重新加载快照) 则返回 None
+        '''
+        raise NotImplementedError
+
+    def append(self, ops: list) -> list:
+        '''
+        追加操作
+
+        :return: 分配给这些操作的序号
+        '''
+        raise NotImplementedError
+
+    def compact(self, snapshot: dict, seq: int) -> bool:
+        '''
+        写入序号为 `seq` 的快照, 并删除序号不大于 `seq` 的操作
+
+        :return: 是否写入 (已有更新的快照时不写入)
+        '''
+        raise NotImplementedError
+
+    def wait(self, since: int, timeout: float) -> bool:
+        '''
+        等待序号大于 `since` 的操作 (默认每 `poll_interval` 秒读取一次)
+
+        :return: 是否有新的操作 (需要重新加载快照时也返回 True)
+        '''
+        deadline = monotonic() + timeout
+        while True:
+            ops = self.read(since)
+            if ops is None or ops:
+                return True
+            left = deadline - monotonic()
+            if left <= 0:
+                return False
+            sleep(min(self.poll_interval, left))
+
+    def stats(self) -> dict:
+        return {}
+
+    def close(self):
+        pass
+
+
+class MemoryStore(StateStore):
+    '''
+    内存中的存储: 快照 + 最近的操作, 操作超过 `keep` 条时将较早的一半合并进快照 (不持久化)
+
+    用作单进程模式下的复制源, 以及只读副本中从主实例收到的操作 (见 replica.py)
+    '''
+
+    def __init__(self, snapshot: dict = None, seq: int = 0, keep: int = 5000):
+        self.keep = keep
+        self.epoch = uuid.uuid4().hex
+        self._cond = threading.Condition()
+        self._reset(snapshot, seq)
+
+    def _reset(self, snapshot: dict, seq: int):
+        with self._cond:
+            # 保存为 json 文本, 每次 load() 返回独立的副本
+            self._snapshot = json.dumps(snapshot, ensure_ascii=False) if snapshot is not None else None
+            self._snapshot_seq = seq
+            self._seqs: list = []
+            self._ops: list = []
+            self._cond.notify_all()
+
+    @property
+    def seq(self) -> int:
+        '''
+        最新的序号
+        '''
+        return self._seqs[-1] if self._seqs else self._snapshot_seq
+
+    def load(self) -> tuple:
+        with self._cond:
+            return (json.loads(self._snapshot) if self._snapshot is not None else None), self._snapshot_seq
+
+    def read(self, since: int):
+        with self._cond:
+            if since < self._snapshot_seq:
+                return None
+            i = bisect.bisect_right(self._seqs, since)
+            return list(zip(self._seqs[i:], self._ops[i:]))
+
+    def _extend(self, items: list):
+        '''
+        追加已分配序号的操作 ([(序号, 操作)], 忽略不大于当前序号的)
+        '''
+        with self._cond:
+            for seq, op in items:
+                if seq > self.seq:
+                    self._seqs.append(seq)
+                    self._ops.append(op)
+            if len(self._ops) > self.keep:
+                half = len(self._ops) // 2
+                snapshot = json.loads(self._snapshot) if self._snapshot is not None else {}
+                for op in self._ops[:half]:
+                    apply_op(snapshot, op)
+                self._snapshot = json.dumps(snapshot, ensure_ascii=False)
+                self._snapshot_seq = self._seqs[half - 1]
+                del self._seqs[:half], self._ops[:half]
+            self._cond.notify_all()
+
+    def append(self, ops: list) -> list:
+        with self._cond:
+            start = self.seq + 1
+            seqs = list(range(start, start + len(ops)))
+            # 复制一份, 之后对原对象的修改不影响已记录的操作
+            self._extend(list(zip(seqs, json.loads(json.dumps(ops, ensure_ascii=False)))))
+        return seqs
+
+    def compact(self, snapshot: dict, seq: int) -> bool:
+        # 超过 keep 条时自动合并
+        return False
+
+    def wait(self, since: int, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: since < self._snapshot_seq or self.seq > since, timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'type': 'memory',
+                'log_ops': len(self._ops),
+                'last_seq': self.seq
+            }
+
+
+class FileStore(StateStore):
+    '''
+    基于文件的存储: `<path>.snapshot.json` (快照) + `<path>.log` (每行一条 `{"seq", "op"}`)
+
+    跨进程的互斥使用 `<path>.lock` 上的 flock (Windows 上只在进程内互斥)
+    '''
+
+    def __init__(self, path: str):
+        self.snapshot_path = f'{path}.snapshot.json'
+        self.log_path = f'{path}.log'
+        self.lock_path = f'{path}.lock'
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # 已扫描到的日志位置 (日志被 compact 重写后 inode 改变, 需从头扫描)
+        self._inode = None
+        self._offset = 0
+        self._ops: list = []  # [(seq, op)], 已扫描的操作
+        self._last_seq = 0
+        self._snapshot_sig = None  # 快照文件的 (inode, mtime, 大小)
+        self._snapshot_seq_cached = 0
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, open(self.lock_path, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_snapshot(self) -> tuple:
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+            return raw['data'], int(raw['seq'])
+        except FileNotFoundError:
+            return None, 0
+
+    def _snapshot_seq(self) -> int:
+        '''
+        快照的序号 (快照文件没有变化时不重新读取)
+        '''
+        try:
+            st = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return 0
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if signature != self._snapshot_sig:
+            self._snapshot_sig = signature
+            self._snapshot_seq_cached = self._read_snapshot()[1]
+        return self._snapshot_seq_cached
+
+    def _scan(self):
+        '''
+        读取日志中新增的完整行 (需持有锁)
+        '''
+        try:
+            st = os.stat(self.log_path)
+        except FileNotFoundError:
+            self._inode, self._offset, self._ops = None, 0, []
+            return
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            self._inode, self._offset, self._ops = st.st_ino, 0, []
+        if st.st_size == self._offset:
+            return
+        with open(self.log_path, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        end = chunk.rfind(b'\n') + 1  # 忽略未写完的行
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            self._ops.append((rec['seq'], rec['op']))
+            self._last_seq = max(self._last_seq, rec['seq'])
+        self._offset += end
+
+    def load(self) -> tuple:
+        with self._locked():
+            return self._read_snapshot()
+
+    def read(self, since: int):
+        with self._locked():
+            if since < self._snapshot_seq():
+                return None
+            self._scan()
+            return [(seq, op) for seq, op in self._ops if seq > since]
+
+    def append(self, ops: list) -> list:
+        with self._locked():
+            self._scan()
+            start = max(self._last_seq, self._snapshot_seq()) + 1
+            seqs = list(range(start, start + len(ops)))
+            lines = ''.join(json.dumps({'seq': s, 'op': op}, ensure_ascii=False) + '\n' for s, op in zip(seqs, ops))
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self._scan()
+            return seqs
+
+    def compact(self, snapshot: dict, seq: int) -> bool:
+        with self._locked():
+            if seq <= self._snapshot_seq():
+                return False
+            self._scan()
+            tmp = f'{self.snapshot_path}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'seq': seq, 'data': snapshot}, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.snapshot_path)
+            # 重写日志, 只保留快照之后的操作
+            rest = [(s, op) for s, op in self._ops if s > seq]
+            tmp = f'{self.log_path}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(''.join(json.dumps({'seq': s, 'op': op}, ensure_ascii=False) + '\n' for s, op in rest))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.log_path)
+            self._inode = None
+            self._scan()
+            return True
+
+    def stats(self) -> dict:
+        def size(p):
+            try:
+                return os.path.getsize(p)
+            except OSError:
+                return 0
+        return {
+            'type': 'file',
+            'snapshot_bytes': size(self.snapshot_path),
+            'log_bytes': size(self.log_path),
+            'last_seq': self._last_seq
+        }
+
+
+class SQLiteStore(StateStore):
+    '''
+    基于 SQLite 的存储: `snapshot` 表 (只有一行) + `ops` 表
+
+    - 写入在 `BEGIN IMMEDIATE` 事务中分配序号, 多个进程的写入按序号排列
+    - 读取前检查 `PRAGMA data_version` (其他连接提交后才会变化), 没有新的写入时不查询 ops 表
+    '''
+    poll_interval = 0.05  # 没有新的写入时读取几乎没有开销
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS snapshot (id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL, data TEXT NOT NULL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS ops (seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL)')
+        self._version = None  # 上次读取时的 data_version
+        self._seen = 0  # 本连接读取 / 写入过的最大序号
+
+    def _snapshot_seq(self) -> int:
+        row = self._conn.execute('SELECT seq FROM snapshot WHERE id = 1').fetchone()
+        return row[0] if row else 0
+
+    def load(self) -> tuple:
+        with self._lock:
+            row = self._conn.execute('SELECT data, seq FROM snapshot WHERE id = 1').fetchone()
+        if row is None:
+            return None, 0
+        return json.loads(row[0]), row[1]
+
+    def read(self, since: int):
+        with self._lock:
+            version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            if version == self._version and since >= self._seen:
+                return []
+            self._conn.execute('BEGIN')
+            try:
+                if since < self._snapshot_seq():
+                    return None
+                rows = self._conn.execute('SELECT seq, op FROM ops WHERE seq > ? ORDER BY seq', (since,)).fetchall()
+            finally:
+                self._conn.execute('COMMIT')
+            self._version = version
+            if rows:
+                self._seen = max(self._seen, rows[-1][0])
+        return [(seq, json.loads(op)) for seq, op in rows]
+
+    def append(self, ops: list) -> list:
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                last = self._conn.execute('SELECT MAX(seq) FROM ops').fetchone()[0] or 0
+                start = max(last, self._snapshot_seq()) + 1  # 序号需大于快照 (ops 表可能已被清空)
+                seqs = list(range(start, start + len(ops)))
+                self._conn.executemany('INSERT INTO ops (seq, op) VALUES (?, ?)', [(s, json.dumps(op, ensure_ascii=False)) for s, op in zip(seqs, ops)])
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._seen = max(self._seen, seqs[-1])
+        return seqs
+
+    def compact(self, snapshot: dict, seq: int) -> bool:
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                if seq <= self._snapshot_seq():
+                    self._conn.execute('ROLLBACK')
+                    return False
+                self._conn.execute('INSERT OR REPLACE INTO snapshot (id, seq, data) VALUES (1, ?, ?)', (seq, json.dumps(snapshot, ensure_ascii=False)))
+                self._conn.execute('DELETE FROM ops WHERE seq <= ?', (seq,))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self._conn.execute('SELECT COUNT(*), MAX(seq) FROM ops').fetchone()
+        return {
+            'type': 'sqlite',
+            'log_ops': pending[0],
+            'last_seq': pending[1]
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_store(url: str) -> StateStore:
+    '''
+    按地址打开存储
+
+    :param url: `file:<路径>` 或 `sqlite:<路径>` (相对路径基于主程序目录)
+    '''
+    kind, sep, path = url.partition(':')
+    if not sep or not path:
+        raise ValueError(f'invalid state store: {url!r}, expected file:<path> or sqlite:<path>')
+    if not os.path.isabs(path):
+        path = u.get_path(path)
+    if kind == 'file':
+        return FileStore(path)
+    elif kind == 'sqlite':
+        return SQLiteStore(path)
+    raise ValueError(f'unknown state store type: {kind!r}')
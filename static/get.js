@@ -61,14 +61,6 @@ function formatRecentTime(ts) {
     return dt.toLocaleString([], { month: '2-digit', day: '2-digit', hour: '2-digit', minute: '2-digit' });
 }
 
-function parseHeartRate(value) {
-    if (value === null || value === undefined) return null;
-    const m = String(value).trim().match(/(-?\d+(?:\.\d+)?)\s*bpm$/i);
-    if (!m) return null;
-    const num = Number(m[1]);
-    return Number.isNaN(num) ? null : num;
-}
-
 function formatHeartRateValue(value) {
     if (value === null || value === undefined) return null;
     const num = Number(value);
@@ -142,12 +134,7 @@ async function updateElement(data) {
             const ms = device.battery_percent.match(/(\d{1,3})/);
             if (ms) return parseInt(ms[1], 10);
         }
-        try {
-            const m = (device.app_name || '').match(/电量[:：]?\s*(\d{1,3})%/);
-            const m2 = (device.app_name || '').match(/🔋\s*(\d{1,3})%/);
-            if (m) return parseInt(m[1], 10);
-            if (m2) return parseInt(m2[1], 10);
-        } catch(e) { /* ignore */ }
+        // 电量由服务端在上报时解析 (battery_percent), 这里不再解析 app_name
         return null;
     };
 
@@ -163,8 +150,7 @@ async function updateElement(data) {
         if (device && (device.heart_rate || device.heart_rate === 0)) {
             return device.heart_rate;
         }
-        const text = device ? (device.app_name || '') : '';
-        return parseHeartRate(text);
+        return null;
     };
 
     const resolveCurrentApp = (device, details) => {
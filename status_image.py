@@ -0,0 +1,191 @@
+# coding: utf-8
+'''
+设备状态图片 (`/device/image.png`) 的渲染缓存
+
+- 按视图模型 (`build_device_view_models()` 的结果) 的哈希和输出格式缓存编码后的图片, 状态未变化时直接返回缓存的字节
+- 渲染在有界的线程池中进行, 排队过多时拒绝新的渲染, 避免大量图片请求占满处理 API 的线程
+- 同一视图模型的并发请求只渲染一次
+'''
+import json
+import hashlib
+import threading
+from time import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from singleflight import SingleFlight
+
+
+class Overloaded(Exception):
+    '''
+    渲染队列已满
+    '''
+
+
+class StatusImageCache:
+    '''
+    状态图片缓存
+    '''
+
+    def __init__(self, render, workers: int = 2, max_pending: int = 8, max_entries: int = 64, timeout: float = 10.0, warm_up=None):
+        '''
+        :param render: 渲染函数, 接收视图模型列表 (和 `get()` 的其他参数), 返回图片字节 (或 BytesIO)
+        :param workers: 渲染线程数
+        :param max_pending: 最多同时有多少个渲染 (含排队中的)
+        :param max_entries: 最多缓存多少张图片
+        :param timeout: 等待渲染的超时时间 (秒)
+        :param warm_up: (可选) 渲染线程启动时调用的函数 (如预加载字体)
+        '''
+        self._render = render
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='status-image', initializer=warm_up)
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._flight = SingleFlight()
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits: int = 0
+        self.renders: int = 0
+        self.rejected: int = 0
+
+    @staticmethod
+    def etag(models: list) -> str:
+        '''
+        视图模型的哈希 (同时作为 ETag)
+        '''
+        raw = json.dumps(models, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def peek(self, key: str) -> bytes:
+        '''
+        读取缓存 (不存在时返回 None)
+        '''
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def run(self, func, *args, **kwargs):
+        '''
+        在渲染线程池中执行 `func` (占用一个渲染名额) 并等待结果, 不缓存
+
+        :raise Overloaded: 渲染队列已满
+        :raise TimeoutError: 渲染超时
+        '''
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise Overloaded('too many images rendering')
+        try:
+            fut = self._pool.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        # 等待超时后渲染仍在线程池中进行, 渲染真正结束时才释放名额
+        fut.add_done_callback(lambda _: self._slots.release())
+        return fut.result(timeout=self.timeout)
+
+    def _do_render(self, key: str, models: list, options: dict) -> bytes:
+        data = self.peek(key)
+        if data is not None:
+            return data
+        out = self.run(self._render, models, **options)
+        data = out.getvalue() if hasattr(out, 'getvalue') else bytes(out)
+        with self._lock:
+            self.renders += 1
+            self._cache[key] = data
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return data
+
+    def get(self, models: list, **options) -> tuple:
+        '''
+        获取视图模型对应的图片
+
+        :param options: 传给渲染函数的参数 (如格式 / 缩放), 不同参数的结果分别缓存
+        :return: (etag, 图片字节)
+        :raise Overloaded: 渲染队列已满
+        :raise TimeoutError: 渲染超时
+        '''
+        key = self.etag(models)
+        if options:
+            key += '-' + '-'.join(f'{k}{v}' for k, v in sorted(options.items()))
+        data = self.peek(key)
+        if data is None:
+            data = self._flight.do(key, self._do_render, key, models, options)
+        return key, data
+
+    def stats(self) -> dict:
+        with self._lock:
+            cached = len(self._cache)
+        return {
+            'cached': cached,
+            'hits': self.hits,
+            'renders': self.renders,
+            'rejected': self.rejected,
+            'coalesced': self._flight.coalesced
+        }
+
+
+class ThrottledImage:
+    '''
+    只保留最新一份的图片缓存 (如社交平台预览图)
+
+    版本号变化且距上次渲染超过 `min_interval` 秒时才重新渲染, 其他情况直接返回缓存的字节;
+    正在重新渲染或渲染队列已满 (`Overloaded`) 时, 其他请求继续使用旧的图片
+    '''
+
+    def __init__(self, render, min_interval: float = 60):
+        '''
+        :param render: 渲染函数 (无参数), 返回图片字节 (可通过 `StatusImageCache.run()` 在有界的线程池中渲染)
+        :param min_interval: 两次渲染的最小间隔 (秒)
+        '''
+        self._render = render
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._time: float = 0
+        self._etag: str = None
+        self._data: bytes = None
+        self.hits: int = 0
+        self.renders: int = 0
+
+    def get(self, version) -> tuple:
+        '''
+        :param version: 数据版本 (可哈希, 如 (generation, status))
+        :return: (etag, 图片字节)
+        '''
+        data = self._data
+        if data is not None and (version == self._version or time() - self._time < self.min_interval):
+            self.hits += 1
+            return self._etag, data
+        # 已有旧图片且其他线程正在渲染时, 直接返回旧图片
+        if not self._lock.acquire(blocking=data is None):
+            self.hits += 1
+            return self._etag, data
+        try:
+            if self._data is None or (version != self._version and time() - self._time >= self.min_interval):
+                try:
+                    data = self._render()
+                except Overloaded:
+                    if self._data is None:
+                        raise
+                    self.hits += 1
+                    return self._etag, self._data
+                self._etag = hashlib.sha1(data).hexdigest()
+                self._data = data
+                self._version = version
+                self._time = time()
+                self.renders += 1
+            return self._etag, self._data
+        finally:
+            self._lock.release()
+
+    def stats(self) -> dict:
+        return {
+            'version': repr(self._version),
+            'hits': self.hits,
+            'renders': self.renders
+        }
@@ -0,0 +1,409 @@
+# coding: utf-8
+'''
+进程守护 (start.py 使用)
+
+- 服务在子进程中运行, 监听的 socket 由守护进程创建并传给子进程, 子进程重启期间新连接在 backlog 中排队, 不会被拒绝
+- 子进程异常退出后按指数退避重启, 稳定运行一段时间后退避时间重置; 短时间内崩溃次数过多时认为陷入崩溃循环, 停止重启
+- 热重启 (向守护进程发送 SIGHUP): 先启动新的子进程完成导入, 再让旧的子进程停止并保存数据,
+  新的子进程随后加载刚保存的数据开始服务 —— 新代码导入失败时旧的子进程继续运行
+- 守护进程收到 SIGTERM / SIGINT 时转发给子进程, 子进程保存数据后退出
+- 多进程模式 (`workers` > 1): 多个子进程共用监听 socket, 状态通过 state_store 共享 (见 start.py)
+
+子进程 (server.py) 通过 `listen_fd()` / `worker_id()` / `wait_for_handover()` / `serve()` 与守护进程配合,
+单独运行 server.py 时这些函数不做任何事
+
+> Windows 上不支持传递 socket 和 SIGHUP, 只有退避重启 / 崩溃循环检测
+'''
+import os
+import sys
+import signal
+import socket
+import threading
+import subprocess
+from time import time, sleep
+from collections import deque
+
+import utils as u
+
+# 子进程的环境变量: 监听 socket 的 fd / 与守护进程通信的 socket 的 fd
+LISTEN_FD_ENV = 'SLEEPY_LISTEN_FD'
+CONTROL_FD_ENV = 'SLEEPY_CONTROL_FD'
+WORKER_ID_ENV = 'SLEEPY_WORKER_ID'
+
+# 控制消息 (单字节)
+MSG_WAITING = b'W'  # 子进程: 已完成导入, 等待加载数据
+MSG_GO = b'G'  # 守护进程: 旧的子进程已保存数据, 可以加载
+MSG_SERVING = b'S'  # 子进程: 开始服务
+
+# 只在当前进程中使用, 不传给子进程 (如调试模式的自动重载)
+_listen_fd = os.environ.pop(LISTEN_FD_ENV, None)
+_control_fd = os.environ.pop(CONTROL_FD_ENV, None)
+_worker_id = int(os.environ.pop(WORKER_ID_ENV, 0) or 0)
+_control: socket.socket = None
+
+
+# --- Child side
+
+def _control_socket():
+    global _control, _control_fd
+    if _control is None and _control_fd:
+        fd, _control_fd = int(_control_fd), None
+        try:
+            _control = socket.socket(fileno=fd)
+        except OSError as e:
+            u.warning(f'[supervisor] invalid control socket: {e}')
+    return _control
+
+
+def listen_fd():
+    '''
+    守护进程传入的监听 socket fd (未由守护进程启动时为 None)
+    '''
+    return int(_listen_fd) if _listen_fd else None
+
+
+def worker_id() -> int:
+    '''
+    子进程的编号 (多进程模式下从 0 开始, 其他情况为 0)
+    '''
+    return _worker_id
+
+
+def wait_for_handover():
+    '''
+    (子进程) 在加载数据之前调用: 通知守护进程已完成导入, 等待旧的子进程保存数据
+    '''
+    sock = _control_socket()
+    if sock is None:
+        return
+    sock.sendall(MSG_WAITING)
+    msg = sock.recv(1)
+    if msg != MSG_GO:
+        # 守护进程已退出 / 放弃了本次重启
+        u.warning('[supervisor] handover cancelled, exiting')
+        sys.exit(0)
+
+
+def notify_serving():
+    '''
+    (子进程) 开始服务前调用
+    '''
+    sock = _control_socket()
+    if sock is not None:
+        try:
+            sock.sendall(MSG_SERVING)
+        except OSError:
+            pass
+
+
+def serve(srv, on_stop=None, drain_timeout: float = 10):
+    '''
+    (子进程) 运行 werkzeug 服务, 直到收到 SIGTERM / Ctrl+C; 停止接受连接后等待进行中的请求完成
+
+    :param srv: `werkzeug.serving.make_server()` 创建的服务
+    :param on_stop: 停止接受连接后调用 (如通知 SSE 连接结束)
+    :param drain_timeout: 最多等待进行中的请求多少秒
+    '''
+    lock = threading.Lock()
+    inflight = [0]
+    process_request, shutdown_request = srv.process_request, srv.shutdown_request
+
+    # 从 accept 开始计数 (而不是在处理线程中), 停止时不会漏掉刚接受的连接
+    def tracked_process(request, client_address):
+        with lock:
+            inflight[0] += 1
+        process_request(request, client_address)
+
+    def tracked_shutdown(request):
+        try:
+            shutdown_request(request)
+        finally:
+            with lock:
+                inflight[0] -= 1
+
+    srv.process_request, srv.shutdown_request = tracked_process, tracked_shutdown
+
+    # 在其他线程中调用 shutdown(), 让服务在两次 accept 之间退出 (直接在主线程抛出 KeyboardInterrupt 可能关闭刚接受的连接)
+    def stop(signum, frame):
+        threading.Thread(target=srv.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    notify_serving()
+    srv.serve_forever()
+    if on_stop is not None:
+        on_stop()
+    deadline = time() + drain_timeout
+    while inflight[0] > 0 and time() < deadline:
+        sleep(0.01)
+    if inflight[0] > 0:
+        u.warning(f'[supervisor] {inflight[0]} requests still running after {drain_timeout}s')
+
+
+# --- Supervisor side
+
+class Child:
+    '''
+    一个服务子进程
+    '''
+
+    def __init__(self, proc: subprocess.Popen, control: socket.socket, slot: int = 0):
+        self.proc = proc
+        self.control = control
+        self.slot = slot
+        self.started = time()
+        self.serving = False
+        self.terminated = False
+
+    def wait_message(self, expected: bytes, timeout: float) -> bool:
+        '''
+        等待子进程发送 `expected` (子进程退出或超时返回 False)
+        '''
+        if self.control is None:
+            return self.proc.poll() is None
+        deadline = time() + timeout
+        while time() < deadline:
+            self.control.settimeout(min(0.5, max(0.01, deadline - time())))
+            try:
+                msg = self.control.recv(1)
+            except socket.timeout:
+                if self.proc.poll() is not None:
+                    return False
+                continue
+            except OSError:
+                return False
+            if not msg:
+                return False
+            if msg == MSG_SERVING:
+                self.serving = True
+            if msg == expected:
+                return True
+        return False
+
+    def send(self, msg: bytes):
+        if self.control is not None:
+            try:
+                self.control.sendall(msg)
+            except OSError:
+                pass
+
+    def terminate(self):
+        '''
+        发送 SIGTERM (只发送一次, 避免打断子进程保存数据)
+        '''
+        if not self.terminated and self.proc.poll() is None:
+            self.terminated = True
+            self.proc.terminate()
+
+    def stop(self, timeout: float) -> int:
+        '''
+        发送 SIGTERM, 等待子进程保存数据后退出, 超时后强制结束
+        '''
+        if self.proc.poll() is None:
+            self.terminate()
+            try:
+                self.proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                u.warning(f'[supervisor] pid {self.proc.pid} did not exit in {timeout}s, killing')
+                self.proc.kill()
+                self.proc.wait()
+        self.close()
+        return self.proc.returncode
+
+    def close(self):
+        if self.control is not None:
+            self.control.close()
+            self.control = None
+
+
+class Supervisor:
+    '''
+    服务子进程的守护
+
+    `workers` 大于 1 时同时运行多个子进程, 共用同一个监听 socket (由内核分配连接), 每个子进程单独重启;
+    热重启时逐个替换, 始终有进程在处理请求
+    '''
+
+    def __init__(self, command: list, host: str = None, port: int = None, workers: int = 1, backoff_initial: float = 1,
+                 backoff_max: float = 60, stable_after: float = 60, crash_limit: int = 5, crash_window: float = 120,
+                 stop_timeout: float = 15, start_timeout: float = 60):
+        '''
+        :param command: 启动子进程的命令
+        :param host: 监听地址 (为 None 时由子进程自行监听, 只能有一个子进程)
+        :param port: 监听端口
+        :param workers: 子进程数
+        :param backoff_initial: 第一次崩溃后的重启等待时间 (秒), 之后每次翻倍
+        :param backoff_max: 最长重启等待时间 (秒)
+        :param stable_after: 子进程运行超过多少秒后重置退避时间
+        :param crash_limit: `crash_window` 秒内崩溃多少次视为崩溃循环, 停止重启
+        :param crash_window: 崩溃循环的统计窗口 (秒)
+        :param stop_timeout: 等待子进程保存数据并退出的最长时间 (秒)
+        :param start_timeout: 热重启时等待新的子进程完成导入的最长时间 (秒)
+        '''
+        self.command = command
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.crash_limit = crash_limit
+        self.crash_window = crash_window
+        self.stop_timeout = stop_timeout
+        self.start_timeout = start_timeout
+        self.supports_handover = os.name != 'nt'
+        self.listener = None
+        if host is not None and self.supports_handover:
+            self.listener = socket.create_server((host, port), family=socket.AF_INET6 if ':' in host else socket.AF_INET, backlog=1024)
+            self.listener.set_inheritable(True)
+        self.workers = max(1, workers) if self.listener is not None else 1
+        if self.workers < workers:
+            u.warning(f'[supervisor] cannot share the listening socket here, running 1 worker instead of {workers}')
+        self.children: list = [None] * self.workers  # 每个位置当前的子进程
+        self.restart_at: list = [None] * self.workers  # 崩溃后计划重启的时间
+        self.consecutive: list = [0] * self.workers  # 连续崩溃次数 (用于退避)
+        self.crashes: deque = deque()
+        self.starts: int = 0
+        self._stopping = False
+        self._reload = False
+
+    def _spawn(self, slot: int) -> Child:
+        env = dict(os.environ)
+        pass_fds = []
+        control = None
+        env[WORKER_ID_ENV] = str(slot)
+        if self.supports_handover:
+            control, child_end = socket.socketpair()
+            child_end.set_inheritable(True)
+            pass_fds.append(child_end.fileno())
+            env[CONTROL_FD_ENV] = str(child_end.fileno())
+            if self.listener is not None:
+                pass_fds.append(self.listener.fileno())
+                env[LISTEN_FD_ENV] = str(self.listener.fileno())
+        proc = subprocess.Popen(self.command, env=env, pass_fds=pass_fds)
+        if control is not None:
+            child_end.close()
+        self.starts += 1
+        u.info(f'[supervisor] started server #{self.starts} (pid {proc.pid}){f" as worker {slot}" if self.workers > 1 else ""}')
+        return Child(proc, control, slot)
+
+    def _start_cold(self, slots: list):
+        '''
+        启动子进程 (这些位置没有正在运行的子进程时), 同时导入, 再依次允许加载数据
+        '''
+        children = [self._spawn(slot) for slot in slots]
+        for child in children:
+            if child.wait_message(MSG_WAITING, self.start_timeout):
+                child.send(MSG_GO)
+            self.children[child.slot] = child
+
+    def _warm_restart_slot(self, slot: int) -> bool:
+        old = self.children[slot]
+        new = self._spawn(slot)
+        if not new.wait_message(MSG_WAITING, self.start_timeout):
+            u.error(f'[supervisor] new server failed to start (exit code {new.proc.poll()}), keeping pid {old.proc.pid}')
+            if new.proc.poll() is None:
+                new.proc.kill()
+                new.proc.wait()
+            new.close()
+            return False
+        start = time()
+        code = old.stop(self.stop_timeout)
+        new.send(MSG_GO)
+        self.children[slot] = new
+        u.info(f'[supervisor] handed over from pid {old.proc.pid} (exit code {code}) to pid {new.proc.pid} in {(time() - start) * 1000:.0f} ms')
+        return True
+
+    def warm_restart(self) -> bool:
+        '''
+        热重启: 新的子进程完成导入后再停止旧的子进程, 旧的子进程保存数据后新的子进程开始加载;
+        多个子进程时逐个替换
+
+        :return: 是否成功 (失败时未替换的旧子进程继续运行)
+        '''
+        for slot in range(self.workers):
+            if self.children[slot] is not None and not self._warm_restart_slot(slot):
+                return False
+        return True
+
+    def _backoff(self, slot: int) -> float:
+        return min(self.backoff_max, self.backoff_initial * 2 ** max(0, self.consecutive[slot] - 1))
+
+    def _on_exit(self, slot: int, code: int) -> float:
+        '''
+        子进程意外退出: 记录崩溃, 返回重启前的等待时间 (陷入崩溃循环时返回 None)
+        '''
+        now = time()
+        child = self.children[slot]
+        ran = now - child.started
+        child.close()
+        self.children[slot] = None
+        if ran >= self.stable_after:
+            self.consecutive[slot] = 0
+        self.consecutive[slot] += 1
+        self.crashes.append(now)
+        while self.crashes and now - self.crashes[0] > self.crash_window:
+            self.crashes.popleft()
+        if len(self.crashes) >= self.crash_limit:
+            u.error(f'[supervisor] server crashed {len(self.crashes)} times in {self.crash_window}s, giving up')
+            return None
+        delay = self._backoff(slot)
+        u.warning(f'[supervisor] server exited with code {code} after {ran:.1f}s, restarting in {delay:.2f}s')
+        return delay
+
+    def _install_signals(self):
+        def stop(signum, frame):
+            self._stopping = True
+
+        def reload(signum, frame):
+            self._reload = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, reload)
+
+    def stop_all(self):
+        '''
+        通知所有子进程保存数据并退出, 等待它们结束
+        '''
+        children = [c for c in self.children if c is not None]
+        for child in children:
+            u.info(f'[supervisor] stopping pid {child.proc.pid}')
+            child.terminate()
+        for child in children:
+            code = child.stop(self.stop_timeout)
+            u.info(f'[supervisor] server pid {child.proc.pid} exited with code {code}')
+        self.children = [None] * self.workers
+
+    def run(self) -> int:
+        '''
+        启动并守护子进程, 直到收到 SIGTERM / SIGINT 或陷入崩溃循环
+
+        :return: 退出码
+        '''
+        self._install_signals()
+        if self.listener is not None:
+            host, port = self.listener.getsockname()[:2]
+            u.info(f'[supervisor] listening on {host}:{port} with {self.workers} worker(s) (send SIGHUP to pid {os.getpid()} for a warm restart)')
+        self._start_cold(list(range(self.workers)))
+        try:
+            while not self._stopping:
+                if self._reload:
+                    self._reload = False
+                    self.warm_restart()
+                now = time()
+                for slot, child in enumerate(self.children):
+                    if child is not None:
+                        code = child.proc.poll()
+                        if code is not None:
+                            delay = self._on_exit(slot, code)
+                            if delay is None:
+                                return 1
+                            self.restart_at[slot] = now + delay
+                    elif self.restart_at[slot] is not None and now >= self.restart_at[slot]:
+                        self.restart_at[slot] = None
+                        self._start_cold([slot])
+                sleep(0.05)
+        finally:
+            self.stop_all()
+            if self.listener is not None:
+                self.listener.close()
+        return 0
@@ -0,0 +1,146 @@
+# coding: utf-8
+'''
+性能回归检查
+
+将 `bench_data.py` 的结果与仓库中的基线 (`bench_baseline.json`) 对比:
+各项耗时先除以同一规模测量前后的校准耗时 (`calibration_ms`) 以消除机器速度差异,
+任一操作变慢超过阈值时重新运行相应的规模确认 (取两次中较快的结果), 仍然变慢则以非 0 状态码退出, 并输出对比表格;
+基线为多次完整运行中各项最快的结果
+
+用法:
+    python tools/bench_compare.py                  # 运行基准测试并与基线对比
+    python tools/bench_compare.py bench.json       # 使用已有的结果文件对比
+    python tools/bench_compare.py --update         # 运行基准测试 (默认 3 次) 并刷新基线
+'''
+import os
+import sys
+import json
+import argparse
+
+import bench_data
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+
+def calibration(result: dict, size: str, op: str) -> float:
+    '''
+    某一项的校准耗时 (旧版结果没有按项 / 规模记录时使用规模 / 整体的校准耗时)
+    '''
+    return (result['results'][size][op].get('calibration_ms')
+            or result['sizes'].get(size, {}).get('calibration_ms')
+            or result['meta'].get('calibration_ms') or 1)
+
+
+def normalized(result: dict) -> dict:
+    '''
+    {(size, op): min_ms / calibration_ms}
+    '''
+    return {
+        (size, op): st['min_ms'] / calibration(result, size, op)
+        for size, ops in result['results'].items()
+        for op, st in ops.items()
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.5, min_ms: float = 0.5) -> tuple:
+    '''
+    对比两次结果
+
+    :param threshold: 允许的相对变慢比例 (0.5 = 50%)
+    :param min_ms: 绝对差值 (按基线机器速度换算后) 小于此值时不视为回归, 避免亚毫秒级操作的噪声
+    :return: (rows, regressed) - rows 为 (size, op, base_ms, cur_ms, ratio, state) 列表
+    '''
+    base_n = normalized(baseline)
+    cur_n = normalized(current)
+    rows = []
+    regressed = False
+    for key, b in base_n.items():
+        size, op = key
+        base_ms = baseline['results'][size][op]['min_ms']
+        if key not in cur_n:
+            rows.append((size, op, base_ms, None, None, 'missing'))
+            continue
+        c = cur_n[key]
+        ratio = c / b if b else 1.0
+        # 当前耗时换算到基线机器上的值
+        cur_ms = c * calibration(baseline, size, op)
+        if ratio > 1 + threshold and cur_ms - base_ms >= min_ms:
+            state = 'REGRESSED'
+            regressed = True
+        elif ratio < 1 - threshold and base_ms - cur_ms >= min_ms:
+            state = 'improved'
+        else:
+            state = 'ok'
+        rows.append((size, op, base_ms, cur_ms, ratio, state))
+    for key in cur_n.keys() - base_n.keys():
+        size, op = key
+        base_cal = baseline['sizes'].get(size, {}).get('calibration_ms') or baseline['meta'].get('calibration_ms') or 1
+        rows.append((size, op, None, cur_n[key] * base_cal, None, 'new'))
+    return rows, regressed
+
+
+def print_table(rows: list, threshold: float):
+    print(f'{"size":<8} {"operation":<26} {"baseline ms":>12} {"current ms":>11} {"ratio":>7}  state')
+    for size, op, base_ms, cur_ms, ratio, state in rows:
+        b = f'{base_ms:.3f}' if base_ms is not None else '-'
+        c = f'{cur_ms:.3f}' if cur_ms is not None else '-'
+        r = f'{ratio:.2f}x' if ratio is not None else '-'
+        print(f'{size:<8} {op:<26} {b:>12} {c:>11} {r:>7}  {state}')
+    print(f'(current ms normalized to the baseline machine speed, threshold +{threshold:.0%})')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare data layer benchmark results against the stored baseline')
+    parser.add_argument('current', nargs='?', help='benchmark json from bench_data.py (default: run the benchmark now)')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline json (default: tools/bench_baseline.json)')
+    parser.add_argument('--threshold', type=float, default=0.5, help='allowed slowdown ratio (default: 0.5)')
+    parser.add_argument('--min-ms', type=float, default=0.5, help='ignore absolute differences below this (default: 0.5)')
+    parser.add_argument('--update', action='store_true', help='write the current results as the new baseline')
+    parser.add_argument('--runs', type=int, default=3, help='full runs for --update, the baseline keeps the best of them (default: 3)')
+    parser.add_argument('--confirm', type=int, default=1, help='reruns of regressed sizes before reporting a regression (default: 1)')
+    args = parser.parse_args()
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    if args.current:
+        with open(args.current, 'r', encoding='utf-8') as f:
+            current = json.load(f)
+    else:
+        # 与基线使用相同的规模 / 次数 / 种子
+        sizes = list(baseline['sizes']) if baseline else list(bench_data.SIZES)
+        repeat = baseline['meta']['repeat'] if baseline else 10
+        seed = baseline['meta']['seed'] if baseline else 0
+        current = bench_data.run(sizes, repeat=repeat, seed=seed)
+        if args.update:
+            for i in range(1, args.runs):
+                print(f'[bench] baseline run {i + 1}/{args.runs}', file=sys.stderr)
+                current = bench_data.best_of([current, bench_data.run(sizes, repeat=repeat, seed=seed)])
+
+    if args.update:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=4, ensure_ascii=False)
+            f.write('\n')
+        print(f'[bench] baseline updated: {args.baseline}')
+        sys.exit(0)
+
+    if not baseline:
+        print(f'[bench] baseline not found: {args.baseline} (use --update to create)', file=sys.stderr)
+        sys.exit(2)
+
+    rows, regressed = compare(baseline, current, threshold=args.threshold, min_ms=args.min_ms)
+    # 确认: 重新运行变慢的规模, 取两次中较快的结果 (使用已有结果文件时无法重新运行)
+    for _ in range(args.confirm if not args.current else 0):
+        if not regressed:
+            break
+        again = [size for size in bench_data.SIZES if any(row[0] == size and row[5] == 'REGRESSED' for row in rows)]
+        print(f'[bench] slower than baseline in {", ".join(again)}, rerunning to confirm', file=sys.stderr)
+        current = bench_data.best_of([current, bench_data.run(again, repeat=repeat, seed=seed)])
+        rows, regressed = compare(baseline, current, threshold=args.threshold, min_ms=args.min_ms)
+    print_table(rows, args.threshold)
+    if regressed:
+        print('[bench] performance regression detected!', file=sys.stderr)
+        sys.exit(1)
+    print('[bench] no regression.')
@@ -0,0 +1,334 @@
+# coding: utf-8
+'''
+data 层基准测试
+
+使用合成的设备历史 (多设备 / 应用切换 / 使用-待机比例 / 心率流) 测量 `data` 类各操作的耗时,
+结果可输出为 json, 便于在不同提交之间对比
+
+用法:
+    python tools/bench_data.py
+    python tools/bench_data.py --sizes small,medium --repeat 10 -o bench.json
+'''
+import gc
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+from time import perf_counter
+from statistics import mean, median
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+if True:
+    import pytz
+    import env
+    from data import data as data_init
+
+
+# 预设规模: 设备数 / 每设备每小时事件数 / 历史跨度 (小时)
+SIZES = {
+    'small': {'devices': 2, 'events_per_hour': 6, 'hours': 48},
+    'medium': {'devices': 5, 'events_per_hour': 30, 'hours': 48},
+    'large': {'devices': 10, 'events_per_hour': 120, 'hours': 48},
+}
+
+APPS = [
+    ('微信', 'com.tencent.mm'),
+    ('QQ', 'com.tencent.mobileqq'),
+    ('哔哩哔哩', 'tv.danmaku.bili'),
+    ('抖音', 'com.ss.android.ugc.aweme'),
+    ('Chrome', 'com.android.chrome'),
+    ('Visual Studio Code', 'code.exe'),
+    ('网易云音乐', 'com.netease.cloudmusic'),
+    ('原神', 'com.miHoYo.Yuanshen'),
+    ('Steam', 'steam.exe'),
+    ('设置', 'com.android.settings'),
+]
+
+OPERATIONS = [
+    'record_app_usage',
+    'save',
+    'load',
+    'get_app_usage_details_v2',
+    'get_app_hour_breakdown',
+    'get_app_usage_aggregate',
+]
+
+
+def generate_history(devices: int, events_per_hour: int, hours: int = 48, churn: float = 0.35,
+                     using_ratio: float = 0.7, heart_every: int = 3, seed: int = 0) -> dict:
+    '''
+    生成合成的设备历史
+
+    :param devices: 设备数量
+    :param events_per_hour: 每台设备每小时平均上报次数
+    :param hours: 历史跨度 (小时)
+    :param churn: 每次上报切换应用的概率
+    :param using_ratio: 上报为 "使用中" 的比例
+    :param heart_every: 每隔多少台设备有一台带心率上报 (手表 / 手环, 为 0 则不生成)
+    :param seed: 随机种子
+    :return: 可直接合并进 `data.data` 的 dict (`device_status` / `app_history` / `heart_history`)
+    '''
+    rnd = random.Random(seed)
+    tz = pytz.timezone(env.main.timezone)
+    now = datetime.now(tz)
+    start = now - timedelta(hours=hours)
+    # 应用热度近似 Zipf 分布
+    weights = [1 / (i + 1) for i in range(len(APPS))]
+
+    device_status = {}
+    app_history = {}
+    heart_history = {}
+    for n in range(devices):
+        device_id = f'bench-device-{n}'
+        is_phone = n % 2 == 0
+        has_heart = heart_every > 0 and n % heart_every == heart_every - 1
+        events = []
+        hearts = []
+        app, pkg = rnd.choices(APPS, weights)[0]
+        bpm = rnd.randint(60, 90)
+        t = start
+        while True:
+            t += timedelta(seconds=rnd.expovariate(events_per_hour / 3600))
+            if t >= now:
+                break
+            if rnd.random() < churn:
+                app, pkg = rnd.choices(APPS, weights)[0]
+            using = rnd.random() < using_ratio
+            if has_heart:
+                bpm = max(45, min(180, bpm + rnd.randint(-4, 4)))
+                app_name = f'{bpm} bpm'
+                app_name_only = app_name
+                pkg = ''
+                hearts.append({'time': t.isoformat(), 'value': float(bpm)})
+            elif is_phone:
+                app_name = f'电量:{rnd.randint(5, 100)}%🔋\n应用:{app}'
+                app_name_only = app
+            else:
+                app_name = app
+                app_name_only = app
+            events.append({'time': t.isoformat(), 'app_name': app_name, 'app_name_only': app_name_only, 'app_pkg': pkg, 'using': using})
+        app_history[device_id] = events
+        if hearts:
+            heart_history[device_id] = hearts
+        last = events[-1] if events else {'time': now.isoformat(), 'app_name': '', 'using': False}
+        device_status[device_id] = {
+            'show_name': f'Bench {"Phone" if is_phone else "PC"} {n}',
+            'using': last['using'],
+            'app_name': last['app_name'],
+            'offline': False,
+            'updated_at': last['time'],
+            'heart_rate': (bpm if has_heart else None),
+            'heart_updated_at': last['time']
+        }
+    return {
+        'device_status': device_status,
+        'app_history': app_history,
+        'heart_history': heart_history
+    }
+
+
+# 每个样本至少运行多久 (秒): 毫秒级的操作在一个样本中重复多次, 取平均的单次耗时;
+# 样本较短且较多, 机器速度周期性波动 (如虚拟机共享 CPU) 时最快的样本仍能落在快的时段
+MIN_TIME = 0.05
+
+
+def _calibration_load():
+    base = datetime(2025, 1, 1, 8, 0, 0)
+    counts = {}
+    for i in range(2000):
+        ts = (base + timedelta(seconds=i * 37)).isoformat()
+        t = datetime.fromisoformat(ts).timestamp()
+        key = f'app-{i % 17}'
+        counts[key] = counts.get(key, 0) + t % 3
+    json.loads(json.dumps(counts))
+
+
+def calibrate(repeat: int = 10) -> float:
+    '''
+    固定的纯 Python 负载 (json / 时间解析 / dict 操作, 与 data 层的开销构成相近),
+    与各项操作使用相同的方式计时, 返回最快样本的单次耗时 (毫秒), 用于在不同机器之间归一化结果
+    '''
+    return timeit({'calibration': _calibration_load}, repeat)['calibration']['min_ms']
+
+
+def _sample(func, loops: int, setup=None) -> float:
+    '''
+    一个样本: 连续运行 `func` `loops` 次, 返回单次耗时 (毫秒)
+    '''
+    if setup is not None:
+        setup()
+    gc.collect()
+    gc.disable()
+    try:
+        t0 = perf_counter()
+        for _ in range(loops):
+            func()
+        return (perf_counter() - t0) * 1000 / loops
+    finally:
+        gc.enable()
+
+
+def _autorange(func, setup, min_time: float) -> int:
+    scale = 1
+    while True:
+        for n in (1, 2, 5):
+            loops = n * scale
+            if _sample(func, loops, setup) * loops / 1000 >= min_time:
+                return loops
+        scale *= 10
+
+
+def timeit(funcs: dict, repeat: int, setup=None, min_time: float = MIN_TIME) -> dict:
+    '''
+    测量各函数的单次耗时 (毫秒)
+
+    与标准库 `timeit.Timer.autorange()` 相同, 先按 1, 2, 5, 10, 20, 50... 增加每个样本的运行次数,
+    直到一个样本至少运行 `min_time` 秒; 之后轮流为各函数采集样本 (共 `repeat` 轮), 每个函数的样本分散在整个测量期间,
+    机器速度短时间变慢时不会只影响某一项; 计时期间关闭垃圾回收
+
+    :param funcs: {名称: 函数}
+    :param setup: (可选) 每个样本前调用 (不计时), 如还原被操作修改的状态
+    :return: {名称: 耗时统计}
+    '''
+    loops = {name: _autorange(func, setup, min_time) for name, func in funcs.items()}
+    runs = {name: [] for name in funcs}
+    for _ in range(repeat):
+        for name, func in funcs.items():
+            runs[name].append(_sample(func, loops[name], setup))
+    return {
+        name: {
+            'min_ms': round(min(r), 4),
+            'median_ms': round(median(r), 4),
+            'mean_ms': round(mean(r), 4),
+            'runs': repeat,
+            'loops': loops[name]
+        } for name, r in runs.items()
+    }
+
+
+def bench_size(name: str, spec: dict, repeat: int, seed: int, workdir: str) -> tuple:
+    '''
+    对单个规模运行全部操作 (与校准负载轮流测量)
+
+    :return: (各操作的耗时统计, 校准耗时)
+    '''
+    d = data_init(data_file=os.path.join(workdir, f'bench_{name}.json'))
+    d.data.update(generate_history(seed=seed, **spec))
+    d.save()
+    device_id = 'bench-device-0'
+    tz = pytz.timezone(env.main.timezone)
+    hour_key = (datetime.now(tz) - timedelta(hours=1)).strftime('%Y-%m-%d %H:00')
+    apps = [a for a, _ in APPS]
+    history = list(d.data['app_history'][device_id])
+
+    def reset():
+        # record_app_usage 每次追加一条记录, 每个样本前还原, 避免历史越测越长
+        d.data['app_history'][device_id] = list(history)
+
+    ops = {
+        'record_app_usage': lambda: d.record_app_usage(device_id, random.choice(apps), True),
+        'save': d.save,
+        'load': d.load,
+        'get_app_usage_details_v2': lambda: d.get_app_usage_details_v2(device_id, 24),
+        'get_app_hour_breakdown': lambda: d.get_app_hour_breakdown(device_id, hour_key, hours=24),
+        'get_app_usage_aggregate': lambda: d.get_app_usage_aggregate(24),
+    }
+    funcs = {op: ops[op] for op in OPERATIONS}
+    funcs['calibration'] = _calibration_load
+    results = timeit(funcs, repeat, setup=reset)
+    return results, results.pop('calibration')['min_ms']
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return ''
+
+
+def run(sizes: list, repeat: int = 10, seed: int = 0) -> dict:
+    '''
+    运行基准测试, 返回可序列化的结果
+    '''
+    result = {
+        'meta': {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'seed': seed,
+            'calibration_ms': calibrate()
+        },
+        'sizes': {},
+        'results': {}
+    }
+    with tempfile.TemporaryDirectory(prefix='sleepy-bench-') as workdir:
+        for name in sizes:
+            spec = SIZES[name]
+            events = sum(len(v) for v in generate_history(seed=seed, **spec)['app_history'].values())
+            result['sizes'][name] = {**spec, 'events': events}
+            print(f'[bench] {name}: {spec["devices"]} devices, {events} events', file=sys.stderr)
+            # 校准负载与各操作轮流测量, 避免运行期间机器速度变化 (如 CPU 降频 / 其他负载) 影响归一化结果
+            ops, cal = bench_size(name, spec, repeat, seed, workdir)
+            result['sizes'][name]['calibration_ms'] = cal
+            # 每项也记录校准耗时, 合并多次运行的结果 (best_of) 后仍可归一化
+            for st in ops.values():
+                st['calibration_ms'] = cal
+            result['results'][name] = ops
+    return result
+
+
+def best_of(results: list) -> dict:
+    '''
+    合并多次 `run()` 的结果: 每项取归一化耗时 (`min_ms / calibration_ms`) 最小的一次
+    '''
+    merged = json.loads(json.dumps(results[0]))
+    for result in results[1:]:
+        for name, spec in result['sizes'].items():
+            merged['sizes'].setdefault(name, spec)
+        for name, ops in result['results'].items():
+            best = merged['results'].setdefault(name, {})
+            for op, st in ops.items():
+                cur = best.get(op)
+                if cur is None or st['min_ms'] / st['calibration_ms'] < cur['min_ms'] / cur['calibration_ms']:
+                    best[op] = st
+    merged['meta']['runs'] = merged['meta'].get('runs', 1) + sum(r['meta'].get('runs', 1) for r in results[1:])
+    return merged
+
+
+def print_table(result: dict):
+    print(f'{"size":<8} {"operation":<26} {"min (ms)":>10} {"median (ms)":>12} {"mean (ms)":>10}')
+    for name, ops in result['results'].items():
+        for op, st in ops.items():
+            print(f'{name:<8} {op:<26} {st["min_ms"]:>10.3f} {st["median_ms"]:>12.3f} {st["mean_ms"]:>10.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the data layer with synthetic device histories')
+    parser.add_argument('--sizes', default=','.join(SIZES), help=f'comma-separated sizes ({", ".join(SIZES)})')
+    parser.add_argument('--repeat', type=int, default=10, help='samples per operation')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the history generator')
+    parser.add_argument('-o', '--output', help='write results as json to this file')
+    args = parser.parse_args()
+
+    sizes = [s.strip() for s in args.sizes.split(',') if s.strip()]
+    for s in sizes:
+        if s not in SIZES:
+            parser.error(f'unknown size: {s}')
+
+    result = run(sizes, repeat=args.repeat, seed=args.seed)
+    print_table(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=4, ensure_ascii=False)
+        print(f'[bench] results written to {args.output}', file=sys.stderr)
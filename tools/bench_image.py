@@ -0,0 +1,106 @@
+# coding: utf-8
+'''
+设备状态图片渲染的基准测试
+
+测量 `image_renderer` 在不同数量的卡片发生变化时的渲染耗时:
+未变化的卡片直接使用缓存的图块, 只有变化的卡片需要重新绘制
+
+用法:
+    python tools/bench_image.py
+    python tools/bench_image.py --devices 12 --repeat 20 -o bench_image.json
+'''
+import os
+import sys
+import json
+import argparse
+from time import perf_counter
+from statistics import median
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+if True:
+    import image_renderer as ir
+
+
+def make_models(devices: int, version: int = 0, changed: int = 0) -> list:
+    '''
+    生成视图模型列表, 前 `changed` 个设备的当前应用带上 `version`
+    '''
+    models = []
+    for i in range(devices):
+        app = f'App {i}' if i >= changed else f'App {i} v{version}'
+        models.append({
+            'id': f'device-{i}',
+            'name': f'Device {i}',
+            'type': ('手机', '电脑', '其他')[i % 3],
+            'platform': '—',
+            'online_status': ('在线', '离线', '待机')[i % 3],
+            'current_app': app,
+            'app_status': '运行中',
+            'last_active': '—',
+            'battery_percent': (i * 17) % 101,
+        })
+    return models
+
+
+def bench(devices: int, changed: int, repeat: int) -> dict:
+    '''
+    :return: {'compose_ms': 拼接耗时中位数, 'total_ms': 含 PNG 编码的耗时中位数}
+    '''
+    ir.clear_tile_cache()
+    ir.compose_device_usage_image(make_models(devices))  # 预热: 所有卡片进入缓存
+    compose, total = [], []
+    devnull = open(os.devnull, 'wb')
+    for r in range(repeat):
+        models = make_models(devices, version=r + 1, changed=changed)
+        start = perf_counter()
+        img = ir.compose_device_usage_image(models)
+        mid = perf_counter()
+        img.save(devnull, format='PNG')
+        end = perf_counter()
+        compose.append((mid - start) * 1000)
+        total.append((end - start) * 1000)
+    devnull.close()
+    return {'compose_ms': round(median(compose), 3), 'total_ms': round(median(total), 3)}
+
+
+def run(devices: int = 8, repeat: int = 10) -> dict:
+    ir.warm_up()
+    results = {}
+    for changed in range(devices + 1):
+        results[changed] = bench(devices, changed, repeat)
+    # 不使用缓存 (每次清空) 作为对照
+    full = []
+    for r in range(repeat):
+        ir.clear_tile_cache()
+        start = perf_counter()
+        ir.compose_device_usage_image(make_models(devices, version=r))
+        full.append((perf_counter() - start) * 1000)
+    return {
+        'devices': devices,
+        'repeat': repeat,
+        'uncached_compose_ms': round(median(full), 3),
+        'results': results
+    }
+
+
+def print_table(result: dict):
+    print(f'{result["devices"]} devices, uncached compose: {result["uncached_compose_ms"]:.3f} ms')
+    print(f'{"changed":>8} {"compose ms":>11} {"total ms":>9}')
+    for changed, st in result['results'].items():
+        print(f'{changed:>8} {st["compose_ms"]:>11.3f} {st["total_ms"]:>9.3f}')
+    print('(total = compose + PNG encoding)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark status image rendering against the number of changed cards')
+    parser.add_argument('--devices', type=int, default=8, help='number of device cards (default: 8)')
+    parser.add_argument('--repeat', type=int, default=10, help='runs per case (default: 10)')
+    parser.add_argument('-o', '--output', help='write results as json')
+    args = parser.parse_args()
+
+    result = run(args.devices, args.repeat)
+    print_table(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=4, ensure_ascii=False)
+        print(f'[bench] results saved to {args.output}')
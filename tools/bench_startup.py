@@ -0,0 +1,110 @@
+# coding: utf-8
+'''
+冷启动基准测试
+
+在新的 Python 进程中导入 `server` 并处理第一个请求 (模拟 Vercel 等无服务器环境的冷启动), 输出:
+- 进程启动到第一个响应的总耗时 (含解释器启动)
+- `import server` 耗时 / 第一个请求的耗时
+- `python -X importtime` 统计的最耗时的模块 (累计耗时)
+
+用法:
+    python tools/bench_startup.py
+    python tools/bench_startup.py --path /query --runs 10 --top 15 -o startup.json
+
+> 子进程使用主程序目录下的 data.json (不存在时会创建)
+'''
+import os
+import sys
+import json
+import argparse
+import subprocess
+from time import perf_counter
+from statistics import median
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# 子进程中运行的代码: 导入 server 并请求一次, 输出耗时
+CHILD = '''
+import json, sys
+from time import perf_counter
+start = perf_counter()
+import server
+imported = perf_counter()
+resp = server.app.test_client().get(sys.argv[1])
+done = perf_counter()
+sys.stderr.flush()
+print('\\n@@' + json.dumps({'status': resp.status_code, 'import_ms': (imported - start) * 1000, 'first_request_ms': (done - imported) * 1000}))
+'''
+
+
+def run_once(path: str) -> dict:
+    '''
+    启动一个子进程, 返回 {'total_ms', 'import_ms', 'first_request_ms', 'status'}
+    '''
+    start = perf_counter()
+    proc = subprocess.run([sys.executable, '-c', CHILD, path], cwd=ROOT, capture_output=True, text=True)
+    total = (perf_counter() - start) * 1000
+    for line in proc.stdout.splitlines():
+        if line.startswith('@@'):
+            ret = json.loads(line[2:])
+            ret['total_ms'] = total
+            return ret
+    raise RuntimeError(f'child process failed:\n{proc.stdout}\n{proc.stderr}')
+
+
+def import_times(top: int = 15) -> list:
+    '''
+    使用 `-X importtime` 统计导入 server 时各个顶层模块的累计耗时
+
+    :return: [(模块名, 累计耗时 ms)], 按耗时倒序
+    '''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import server'], cwd=ROOT, capture_output=True, text=True)
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # 只统计第一层 (缩进为 1 个空格) 的模块, 子模块已包含在累计耗时中
+        if name.startswith(' ') and not name.startswith('  '):
+            modules.append((name.strip(), int(cumulative) / 1000))
+    modules.sort(key=lambda x: x[1], reverse=True)
+    return modules[:top]
+
+
+def run(path: str = '/', runs: int = 5, top: int = 15) -> dict:
+    samples = [run_once(path) for _ in range(runs)]
+    return {
+        'path': path,
+        'runs': runs,
+        'status': samples[-1]['status'],
+        'total_ms': round(median(s['total_ms'] for s in samples), 1),
+        'import_ms': round(median(s['import_ms'] for s in samples), 1),
+        'first_request_ms': round(median(s['first_request_ms'] for s in samples), 1),
+        'modules': [{'name': n, 'cumulative_ms': round(ms, 1)} for n, ms in import_times(top)]
+    }
+
+
+def print_report(result: dict):
+    print(f'GET {result["path"]} -> {result["status"]} (median of {result["runs"]} runs)')
+    print(f'  process start -> first response: {result["total_ms"]:8.1f} ms')
+    print(f'  import server:                    {result["import_ms"]:8.1f} ms')
+    print(f'  first request:                    {result["first_request_ms"]:8.1f} ms')
+    print('slowest top-level imports (-X importtime, cumulative):')
+    for m in result['modules']:
+        print(f'  {m["cumulative_ms"]:8.1f} ms  {m["name"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure cold start: process start to first response, and import times')
+    parser.add_argument('--path', default='/', help='path of the first request (default: /)')
+    parser.add_argument('--runs', type=int, default=5, help='number of cold starts (default: 5)')
+    parser.add_argument('--top', type=int, default=15, help='number of modules to list (default: 15)')
+    parser.add_argument('-o', '--output', help='write results as json')
+    args = parser.parse_args()
+
+    result = run(args.path, args.runs, args.top)
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=4, ensure_ascii=False)
+        print(f'[bench] results saved to {args.output}')
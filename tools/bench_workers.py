@@ -0,0 +1,180 @@
+# coding: utf-8
+'''
+单进程 / 多进程模式的吞吐量对比
+
+分别用 `start.py --workers 1` 和 `start.py --workers N` 启动服务 (随机端口, 共享存储放在临时目录),
+由多个客户端进程 (避免客户端自身受 GIL 限制) 持续发送请求: 大部分为 `/query` 和主页, 少量为 `/device/set`,
+输出每种模式的吞吐量 / 延迟 / 错误数, 并检查多进程模式下写入后立即从任意进程读到的状态是否一致
+
+用法:
+    python tools/bench_workers.py
+    python tools/bench_workers.py --workers 1,2,4 --clients 8 --duration 15 -o workers.json
+
+> 会临时使用主程序目录下的 data.json, 结束后恢复 (仅支持 Linux / macOS)
+'''
+import os
+import sys
+import json
+import random
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import subprocess
+import http.client
+import multiprocessing
+from time import sleep, perf_counter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DATA = os.path.join(ROOT, 'data.json')
+SECRET = 'bench-workers'
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def request(port: int, method: str, path: str, body: dict = None, timeout: float = 10):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        raw = json.dumps(body).encode('utf-8') if body is not None else None
+        conn.request(method, path, body=raw, headers={'Content-Type': 'application/json'} if raw else {})
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+    finally:
+        conn.close()
+
+
+def client(port: int, duration: float, write_ratio: float, seed: int, queue):
+    '''
+    客户端进程: 在 `duration` 秒内不断发送请求, 结束后通过 queue 返回延迟列表和错误数
+    '''
+    rnd = random.Random(seed)
+    latencies = {'read': [], 'write': []}
+    errors = 0
+    deadline = perf_counter() + duration
+    while perf_counter() < deadline:
+        if rnd.random() < write_ratio:
+            kind, method, path = 'write', 'POST', '/device/set'
+            body = {'secret': SECRET, 'id': f'device-{rnd.randrange(5)}', 'show_name': 'bench', 'using': True, 'app_name': f'App {rnd.randrange(100)}'}
+        else:
+            kind, method, body = 'read', 'GET', None
+            path = '/query' if rnd.random() < 0.8 else '/'
+        start = perf_counter()
+        try:
+            code, _ = request(port, method, path, body)
+            if code != 200:
+                errors += 1
+        except OSError:
+            errors += 1
+        latencies[kind].append(perf_counter() - start)
+    queue.put((latencies, errors))
+
+
+def pct(values: list, p: float):
+    if not values:
+        return None
+    s = sorted(values)
+    return round(s[min(len(s) - 1, int(len(s) * p))] * 1000, 2)
+
+
+def run_mode(workers: int, clients: int, duration: float, write_ratio: float, store: str) -> dict:
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'SLEEPY_MAIN_HOST': '127.0.0.1',
+        'SLEEPY_MAIN_PORT': str(port),
+        'SLEEPY_SECRET': SECRET,
+        'SLEEPY_MAIN_STATE_STORE': store,
+        'SLEEPY_UTIL_TRACE_SAMPLE_RATE': '0'
+    })
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'start.py'), '--workers', str(workers)], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = perf_counter() + 60
+        while True:
+            try:
+                if request(port, 'GET', '/query', timeout=2)[0] == 200:
+                    break
+            except OSError:
+                if perf_counter() > deadline:
+                    raise RuntimeError(f'server with {workers} workers did not start')
+                sleep(0.2)
+        sleep(1)  # 等待所有进程就绪
+
+        queue = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=client, args=(port, duration, write_ratio, i, queue)) for i in range(clients)]
+        for p in procs:
+            p.start()
+        results = [queue.get() for _ in procs]
+        for p in procs:
+            p.join()
+        reads = [x for r in results for x in r[0]['read']]
+        writes = [x for r in results for x in r[0]['write']]
+
+        # 写入后立即读取: 每个进程都应读到最新的状态
+        stale = 0
+        for i in range(20):
+            request(port, 'POST', '/device/set', {'secret': SECRET, 'id': 'check', 'show_name': 'check', 'using': True, 'app_name': f'final-{i}'})
+            for _ in range(workers * 2):
+                _, raw = request(port, 'GET', '/query')
+                if json.loads(raw)['device']['check']['app_name'] != f'final-{i}':
+                    stale += 1
+        return {
+            'workers': workers,
+            'requests': len(reads) + len(writes),
+            'rps': round((len(reads) + len(writes)) / duration, 1),
+            'read_p50_ms': pct(reads, 0.5),
+            'read_p95_ms': pct(reads, 0.95),
+            'write_p50_ms': pct(writes, 0.5),
+            'write_p95_ms': pct(writes, 0.95),
+            'errors': sum(r[1] for r in results),
+            'stale_reads': stale
+        }
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main(workers: list, clients: int, duration: float, write_ratio: float) -> list:
+    backup = None
+    if os.path.exists(DATA):
+        backup = tempfile.mktemp(suffix='.json')
+        shutil.copy2(DATA, backup)
+    tmp = tempfile.mkdtemp()
+    try:
+        return [run_mode(n, clients, duration, write_ratio, f'sqlite:{os.path.join(tmp, f"state-{n}.db")}') for n in workers]
+    finally:
+        if backup is not None:
+            shutil.move(backup, DATA)
+        else:
+            for suffix in ('', '.bak', '.tmp'):
+                if os.path.exists(DATA + suffix):
+                    os.remove(DATA + suffix)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare throughput of start.py with 1 vs N worker processes')
+    parser.add_argument('--workers', default=f'1,{max(2, os.cpu_count() or 1)}', help='comma separated worker counts (default: 1,<cpu count>)')
+    parser.add_argument('--clients', type=int, default=8, help='number of client processes (default: 8)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per mode (default: 10)')
+    parser.add_argument('--write-ratio', type=float, default=0.05, help='fraction of /device/set requests (default: 0.05)')
+    parser.add_argument('-o', '--output', help='write results as json')
+    args = parser.parse_args()
+
+    results = main([int(n) for n in args.workers.split(',')], args.clients, args.duration, args.write_ratio)
+    print(f'{os.cpu_count()} cpu(s), {args.clients} clients, {args.duration:.0f}s per mode, {args.write_ratio:.0%} writes')
+    print(f'{"workers":>8} {"req/s":>9} {"read p50":>9} {"read p95":>9} {"write p50":>10} {"write p95":>10} {"errors":>7} {"stale":>6}')
+    for r in results:
+        print(f'{r["workers"]:>8} {r["rps"]:>9} {r["read_p50_ms"]:>9} {r["read_p95_ms"]:>9} {r["write_p50_ms"]:>10} {r["write_p95_ms"]:>10} {r["errors"]:>7} {r["stale_reads"]:>6}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+        print(f'[bench] results saved to {args.output}')
@@ -0,0 +1,232 @@
+# coding: utf-8
+'''
+本地模拟的 DG-Lab 控制器 (`/api/v2/game/all/action/fire`)
+
+用于在没有真实控制器的情况下测试 `/dglab/lightning`:
+可设置响应延迟 / 失败比例 / 完全不响应, 检查超时和后台任务的处理
+
+用法:
+    python tools/fake_dglab.py                       # 监听 127.0.0.1:8920 (与 DGLab.json 默认地址一致)
+    python tools/fake_dglab.py --delay 2 --fail 0.3  # 每次响应前等待 2 秒, 30% 的请求返回 500
+    python tools/fake_dglab.py --hang                # 接受连接但不响应 (测试读取超时)
+    python tools/fake_dglab.py --selftest            # 启动模拟控制器并测试调度器, 输出结果
+'''
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from time import sleep, perf_counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIRE_PATH = '/api/v2/game/all/action/fire'
+
+
+class FakeDGLab(ThreadingHTTPServer):
+    '''
+    模拟控制器, 记录收到的请求数和连接数 (用于确认连接复用)
+    '''
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, delay: float = 0, fail: float = 0, hang: bool = False):
+        super().__init__((host, port), FireHandler)
+        self.delay = delay
+        self.fail = fail
+        self.hang = hang
+        self.requests: list = []
+        self.connections: int = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{FIRE_PATH}'
+
+    def start(self) -> threading.Thread:
+        t = threading.Thread(target=self.serve_forever, daemon=True)
+        t.start()
+        return t
+
+
+class FireHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持 keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code: int, body: dict):
+        raw = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if self.path != FIRE_PATH:
+            self._reply(404, {'status': 0, 'code': 'ERR::NOT_FOUND'})
+            return
+        try:
+            body = json.loads(raw or b'{}')
+        except ValueError:
+            self._reply(400, {'status': 0, 'code': 'ERR::INVALID_JSON'})
+            return
+        with self.server.lock:
+            self.server.requests.append(body)
+        if self.server.hang:
+            sleep(3600)
+            return
+        if self.server.delay:
+            sleep(self.server.delay)
+        if random.random() < self.server.fail:
+            self._reply(500, {'status': 0, 'code': 'ERR::INTERNAL'})
+            return
+        self._reply(200, {'status': 1, 'code': 'OK', 'successClientIds': ['fake']})
+
+
+def selftest(jobs: int = 20) -> bool:
+    '''
+    启动模拟控制器, 用调度器发送请求并检查: 结果正确 / 连接被复用 / 超时生效
+    '''
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    import dglab_api
+    from dglab_dispatcher import DGLabDispatcher, Cooldown
+
+    ok = True
+
+    def check(name: str, cond: bool, detail: str = ''):
+        nonlocal ok
+        ok = ok and cond
+        print(f'[{"PASS" if cond else "FAIL"}] {name} {detail}')
+
+    server = FakeDGLab()
+    server.start()
+    tmp = tempfile.mkdtemp()
+    config_path = os.path.join(tmp, 'DGLab.json')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'api': {'url': server.url},
+            'scheduler': {'window': 0, 'global_cooldown': 0, 'client_cooldown': 0, 'max_queue': 1000}
+        }, f)
+    dglab_api.init_config(config_path, check_interval=0)
+    try:
+        dispatcher = DGLabDispatcher(workers=2, max_pending=jobs, connect_timeout=1, read_timeout=1)
+        start = perf_counter()
+        ids = [dispatcher.submit()['id'] for _ in range(jobs)]
+        submit_ms = (perf_counter() - start) * 1000
+        results = [dispatcher.get(i, wait=5) for i in ids]
+        check('all jobs done', all(r['status'] == 'done' for r in results))
+        check('all jobs succeeded', all(r['result']['success'] for r in results), str(dispatcher.stats()))
+        check('requests received', len(server.requests) == jobs, f'({len(server.requests)}/{jobs})')
+        check('connections reused', server.connections <= 2, f'({server.connections} connections for {jobs} requests)')
+        check('submit does not block', submit_ms < 500, f'({submit_ms:.1f} ms for {jobs} jobs)')
+
+        server.fail = 1
+        r = dispatcher.get(dispatcher.submit()['id'], wait=5)
+        check('controller error reported', r['status'] == 'done' and not r['result']['success'], r['result']['message'])
+
+        server.fail = 0
+        server.hang = True
+        start = perf_counter()
+        r = dispatcher.get(dispatcher.submit()['id'], wait=5)
+        elapsed = perf_counter() - start
+        check('hung controller times out', r['status'] == 'done' and not r['result']['success'] and elapsed < 3,
+              f'({elapsed:.2f} s, {r["result"]["message"]})')
+        server.hang = False
+        dispatcher.shutdown()
+
+        # 调度: 合并窗口 / 全局冷却 / 访客冷却
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'api': {'url': server.url},
+                'scheduler': {'window': 0.2, 'merge': 'max', 'global_cooldown': 0.5, 'client_cooldown': 10, 'client_burst': 2, 'max_queue': 2}
+            }, f)
+        dglab_api.init_config(config_path, check_interval=0)
+        dispatcher = DGLabDispatcher(workers=2, max_pending=1000, connect_timeout=1, read_timeout=1)
+        before = len(server.requests)
+        clicks = 200
+        start = perf_counter()
+        ids = []
+        for i in range(clicks):
+            ids.append(dispatcher.submit(f'viewer-{i % 100}')['id'])
+        results = [dispatcher.get(i, wait=10) for i in ids]
+        elapsed = perf_counter() - start
+        fired = len(server.requests) - before
+        check('burst coalesced', all(r['result']['success'] for r in results) and fired <= 2,
+              f'({clicks} clicks -> {fired} fires in {elapsed:.2f} s, {dispatcher.stats()})')
+        merged = results[0]['result']['data_sent']
+        check('merged command sent', server.requests[-1] == merged, str(merged))
+        try:
+            dispatcher.submit('viewer-0')
+            check('client cooldown enforced', False)
+        except Cooldown as e:
+            check('client cooldown enforced', True, f'(retry after {e.retry_after:.1f} s)')
+        dispatcher.shutdown()
+
+        # 多个控制器: 并发发送 / 部分失败
+        slow = FakeDGLab(delay=0.5)
+        broken = FakeDGLab(fail=1)
+        for extra in (slow, broken):
+            extra.start()
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'targets': [
+                    {'name': 'main', 'url': server.url},
+                    {'name': 'slow', 'url': slow.url, 'weight': 0.5},
+                    {'name': 'slow-2', 'url': slow.url, 'time': {'min': 1, 'max': 1}},
+                    {'name': 'broken', 'url': broken.url}
+                ],
+                'strength': {'min': 40, 'max': 40},
+                'scheduler': {'window': 0, 'global_cooldown': 0, 'client_cooldown': 0}
+            }, f)
+        dglab_api.init_config(config_path, check_interval=0)
+        dispatcher = DGLabDispatcher(workers=2, connect_timeout=1, read_timeout=1)
+        start = perf_counter()
+        r = dispatcher.get(dispatcher.submit()['id'], wait=5)['result']
+        elapsed = perf_counter() - start
+        per_target = {t['name']: t for t in r['targets']}
+        check('fan-out is concurrent', elapsed < 0.9, f'({elapsed:.2f} s with two 0.5 s targets)')
+        check('partial failure reported', r['success'] and r['partial'] and not per_target['broken']['success'], r['message'])
+        check('per-target weight / range applied',
+              per_target['slow']['data_sent']['strength'] == 20 and per_target['slow-2']['data_sent']['time'] == 1000,
+              str({k: t['data_sent'] for k, t in per_target.items()}))
+        dispatcher.shutdown()
+        slow.shutdown()
+        broken.shutdown()
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stand-in DG-Lab controller for testing /dglab/lightning')
+    parser.add_argument('--host', default='127.0.0.1', help='listen host (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8920, help='listen port (default: 8920)')
+    parser.add_argument('--delay', type=float, default=0, help='seconds to wait before each response')
+    parser.add_argument('--fail', type=float, default=0, help='fraction of requests answered with 500 (0-1)')
+    parser.add_argument('--hang', action='store_true', help='accept requests but never respond')
+    parser.add_argument('--selftest', action='store_true', help='run the dispatcher against a temporary instance and exit')
+    args = parser.parse_args()
+
+    if args.selftest:
+        sys.exit(0 if selftest() else 1)
+
+    server = FakeDGLab(args.host, args.port, delay=args.delay, fail=args.fail, hang=args.hang)
+    print(f'[fake-dglab] listening on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f'[fake-dglab] {len(server.requests)} requests, {server.connections} connections')
@@ -0,0 +1,317 @@
+# coding: utf-8
+'''
+端到端压力测试
+
+模拟 K 个设备客户端按真实节奏上报 `/device/set` (Magisk 多行 app_name / 电量 / 心率),
+以及 V 个访客打开主页、保持 `/events` 连接并像 `get.js` 一样点击查看 `/device/history`,
+输出各路由的吞吐量、p50/p95/p99 延迟、错误率, 以及服务端 CPU / RSS 随时间的变化
+
+用法:
+    python tools/load_test.py --agents 20 --viewers 50 --duration 60
+    python tools/load_test.py --url http://127.0.0.1:9010 --pid 12345 --secret xxx
+'''
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import threading
+from time import sleep, time, perf_counter
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+if True:
+    import env
+    from bench_data import APPS
+
+
+class Stats:
+    '''
+    线程安全的按路由统计
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes: dict = {}
+
+    def add(self, route: str, latency: float, ok: bool):
+        with self.lock:
+            r = self.routes.setdefault(route, {'latency': [], 'errors': 0})
+            r['latency'].append(latency)
+            if not ok:
+                r['errors'] += 1
+
+    def report(self, duration: float) -> dict:
+        ret = {}
+        with self.lock:
+            for route, r in sorted(self.routes.items()):
+                lat = sorted(r['latency'])
+                n = len(lat)
+                if not n:
+                    continue
+
+                def pct(p):
+                    return round(lat[min(n - 1, int(n * p))] * 1000, 2)
+                ret[route] = {
+                    'requests': n,
+                    'rps': round(n / duration, 2),
+                    'p50_ms': pct(0.50),
+                    'p95_ms': pct(0.95),
+                    'p99_ms': pct(0.99),
+                    'errors': r['errors'],
+                    'error_rate': round(r['errors'] / n, 4)
+                }
+        return ret
+
+
+class ProcSampler(threading.Thread):
+    '''
+    每秒采样一次指定进程的 CPU 占用和 RSS (读取 /proc, 仅 Linux 可用)
+    '''
+
+    def __init__(self, pid: int, interval: float = 1.0):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples: list = []
+        self.stop_event = threading.Event()
+        self.tick = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self.page = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def read(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / self.tick  # utime + stime
+        with open(f'/proc/{self.pid}/statm') as f:
+            rss = int(f.read().split()[1]) * self.page
+        return cpu, rss
+
+    def run(self):
+        try:
+            last_cpu, _ = self.read()
+        except Exception as e:
+            print(f'[load] cannot sample pid {self.pid}: {e}', file=sys.stderr)
+            return
+        start = last_t = time()
+        while not self.stop_event.wait(self.interval):
+            try:
+                cpu, rss = self.read()
+            except Exception:
+                break
+            now = time()
+            self.samples.append({
+                't': round(now - start, 1),
+                'cpu_percent': round((cpu - last_cpu) / (now - last_t) * 100, 1),
+                'rss_mb': round(rss / 1024 / 1024, 1)
+            })
+            last_cpu, last_t = cpu, now
+
+
+def make_payload(rnd: random.Random, device_id: str, kind: str, state: dict) -> dict:
+    '''
+    构造与各客户端一致的 `/device/set` 请求体
+    '''
+    if rnd.random() < 0.35 or 'app' not in state:
+        state['app'], state['pkg'] = rnd.choice(APPS)
+    state['battery'] = max(1, state.get('battery', rnd.randint(30, 100)) - rnd.choice((0, 0, 1)))
+    using = rnd.random() < 0.75
+    if kind == 'phone':
+        # magisk/service.sh
+        return {
+            'id': device_id,
+            'show_name': f'Load Phone {device_id}',
+            'using': using,
+            'app_name': f'电量:{state["battery"]}%🔋\n应用:{state["app"]}',
+            'app_name_only': state['app'],
+            'app_pkg': state['pkg']
+        }
+    elif kind == 'watch':
+        state['bpm'] = max(45, min(180, state.get('bpm', 75) + rnd.randint(-4, 4)))
+        return {
+            'id': device_id,
+            'show_name': f'Load Watch {device_id}',
+            'using': True,
+            'app_name': f'{state["bpm"]} bpm'
+        }
+    else:
+        # win_device.py
+        return {
+            'id': device_id,
+            'show_name': f'Load PC {device_id}',
+            'using': using,
+            'app_name': f'{state["app"]} [🔋{state["battery"]}%]'
+        }
+
+
+def agent(n: int, base: str, secret: str, interval: float, stats: Stats, stop: threading.Event, seed: int):
+    rnd = random.Random(seed + n)
+    kind = ('phone', 'pc', 'watch')[n % 3]
+    device_id = f'load-{kind}-{n}'
+    state = {}
+    s = requests.Session()
+    s.headers['Sleepy-Secret'] = secret
+    # 错开首次上报
+    if stop.wait(rnd.uniform(0, interval)):
+        return
+    while not stop.is_set():
+        t0 = perf_counter()
+        try:
+            r = s.post(f'{base}/device/set', json=make_payload(rnd, device_id, kind, state), timeout=30)
+            ok = r.status_code == 200
+        except Exception:
+            ok = False
+        stats.add('/device/set', perf_counter() - t0, ok)
+        stop.wait(rnd.expovariate(1 / interval))
+
+
+def sse_listener(base: str, stats: Stats, stop: threading.Event, counter: dict):
+    t0 = perf_counter()
+    try:
+        with requests.get(f'{base}/events', stream=True, timeout=(10, 60)) as r:
+            stats.add('/events', perf_counter() - t0, r.status_code == 200)
+            for line in r.iter_lines(decode_unicode=True):
+                if stop.is_set():
+                    break
+                if line and line.startswith('event: update'):
+                    with stats.lock:
+                        counter['updates'] += 1
+    except Exception:
+        if not stop.is_set():
+            stats.add('/events', perf_counter() - t0, False)
+
+
+def viewer(n: int, base: str, think: float, stats: Stats, stop: threading.Event, seed: int, counter: dict):
+    rnd = random.Random(seed * 1000 + n)
+    s = requests.Session()
+
+    def get(route: str, path: str):
+        t0 = perf_counter()
+        try:
+            r = s.get(f'{base}{path}', timeout=30)
+            ok = r.status_code == 200
+        except Exception:
+            r, ok = None, False
+        stats.add(route, perf_counter() - t0, ok)
+        return r
+
+    if stop.wait(rnd.uniform(0, think)):
+        return
+    # 打开页面: 主页 + 首次 /query + SSE
+    get('/', '/')
+    threading.Thread(target=sse_listener, args=(base, stats, stop, counter), daemon=True).start()
+    r = get('/query', '/query')
+    devices = []
+    try:
+        devices = list(r.json()['device'])
+    except Exception:
+        pass
+    hours = 24
+    while not stop.wait(rnd.expovariate(1 / think)):
+        if rnd.random() < 0.15:
+            # 切换心率时间范围 (get.js: heart-range-btn)
+            hours = rnd.choice((1, 6, 12, 24, 48))
+        if rnd.random() < 0.1 or not devices:
+            # 刷新按钮
+            r = get('/query', '/query')
+            try:
+                devices = list(r.json()['device'])
+            except Exception:
+                pass
+            continue
+        device_id = rnd.choice(devices)
+        get('/device/history', f'/device/history?id={requests.utils.quote(device_id)}&hours={hours}')
+
+
+def start_inprocess():
+    '''
+    在当前进程中启动 Flask app (使用临时状态文件, 不影响 data.json)
+    '''
+    from werkzeug.serving import make_server
+    # 必须在 import server 之前设置: server 在导入时就会加载状态文件并启动定时保存
+    env.main.data_file = os.path.join(tempfile.mkdtemp(prefix='sleepy-load-'), 'data.json')
+    import server
+    srv = make_server('127.0.0.1', 0, server.app, threaded=True)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f'http://127.0.0.1:{srv.server_port}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate device agents and dashboard viewers against a sleepy server')
+    parser.add_argument('--url', help='target a running server (default: start the app in-process)')
+    parser.add_argument('--pid', type=int, help='server pid to sample CPU/RSS from (default: own pid when in-process)')
+    parser.add_argument('--secret', default=env.main.secret, help='secret used by the agents (default: from env)')
+    parser.add_argument('--agents', type=int, default=10, help='number of device agents (K)')
+    parser.add_argument('--viewers', type=int, default=20, help='number of dashboard viewers (V)')
+    parser.add_argument('--agent-interval', type=float, default=5.0, help='mean seconds between device reports')
+    parser.add_argument('--viewer-think', type=float, default=3.0, help='mean seconds between viewer clicks')
+    parser.add_argument('--duration', type=float, default=30.0, help='test duration in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write the report as json to this file')
+    args = parser.parse_args()
+
+    srv = None
+    if args.url:
+        base = args.url.rstrip('/')
+        pid = args.pid
+    else:
+        srv, base = start_inprocess()
+        pid = args.pid or os.getpid()
+        print('[load] in-process mode: CPU/RSS include the load generator itself', file=sys.stderr)
+    print(f'[load] target: {base}, {args.agents} agents, {args.viewers} viewers, {args.duration}s', file=sys.stderr)
+
+    stats = Stats()
+    counter = {'updates': 0}
+    stop = threading.Event()
+    sampler = None
+    if pid and os.path.exists(f'/proc/{pid}'):
+        sampler = ProcSampler(pid)
+        sampler.start()
+
+    threads = [
+        threading.Thread(target=agent, args=(i, base, args.secret, args.agent_interval, stats, stop, args.seed), daemon=True)
+        for i in range(args.agents)
+    ] + [
+        threading.Thread(target=viewer, args=(i, base, args.viewer_think, stats, stop, args.seed, counter), daemon=True)
+        for i in range(args.viewers)
+    ]
+    start = time()
+    for t in threads:
+        t.start()
+    try:
+        sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    duration = time() - start
+    if sampler:
+        sampler.stop_event.set()
+
+    routes = stats.report(duration)
+    total = sum(r['requests'] for r in routes.values())
+    report = {
+        'target': base,
+        'duration': round(duration, 1),
+        'agents': args.agents,
+        'viewers': args.viewers,
+        'total_requests': total,
+        'rps': round(total / duration, 2),
+        'sse_updates_received': counter['updates'],
+        'routes': routes,
+        'server': sampler.samples if sampler else []
+    }
+
+    print(f'{"route":<18} {"reqs":>7} {"rps":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"errors":>7}')
+    for route, r in routes.items():
+        print(f'{route:<18} {r["requests"]:>7} {r["rps"]:>8.2f} {r["p50_ms"]:>9.2f} {r["p95_ms"]:>9.2f} {r["p99_ms"]:>9.2f} {r["errors"]:>7}')
+    print(f'total: {total} requests, {report["rps"]} req/s, {counter["updates"]} SSE updates received')
+    if report['server']:
+        print(f'{"t (s)":>6} {"cpu %":>7} {"rss MB":>8}')
+        for smp in report['server']:
+            print(f'{smp["t"]:>6} {smp["cpu_percent"]:>7} {smp["rss_mb"]:>8}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+    if srv:
+        srv.shutdown()
@@ -0,0 +1,257 @@
+# coding: utf-8
+'''
+只读副本检查
+
+在本机随机端口上启动一个主实例和两个只读副本 (一个转发修改, 一个拒绝修改), 检查:
+- 副本启动后的状态与主实例一致, 主实例的修改很快出现在副本上 (输出传播延迟)
+- 副本上的 `/device/history`、主页、`/events` 使用同步的数据
+- 通过副本发送的修改转发到主实例, 随后从同一个副本能立即读到; 拒绝模式返回 403, secret 错误返回 401
+- `/metrics` 中的复制延迟; 主实例停止时延迟增加, 重启后副本重新加载快照并继续同步
+
+用法:
+    python tools/replica_check.py                   # 主实例分别为单进程 / 多进程 (start.py --workers 2)
+    python tools/replica_check.py --primary single
+
+> 会临时使用主程序目录下的 data.json, 结束后恢复 (仅支持 Linux / macOS)
+'''
+import os
+import sys
+import json
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from time import sleep, perf_counter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DATA = os.path.join(ROOT, 'data.json')
+SECRET = 'replica-check'
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Instance:
+    '''
+    在子进程中运行的主实例 / 副本
+    '''
+
+    def __init__(self, args: list, port: int = None, **env):
+        self.args = args
+        self.port = port or free_port()
+        self.env = dict(os.environ)
+        self.env.update({
+            'SLEEPY_MAIN_HOST': '127.0.0.1',
+            'SLEEPY_MAIN_PORT': str(self.port),
+            'SLEEPY_SECRET': SECRET,
+            'SLEEPY_UTIL_METRICS': 'true',
+            'PYTHONUNBUFFERED': '1'
+        })
+        self.env.update(env)
+        self.start()
+
+    def start(self):
+        self.proc = subprocess.Popen([sys.executable, *self.args], cwd=ROOT, env=self.env,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGTERM)
+            try:
+                self.proc.wait(30)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+    def request(self, method: str, path: str, body: dict = None, timeout: float = 10):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+        try:
+            raw = json.dumps(body).encode('utf-8') if body is not None else None
+            conn.request(method, path, body=raw, headers={'Content-Type': 'application/json'} if raw else {})
+            resp = conn.getresponse()
+            return resp.status, resp.read()
+        finally:
+            conn.close()
+
+    def json(self, path: str):
+        code, raw = self.request('GET', path)
+        return json.loads(raw)
+
+    def report(self, device_id: str, app_name: str, secret: str = SECRET):
+        return self.request('POST', '/device/set', {'secret': secret, 'id': device_id, 'show_name': f'Device {device_id}', 'using': True, 'app_name': app_name})
+
+    def wait_ready(self, timeout: float = 60) -> bool:
+        deadline = perf_counter() + timeout
+        while perf_counter() < deadline:
+            try:
+                if self.request('GET', '/query', timeout=2)[0] == 200:
+                    return True
+            except OSError:
+                pass
+            if self.proc.poll() is not None:
+                return False
+            sleep(0.1)
+        return False
+
+
+def wait_until(cond, timeout: float = 5, interval: float = 0.005) -> float:
+    '''
+    :return: 条件满足所用的秒数, 超时返回 None
+    '''
+    start = perf_counter()
+    while perf_counter() - start < timeout:
+        try:
+            if cond():
+                return perf_counter() - start
+        except (OSError, KeyError, ValueError):
+            pass
+        sleep(interval)
+    return None
+
+
+def same_history(a, b, tolerance: float) -> bool:
+    '''
+    比较两次 `/device/history` 的结果: 正在使用的应用的时长随当前时间增长, 数值 (秒 / 时间戳) 允许相差 `tolerance`
+    '''
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same_history(a[k], b[k], tolerance) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same_history(x, y, tolerance) for x, y in zip(a, b))
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool) and not isinstance(b, bool):
+        return abs(a - b) <= tolerance
+    return a == b
+
+
+def run(kind: str, tmp: str) -> bool:
+    ok = True
+
+    def check(name: str, cond: bool, detail: str = ''):
+        nonlocal ok
+        ok = ok and cond
+        print(f'[{"PASS" if cond else "FAIL"}] ({kind}) {name} {detail}')
+
+    if kind == 'single':
+        primary_args = ['server.py']
+        primary_env = {}
+    else:
+        primary_args = ['start.py', '--workers', '2']
+        primary_env = {'SLEEPY_MAIN_STATE_STORE': f'sqlite:{os.path.join(tmp, f"{kind}.db")}'}
+    primary = Instance(primary_args, **primary_env)
+    replicas = []
+    try:
+        check('primary started', primary.wait_ready())
+        primary.report('phone', 'Before Replica')
+        url = f'http://127.0.0.1:{primary.port}'
+        proxy = Instance(['server.py'], SLEEPY_MAIN_REPLICA_OF=url)
+        reject = Instance(['server.py'], SLEEPY_MAIN_REPLICA_OF=url, SLEEPY_MAIN_REPLICA_WRITES='reject')
+        replicas = [proxy, reject]
+        check('replicas started', proxy.wait_ready() and reject.wait_ready())
+        p, r = primary.json('/query'), proxy.json('/query')
+        check('initial state copied', r['device'] == p['device'] and r['status'] == p['status'], f'(devices {sorted(r["device"])})')
+
+        # 传播延迟
+        delays = []
+        for i in range(20):
+            primary.report('phone', f'App {i}')
+            delays.append(wait_until(lambda: proxy.json('/query')['device']['phone']['app_name'] == f'App {i}'))
+        got = sorted(x for x in delays if x is not None)
+        check('writes propagate to replica', len(got) == len(delays),
+              f'({len(got)}/{len(delays)}, p50 {got[len(got) // 2] * 1000:.1f} ms, max {got[-1] * 1000:.1f} ms)' if got else '')
+
+        # 副本上的历史 / 主页 / SSE
+        def history_matches() -> bool:
+            start = perf_counter()
+            history = [x.json('/device/history?id=phone&hours=24')['history'] for x in (primary, proxy)]
+            return same_history(history[0], history[1], perf_counter() - start + 1)
+
+        # 重试几次: 两次请求之间跨过整点时统计窗口会移动
+        check('/device/history matches primary', wait_until(history_matches, timeout=5, interval=0.5) is not None)
+        code, page = proxy.request('GET', '/')
+        check('index page on replica', code == 200 and 'Device phone'.encode() in page, f'(HTTP {code})')
+        events = []
+
+        def listen():
+            conn = http.client.HTTPConnection('127.0.0.1', proxy.port, timeout=10)
+            try:
+                conn.request('GET', '/events')
+                resp = conn.getresponse()
+                while True:
+                    line = resp.readline()
+                    if not line:
+                        break
+                    events.append(line.decode('utf-8', 'replace'))
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+        threading.Thread(target=listen, daemon=True).start()
+        wait_until(lambda: any(line.startswith('event: update') for line in events))
+        primary.report('phone', 'SSE App')
+        check('/events on replica pushes primary writes', wait_until(lambda: any('SSE App' in line for line in events)) is not None)
+
+        # 通过副本修改
+        code, _ = proxy.report('pc', 'Via Replica')
+        r = proxy.json('/query')
+        check('write forwarded to primary', code == 200 and wait_until(lambda: primary.json('/query')['device']['pc']['app_name'] == 'Via Replica') is not None)
+        check('read-your-writes on same replica', r['device'].get('pc', {}).get('app_name') == 'Via Replica')
+        code, _ = proxy.report('pc', 'Wrong Secret', secret='wrong')
+        check('wrong secret rejected by replica', code == 401, f'(HTTP {code})')
+        code, _ = reject.report('pc', 'Rejected')
+        check('reject mode returns 403', code == 403 and primary.json('/query')['device']['pc']['app_name'] == 'Via Replica', f'(HTTP {code})')
+
+        # 复制延迟
+        m = proxy.json('/metrics')['replication']
+        check('replica lag metric', m['connected'] and m['lag_ops'] == 0 and m['lag_seconds'] == 0, str({k: m[k] for k in ('seq', 'lag_ops', 'lag_seconds')}))
+        m = primary.json('/metrics')['replication']
+        check('primary lists replicas', m is not None and len(m['replicas']) >= 1, str(m and m['replicas']))
+
+        # 主实例重启
+        primary.stop()
+        sleep(2)
+        m = proxy.json('/metrics')['replication']
+        code, _ = proxy.request('GET', '/query')
+        check('replica serves while primary is down', code == 200 and not m['connected'] and (m['lag_seconds'] or 0) >= 1,
+              f'(lag {m["lag_seconds"]} s)')
+        primary.start()
+        check('primary restarted', primary.wait_ready())
+        primary.report('phone', 'After Restart')
+        took = wait_until(lambda: proxy.json('/query')['device']['phone']['app_name'] == 'After Restart', timeout=40, interval=0.1)
+        m = proxy.json('/metrics')['replication']
+        check('replica resumes after primary restart', took is not None and m['connected'],
+              f'({took and round(took, 1)} s, {m["snapshots"]} snapshots)')
+    finally:
+        for x in replicas:
+            x.stop()
+        primary.stop()
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a primary and read-only replicas on localhost and check replication')
+    parser.add_argument('--primary', choices=('single', 'workers', 'all'), default='all', help='primary mode (default: all)')
+    args = parser.parse_args()
+
+    backup = None
+    if os.path.exists(DATA):
+        backup = tempfile.mktemp(suffix='.json')
+        shutil.copy2(DATA, backup)
+    tmp = tempfile.mkdtemp()
+    try:
+        kinds = ('single', 'workers') if args.primary == 'all' else (args.primary,)
+        results = [run(k, tmp) for k in kinds]
+    finally:
+        if backup is not None:
+            shutil.move(backup, DATA)
+        else:
+            for suffix in ('', '.bak', '.tmp'):
+                if os.path.exists(DATA + suffix):
+                    os.remove(DATA + suffix)
+        shutil.rmtree(tmp, ignore_errors=True)
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,178 @@
+# coding: utf-8
+'''
+无服务器模式模拟
+
+每次 "调用" 都在新的 Python 进程中导入 `server` 并处理几个请求 (相当于 Vercel 上的一个冷启动实例),
+实例之间只通过状态存储 (`file:` / `sqlite:`) 共享状态, 检查:
+- 一个实例写入的状态 / 设备, 之后的冷启动实例可以读到
+- 每次修改只追加少量数据, 不重写整个快照
+- 操作累计到阈值后写入新的快照
+- 没有后台定时线程, 超时离线的设备在请求中被标记
+- 同时存在的两个实例能看到对方的修改, 并发修改同一个键时各实例的结果与日志顺序一致
+- 删除 48 小时前的记录同样同步到其他实例
+
+用法:
+    python tools/serverless_sim.py                  # 测试 file 和 sqlite 两种存储
+    python tools/serverless_sim.py --store sqlite
+'''
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SECRET = 'serverless-sim'
+
+# 子进程中运行的代码: 导入 server, 依次发送请求, 输出响应
+CHILD = '''
+import json, sys, threading
+import server
+client = server.app.test_client()
+out = []
+for method, path, body in json.loads(sys.argv[1]):
+    resp = client.open(path, method=method, json=body)
+    out.append({'status': resp.status_code, 'json': resp.get_json(silent=True)})
+out.append({'threads': sorted(t.name for t in threading.enumerate())})
+print('\\n@@' + json.dumps(out))
+'''
+
+
+def invoke(store: str, requests: list, compact_ops: int = 200) -> list:
+    '''
+    启动一个 "冷启动实例" 处理请求
+
+    :param requests: [(method, path, json body)]
+    :return: 每个请求的 {'status', 'json'}, 最后一项为 {'threads'}
+    '''
+    env = dict(os.environ)
+    env.update({
+        'SLEEPY_MAIN_SERVERLESS': 'true',
+        'SLEEPY_MAIN_STATE_STORE': store,
+        'SLEEPY_MAIN_STATE_COMPACT_OPS': str(compact_ops),
+        'SLEEPY_MAIN_CHECKDATA_INTERVAL': '30',
+        'SLEEPY_SECRET': SECRET,
+        'SLEEPY_UTIL_SETTING_CHECK_INTERVAL': '0'
+    })
+    proc = subprocess.run([sys.executable, '-c', CHILD, json.dumps(requests)], cwd=ROOT, env=env, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith('@@'):
+            return json.loads(line[2:])
+    raise RuntimeError(f'instance failed:\n{proc.stdout}\n{proc.stderr}')
+
+
+def report(device_id: str, app_name: str, using: bool = True) -> tuple:
+    return ('POST', '/device/set', {'secret': SECRET, 'id': device_id, 'show_name': device_id, 'using': using, 'app_name': app_name})
+
+
+def run(kind: str) -> bool:
+    import state_store
+
+    ok = True
+
+    def check(name: str, cond: bool, detail: str = ''):
+        nonlocal ok
+        ok = ok and cond
+        print(f'[{"PASS" if cond else "FAIL"}] ({kind}) {name} {detail}')
+
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'state.db' if kind == 'sqlite' else 'state')
+    url = f'{kind}:{path}'
+    try:
+        # 1. 写入状态 / 设备, 新实例读取
+        r = invoke(url, [('GET', f'/set?secret={SECRET}&status=2', None), report('phone', 'Chrome'), report('pc', 'VSCode')])
+        check('writes accepted', all(x['status'] == 200 for x in r[:-1]))
+        check('no timer thread', not any('timer' in t.lower() for t in r[-1]['threads']), str(r[-1]['threads']))
+        r = invoke(url, [('GET', '/query', None)])
+        q = r[0]['json']
+        check('state survives cold start', q['status'] == 2 and set(q['device']) == {'phone', 'pc'} and q['device']['pc']['app_name'] == 'VSCode',
+              f'(status {q["status"]}, devices {sorted(q["device"])})')
+
+        # 2. 每次修改只追加少量数据
+        store = state_store.open_store(url)
+        before = store.read(0)
+        invoke(url, [report('phone', 'WeChat')])
+        after = store.read(before[-1][0])
+        size = sum(len(json.dumps(op, ensure_ascii=False)) for _, op in after)
+        check('report appends small ops', 0 < len(after) <= 8 and size < 4096, f'({len(after)} ops, {size} bytes)')
+
+        # 3. 操作过多时写入快照
+        invoke(url, [report('phone', f'App {i}') for i in range(30)], compact_ops=20)
+        snapshot, seq = store.load()
+        check('log compacted into snapshot', snapshot is not None and seq > 0 and len(store.read(seq)) < 20,
+              f'(snapshot seq {seq}, {len(store.read(seq))} ops after it)')
+        r = invoke(url, [('GET', '/query', None)])
+        check('state intact after compaction', r[0]['json']['device']['phone']['app_name'] == 'App 29')
+
+        # 4. 超时离线在请求中执行
+        stale = (datetime.now() - timedelta(hours=3)).astimezone().isoformat()
+        store.append([{'op': 'set', 'path': ['device_status', 'old'], 'value': {
+            'show_name': 'old', 'using': True, 'app_name': 'Old App', 'offline': False, 'updated_at': stale
+        }}])
+        r = invoke(url, [('GET', '/query', None)])
+        old = r[0]['json']['device']['old']
+        check('stale device marked offline on request', old['offline'] and not old['using'], str({k: old[k] for k in ('offline', 'using', 'app_name')}))
+        r = invoke(url, [('GET', '/query', None)])
+        check('offline marking persisted', r[0]['json']['device']['old']['offline'])
+
+        # 5. 两个同时存在的实例
+        sys.path.insert(0, ROOT)
+        import data as data_mod
+        a = data_mod.data(store=state_store.open_store(url))
+        b = data_mod.data(store=state_store.open_store(url))
+        a.dset('status', 3)
+        a.flush()
+        b.sync()
+        check('warm instances stay in sync', b.data['status'] == 3, f'(status {b.data["status"]})')
+
+        # 6. 同一个键的并发修改: 各实例都以日志中后写入的为准
+        a.dset('status', 1)
+        b.dset('status', 2)
+        b.flush()
+        a.flush()
+        a.sync()
+        b.sync()
+        fresh = data_mod.data(store=state_store.open_store(url))
+        results = [a.data['status'], b.data['status'], fresh.data['status']]
+        check('concurrent writes converge in log order', results == [1, 1, 1], f'(a / b / fresh: {results})')
+        a.dset('status', 4)
+        b.dset('status', 5)
+        b.flush()
+        a.sync()  # 在本地修改之后应用了 b 的操作
+        a.flush()
+        b.sync()
+        fresh = data_mod.data(store=state_store.open_store(url))
+        results = [a.data['status'], b.data['status'], fresh.data['status']]
+        check('sync between local write and flush converges', results == [4, 4, 4], f'(a / b / fresh: {results})')
+
+        # 7. 超过 48 小时的记录被删除时, 其他实例也删除
+        old_time = (datetime.now() - timedelta(hours=72)).astimezone().isoformat()
+        store.append([{'op': 'push', 'path': ['app_history', 'phone'], 'value': {
+            'time': old_time, 'app_name': 'Old App', 'app_name_only': 'Old App', 'app_pkg': '', 'using': True
+        }}])
+        a.sync()
+        b.sync()
+        a.record_app_usage('phone', 'New App', True)
+        a.flush()
+        b.sync()
+        lens = [len(x.data['app_history']['phone']) for x in (a, b)]
+        stale = [any(e['app_name'] == 'Old App' for e in x.data['app_history']['phone']) for x in (a, b)]
+        check('history prune replicated', lens[0] == lens[1] and not any(stale), f'(entries a / b: {lens}, old entry kept: {stale})')
+        store.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate cold serverless instances sharing a state store')
+    parser.add_argument('--store', choices=('file', 'sqlite', 'all'), default='all', help='store to test (default: all)')
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    kinds = ('file', 'sqlite') if args.store == 'all' else (args.store,)
+    results = [run(k) for k in kinds]
+    sys.exit(0 if all(results) else 1)
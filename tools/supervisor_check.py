@@ -0,0 +1,189 @@
+# coding: utf-8
+'''
+启动器 (start.py / supervisor.py) 检查
+
+在随机端口上用 start.py 启动服务, 检查:
+- 热重启 (SIGHUP) 期间持续请求, 没有连接被拒绝 / 失败的请求
+- 热重启前未保存的修改 (/set) 在重启后仍然存在
+- 子进程被强制结束后自动重启
+- 守护进程收到 SIGTERM 时子进程保存数据后退出
+- 子进程启动即崩溃时, 按退避重启并在达到次数后停止
+
+用法:
+    python tools/supervisor_check.py
+
+> 会使用主程序目录下的 data.json, 结束后恢复原来的内容 (仅支持 Linux / macOS)
+'''
+import os
+import re
+import sys
+import json
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import subprocess
+import http.client
+from time import sleep, perf_counter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DATA = os.path.join(ROOT, 'data.json')
+SECRET = 'supervisor-check'
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Launcher:
+    '''
+    运行 start.py, 在后台读取输出
+    '''
+
+    def __init__(self, port: int, *args):
+        env = dict(os.environ)
+        env.update({
+            'SLEEPY_MAIN_HOST': '127.0.0.1',
+            'SLEEPY_MAIN_PORT': str(port),
+            'SLEEPY_SECRET': SECRET,
+            'SLEEPY_MAIN_CHECKDATA_INTERVAL': '3600',  # 不定时保存, 检查退出时的保存
+            'PYTHONUNBUFFERED': '1'
+        })
+        self.port = port
+        self.proc = subprocess.Popen([sys.executable, '-u', os.path.join(ROOT, 'start.py'), *args], cwd=ROOT, env=env,
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        self.lines: list = []
+        self.children: list = []
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.proc.stdout:
+            self.lines.append(line.rstrip())
+            m = re.search(r'started server #\d+ \(pid (\d+)\)', line)
+            if m:
+                self.children.append(int(m.group(1)))
+
+    def wait_for(self, pattern: str, timeout: float = 30) -> bool:
+        deadline = perf_counter() + timeout
+        while perf_counter() < deadline:
+            if any(re.search(pattern, line) for line in self.lines):
+                return True
+            sleep(0.05)
+        return False
+
+    def get(self, path: str, timeout: float = 10):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+        try:
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            return resp.status, json.loads(resp.read() or b'null')
+        finally:
+            conn.close()
+
+    def wait_ready(self, timeout: float = 30) -> bool:
+        deadline = perf_counter() + timeout
+        while perf_counter() < deadline:
+            try:
+                if self.get('/query', timeout=2)[0] == 200:
+                    return True
+            except OSError:
+                sleep(0.1)
+        return False
+
+
+def main() -> bool:
+    ok = True
+
+    def check(name: str, cond: bool, detail: str = ''):
+        nonlocal ok
+        ok = ok and cond
+        print(f'[{"PASS" if cond else "FAIL"}] {name} {detail}')
+
+    backup = None
+    if os.path.exists(DATA):
+        backup = tempfile.mktemp(suffix='.json')
+        shutil.copy2(DATA, backup)
+    tmp = tempfile.mkdtemp()
+    launcher = None
+    try:
+        launcher = Launcher(free_port(), '--backoff', '0.2')
+        check('server started', launcher.wait_ready())
+
+        # 热重启: 持续请求, 统计失败次数
+        launcher.get(f'/set?secret={SECRET}&status=2')
+        stop = threading.Event()
+        stats = {'ok': 0, 'failed': 0, 'errors': set()}
+
+        def hammer():
+            while not stop.is_set():
+                try:
+                    code, _ = launcher.get('/query')
+                    stats['ok' if code == 200 else 'failed'] += 1
+                except OSError as e:
+                    stats['failed'] += 1
+                    stats['errors'].add(type(e).__name__)
+
+        threads = [threading.Thread(target=hammer) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for i in range(2):
+            sleep(0.5)
+            before = len([line for line in launcher.lines if 'handed over' in line])
+            os.kill(launcher.proc.pid, signal.SIGHUP)
+            deadline = perf_counter() + 30
+            while len([line for line in launcher.lines if 'handed over' in line]) == before and perf_counter() < deadline:
+                sleep(0.05)
+            check(f'warm restart #{i + 1}', perf_counter() < deadline)
+        sleep(0.5)
+        stop.set()
+        for t in threads:
+            t.join()
+        handovers = [line for line in launcher.lines if 'handed over' in line]
+        check('no failed requests during restarts', stats['failed'] == 0 and len(handovers) >= 2,
+              f'({stats["ok"]} ok, {stats["failed"]} failed {sorted(stats["errors"])}, {len(handovers)} handovers)')
+        code, q = launcher.get('/query')
+        check('unsaved state handed over', q['status'] == 2, f'(status {q["status"]})')
+
+        # 子进程崩溃后重启
+        before = len(launcher.children)
+        os.kill(launcher.children[-1], signal.SIGKILL)
+        check('restarted after crash', launcher.wait_for(r'restarting in', 10) and launcher.wait_ready()
+              and len(launcher.children) == before + 1)
+
+        # SIGTERM: 保存数据后退出
+        launcher.get(f'/set?secret={SECRET}&status=3')
+        launcher.proc.send_signal(signal.SIGTERM)
+        code = launcher.proc.wait(30)
+        with open(DATA, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        check('final flush on SIGTERM', code == 0 and saved['status'] == 3, f'(exit code {code}, saved status {saved["status"]})')
+
+        # 崩溃循环
+        broken = os.path.join(tmp, 'broken.py')
+        with open(broken, 'w', encoding='utf-8') as f:
+            f.write('import sys\nsys.exit(3)\n')
+        start = perf_counter()
+        crash = Launcher(free_port(), '--server', broken, '--backoff', '0.05', '--crash-limit', '4', '--crash-window', '30')
+        code = crash.proc.wait(30)
+        elapsed = perf_counter() - start
+        delays = [float(m) for line in crash.lines for m in re.findall(r'restarting in ([\d.]+)s', line)]
+        check('crash loop detected', code == 1 and len(crash.children) == 4 and delays == sorted(delays) and delays[-1] > delays[0],
+              f'(exit code {code}, {len(crash.children)} starts, delays {delays}, {elapsed:.1f} s)')
+    finally:
+        if launcher is not None and launcher.proc.poll() is None:
+            launcher.proc.kill()
+        if backup is not None:
+            shutil.move(backup, DATA)
+        else:
+            for suffix in ('', '.bak', '.tmp'):
+                if os.path.exists(DATA + suffix):
+                    os.remove(DATA + suffix)
+        shutil.rmtree(tmp, ignore_errors=True)
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,238 @@
+# coding: utf-8
+'''
+轻量的请求耗时追踪 (span)
+
+- 每个请求按采样率决定是否追踪, 追踪信息存放在线程局部变量中
+- 代码中使用 `with tracing.span('name'):` 或 `@tracing.traced('name')` 标注阶段,
+  未被采样的请求只有一次线程局部变量读取的开销
+- 请求结束后追踪结果进入内存环形缓冲区 (`recent()`), 可选追加写入 Chrome trace-event json 文件
+'''
+import os
+import json
+import random
+import threading
+from time import perf_counter, time
+from datetime import datetime
+from collections import deque
+from functools import wraps
+
+import env
+import utils as u
+
+_local = threading.local()
+_ring: deque = deque(maxlen=max(1, env.util.trace_ring_size))
+_file_lock = threading.Lock()
+
+
+class _Trace:
+    '''
+    单个请求的追踪
+    '''
+    __slots__ = ('name', 'wall', 'start', 'spans', 'depth', 'tid')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.wall = time()
+        self.start = perf_counter()
+        self.spans = []  # (name, start_offset, duration, depth)
+        self.depth = 0
+        self.tid = threading.get_ident()
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start', 'depth')
+
+    def __init__(self, trace: _Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.depth = self.trace.depth
+        self.trace.depth += 1
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = perf_counter()
+        tr = self.trace
+        tr.depth -= 1
+        tr.spans.append((self.name, self.start - tr.start, end - self.start, self.depth))
+        return False
+
+
+class _NullSpan:
+    '''
+    未采样时使用的空 span
+    '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def start(name: str, sample_rate: float = None) -> bool:
+    '''
+    开始追踪当前线程中的请求 (按采样率)
+
+    :param name: 追踪名称 (一般为 `方法 路径`)
+    :param sample_rate: 采样率 (0-1), 默认使用 `env.util.trace_sample_rate`
+    :return: 是否被采样
+    '''
+    rate = env.util.trace_sample_rate if sample_rate is None else sample_rate
+    if rate > 0 and (rate >= 1 or random.random() < rate):
+        _local.trace = _Trace(name)
+        return True
+    _local.trace = None
+    return False
+
+
+def active() -> bool:
+    return getattr(_local, 'trace', None) is not None
+
+
+def span(name: str):
+    '''
+    标注一个阶段, 用法: `with tracing.span('save'): ...`
+    '''
+    tr = getattr(_local, 'trace', None)
+    if tr is None:
+        return _NULL_SPAN
+    return _Span(tr, name)
+
+
+def traced(name: str = None):
+    '''
+    修饰器版本的 `span()`, 默认使用函数名作为阶段名
+    '''
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            tr = getattr(_local, 'trace', None)
+            if tr is None:
+                return func(*args, **kwargs)
+            with _Span(tr, span_name):
+                return func(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def finish(status: int = None) -> dict:
+    '''
+    结束当前线程的追踪, 结果写入环形缓冲区 (和 trace 文件)
+
+    :param status: 响应状态码
+    :return: 追踪记录 (未在追踪则返回 None)
+    '''
+    tr = getattr(_local, 'trace', None)
+    if tr is None:
+        return None
+    _local.trace = None
+    total = perf_counter() - tr.start
+
+    spans = sorted(tr.spans, key=lambda s: s[1])
+    breakdown = {}
+    for name, _, dur, depth in spans:
+        breakdown[name] = breakdown.get(name, 0) + dur
+    # 顶层 span 之外的耗时 (路由本身 / 序列化等)
+    other = total - sum(s[2] for s in spans if s[3] == 0)
+    record = {
+        'name': tr.name,
+        'time': datetime.fromtimestamp(tr.wall).isoformat(timespec='milliseconds'),
+        'status': status,
+        'duration_ms': round(total * 1000, 3),
+        'breakdown_ms': {**{k: round(v * 1000, 3) for k, v in breakdown.items()}, '(other)': round(max(0, other) * 1000, 3)},
+        'spans': [
+            {'name': name, 'start_ms': round(st * 1000, 3), 'duration_ms': round(dur * 1000, 3), 'depth': depth}
+            for name, st, dur, depth in spans
+        ],
+        '_tid': tr.tid,
+        '_ts': tr.wall
+    }
+    _ring.append(record)
+    if env.util.trace_file:
+        try:
+            _write_chrome([record])
+        except Exception as e:
+            u.warning(f'[tracing] failed to write trace file: {e}')
+    return record
+
+
+def recent(limit: int = 50, name: str = None) -> list:
+    '''
+    获取最近的追踪记录 (新的在前)
+
+    :param limit: 最多返回多少条
+    :param name: 仅返回名称包含此字符串的记录
+    '''
+    ret = []
+    for rec in reversed(list(_ring)):
+        if name and name not in rec['name']:
+            continue
+        ret.append({k: v for k, v in rec.items() if not k.startswith('_')})
+        if len(ret) >= limit:
+            break
+    return ret
+
+
+def summary(name: str = None) -> dict:
+    '''
+    汇总环形缓冲区中各阶段的平均 / 最大耗时 (毫秒)
+    '''
+    agg = {}
+    for rec in list(_ring):
+        if name and name not in rec['name']:
+            continue
+        for k, v in rec['breakdown_ms'].items():
+            a = agg.setdefault(k, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            a['count'] += 1
+            a['total_ms'] += v
+            a['max_ms'] = max(a['max_ms'], v)
+    return {
+        k: {'count': a['count'], 'avg_ms': round(a['total_ms'] / a['count'], 3), 'max_ms': round(a['max_ms'], 3)}
+        for k, a in sorted(agg.items(), key=lambda x: -x[1]['total_ms'])
+    }
+
+
+def chrome_events(records: list = None) -> list:
+    '''
+    转换为 Chrome trace-event 格式 (可在 chrome://tracing 或 Perfetto 中打开)
+    '''
+    if records is None:
+        records = list(_ring)
+    pid = os.getpid()
+    events = []
+    for rec in records:
+        base = rec['_ts'] * 1e6
+        tid = rec['_tid']
+        events.append({
+            'name': rec['name'], 'ph': 'X', 'ts': round(base, 1), 'dur': round(rec['duration_ms'] * 1000, 1),
+            'pid': pid, 'tid': tid, 'args': {'status': rec['status']}
+        })
+        for s in rec['spans']:
+            events.append({
+                'name': s['name'], 'ph': 'X', 'ts': round(base + s['start_ms'] * 1000, 1),
+                'dur': round(s['duration_ms'] * 1000, 1), 'pid': pid, 'tid': tid
+            })
+    return events
+
+
+def _write_chrome(records: list):
+    '''
+    追加写入 trace 文件 (JSON Array Format, 结尾的 `]` 可省略, Chrome 可直接打开)
+    '''
+    path = u.get_path(env.util.trace_file)
+    with _file_lock:
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, 'a', encoding='utf-8') as f:
+            if new:
+                f.write('[\n')
+            for ev in chrome_events(records):
+                f.write(json.dumps(ev, ensure_ascii=False) + ',\n')
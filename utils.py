@@ -18,6 +18,8 @@ except Exception:
 
 from pathlib import Path
 import os
+import importlib
+import threading
 
 from _utils import *
 from env import main as mainenv
@@ -110,12 +112,12 @@ def list_dir(path: str, include_subfolder: bool = True, strict_exist: bool = Fal
     '''
 
     try:
-        filelst = os.listdir(path)
-        for i in filelst:
+        # 不在遍历时修改列表 (会跳过紧随文件夹之后的项)
+        filelst = []
+        for i in os.listdir(path):
             fullname_i = Path(path).joinpath(i)
             if os.path.isdir(fullname_i):
                 # 为文件夹
-                filelst.remove(i)
                 if include_subfolder:
                     filelst.extend([
                         i + n if i.endswith('/') or i.endswith('\\') else i + '/' + n
@@ -126,6 +128,8 @@ def list_dir(path: str, include_subfolder: bool = True, strict_exist: bool = Fal
                             ext=ext
                         )
                     ])
+            else:
+                filelst.append(i)
     except FileNotFoundError:
         # 找不到目标文件夹
         if strict_exist:
@@ -141,3 +145,40 @@ def list_dir(path: str, include_subfolder: bool = True, strict_exist: bool = Fal
             return newlst
         else:
             return filelst
+
+
+class LazyModule:
+    '''
+    延迟导入的模块: 第一次访问其属性时才真正导入
+    '''
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r} ({"loaded" if self._module is not None else "not loaded"})>'
+
+
+def lazy_import(name: str) -> LazyModule:
+    '''
+    延迟导入模块 (用于启动时不一定用到的可选功能, 如 Pillow / requests), 减少冷启动耗时
+
+    :param name: 模块名
+    '''
+    return LazyModule(name)